@@ -267,6 +267,46 @@ class Admin(commands.Cog):
         data = BS(bytes_.decode("utf-8"), "lxml")
         await ctx.send(file=discord.File(BytesIO(data.prettify().encode("utf-8")), filename="data.html"))
 
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def waiters(self, ctx):
+        router = self.bot.event_router
+        stats = "\n".join((f"{event: <24}{count}" for event, count in router.stats().most_common()))
+        await ctx.send(
+            f"```\n{stats}\n\n"
+            f"{'total': <24}{router.live_waiters}\n"
+            f"{'dispatched': <24}{router.dispatched}\n"
+            f"{'resolved': <24}{router.resolved}\n```"
+        )
+
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def httpcache(self, ctx, clear=None):
+        cache = self.bot.http_cache
+        if clear == "clear":
+            cache.clear()
+        await ctx.send(
+            f"```\n{'entries': <16}{len(cache.container)}\n"
+            f"{'memory': <16}{cache.current_size/1024/1024:.2f}MB\n"
+            f"{'hits': <16}{cache.hits}\n"
+            f"{'revalidated': <16}{cache.revalidated}\n"
+            f"{'misses': <16}{cache.misses}\n"
+            f"{'stores': <16}{cache.stores}\n"
+            f"{'hit rate': <16}{cache.hit_rate:.2%}\n```"
+        )
+
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def executors(self, ctx):
+        lines = [f"{'pool': <8}{'size': >5}{'run': >5}{'queue': >6}{'peak': >6}{'done': >8}{'reject': >7}{'wait': >9}{'run': >9}"]
+        for name, pool in self.bot.executors.items():
+            s = pool.stats()
+            lines.append(
+                f"{name: <8}{s['size']: >5}{s['running']: >5}{s['queued']: >6}{s['peak_queue']: >6}{s['submitted']: >8}{s['rejected']: >7}"
+                f"{s['avg_wait']*1000: >7.1f}ms{s['avg_run']*1000: >7.1f}ms"
+            )
+        await ctx.send("```\n{}\n```".format("\n".join(lines)))
+
     @commands.command(hidden=True)
     @checks.owner_only()
     async def growth(self, ctx, limit: int=10):
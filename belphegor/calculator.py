@@ -9,9 +9,16 @@ import asyncio
 import random
 import time
 import functools
+import math
 import sympy
 from datetime import datetime, timedelta
 import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import resource
+except ImportError:
+    resource = None
 
 #==================================================================================================================================================
 
@@ -22,6 +29,34 @@ INF = sympy.oo
 NAN = sympy.nan
 ZINF = sympy.zoo
 SPECIAL_NUMBERS = (INF, -INF, NAN, ZINF)
+SIGMA_MAX_DEGREE = 20
+
+CALC_WORKERS = 2
+CALC_TIMEOUT = 10
+CALC_CPU_LIMIT = 10
+CALC_MEMORY_LIMIT = 1024 * 1024 * 1024
+CALC_MAX_TASKS = 200
+
+BENCHMARK_CORPUS = (
+    "2*3+4",
+    "1+2+3+4+5+6+7+8+9+10",
+    "(15-4)*3//2",
+    "2^64 - 1",
+    "100!",
+    "200C100",
+    "7/2",
+    "22/7 - 3",
+    "gcd(1071, 462) + lcm(4, 6)",
+    "hex: ff * 10",
+    "bin: 1011 + 110",
+    "abs(-42) % 5",
+    "n = counter\nsigma(n, 1, 100)(n^2)",
+    "f(x) = x^2 + 2x + 1\nf(3) + f(4)",
+    "sqrt(2)",
+    "sin(pi/6) + cos(pi/3)",
+    "1.5 * 4",
+    "e^(i*pi)"
+)
 
 #==================================================================================================================================================
 
@@ -41,7 +76,12 @@ cls.__le__ = always_false
 
 #==================================================================================================================================================
 
+def is_symbolic(number):
+    return bool(getattr(number, "free_symbols", None))
+
 def maybe_int(number):
+    if type(number) is int or is_symbolic(number):
+        return number
     ret = []
     for n in (sympy.re(number), sympy.im(number)):
         if n in SPECIAL_NUMBERS:
@@ -55,11 +95,80 @@ def maybe_int(number):
         ret.append(r)
     return ret[0] + ret[1] * sympy.I
 
+def _all_int(args):
+    return all(type(a) is int for a in args)
+
+def _promote(number):
+    if type(number) is int:
+        return sympy.Integer(number)
+    else:
+        return number
+
+def true_divide(a, b):
+    if type(a) is int and type(b) is int and b != 0:
+        q, r = divmod(a, b)
+        if r == 0:
+            return q
+        else:
+            return sympy.Rational(a, b)
+    else:
+        return _promote(a) / _promote(b)
+
+def floor_divide(a, b):
+    if type(a) is int and type(b) is int and b != 0:
+        return a // b
+    else:
+        return _promote(a) // _promote(b)
+
+def modulo(a, b):
+    if type(a) is int and type(b) is int and b != 0:
+        return a % b
+    else:
+        return _promote(a) % _promote(b)
+
+def power(a, b):
+    if type(a) is int and type(b) is int and b >= 0:
+        return a ** b
+    else:
+        return pow(_promote(a), _promote(b))
+
+def factorial(number):
+    if type(number) is int and number >= 0:
+        return math.factorial(number)
+    else:
+        return sympy.factorial(_promote(number))
+
+def binomial(n, k):
+    if type(n) is int and type(k) is int and 0 <= k <= n:
+        return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+    else:
+        return sympy.binomial(_promote(n), _promote(k))
+
+def absolute(number):
+    if type(number) is int:
+        return abs(number)
+    else:
+        return sympy.Abs(number)
+
+def floor(number):
+    if type(number) is int:
+        return number
+    else:
+        return sympy.floor(number)
+
+def ceiling(number):
+    if type(number) is int:
+        return number
+    else:
+        return sympy.ceiling(number)
+
 def greatest_common_factor(*args):
     if len(args) < 2:
         raise CommonParseError
+    elif _all_int(args):
+        return functools.reduce(math.gcd, args)
     else:
-        result = args[0]
+        result = _promote(args[0])
         for i in args[1:]:
             result = result.gcd(i)
 
@@ -68,8 +177,10 @@ def greatest_common_factor(*args):
 def least_common_multiple(*args):
     if len(args) < 2:
         raise CommonParseError
+    elif _all_int(args):
+        return functools.reduce(lambda a, b: a // math.gcd(a, b) * b, args)
     else:
-        result = args[0]
+        result = _promote(args[0])
         for i in args[1:]:
             result = result.lcm(i)
 
@@ -91,7 +202,10 @@ def radians(deg):
         raise CommonParseError
 
 def round_float(number):
-    return number.round()
+    if type(number) is int:
+        return number
+    else:
+        return number.round()
 
 #==================================================================================================================================================
 
@@ -127,7 +241,7 @@ class Reduce:
             raise ParseError(f"{self.__class__.__name__} max range is {self.MAX_RANGE}.")
         if func.reduce:
             raise ParseError("Nested reduce/sigma is not accepted.")
-        if isinstance(from_, sympy.Integer) and isinstance(to_, sympy.Integer):
+        if isinstance(from_, (int, sympy.Integer)) and isinstance(to_, (int, sympy.Integer)):
             pass
         else:
             raise ParseError("From/to must be integers.")
@@ -142,12 +256,29 @@ class Reduce:
 class Sigma(Reduce):
     MAX_RANGE = 1000
 
+    def closed_form(self):
+        if not self.func.compiled:
+            return None
+        k = sympy.Dummy(integer=True)
+        try:
+            body = self.func.compiled({self.func.args[0]: k})
+            if not isinstance(body, sympy.Expr) or body.has(sympy.Float) or not body.is_polynomial(k) or sympy.degree(body, k) > SIGMA_MAX_DEGREE:
+                return None
+        except Exception:
+            return None
+        return sympy.summation(body, (k, min(self.from_, self.to_), max(self.from_, self.to_)))
+
     def __call__(self):
-        return sum(self.func(k) for k in range(self.from_, self.to_+self.delta, self.delta))
+        result = self.closed_form()
+        if result is None:
+            return sum(self.func(k) for k in range(self.from_, self.to_+self.delta, self.delta))
+        else:
+            return result
 
 #==================================================================================================================================================
 
 class BaseParse:
+    NUMERIC_TIER = True
     MAX_POWER_LOG = 300
     MAX_FACTORIAL = 100
 
@@ -157,9 +288,9 @@ class BaseParse:
     }
     OPS = {
         "*":        operator.mul,
-        "/":        operator.truediv,
-        "//":       operator.floordiv,
-        "%":        operator.mod
+        "/":        true_divide,
+        "//":       floor_divide,
+        "%":        modulo
     }
     FUNCS = {
         "sin":      sympy.sin,
@@ -179,7 +310,7 @@ class BaseParse:
         "sqrt":     sympy.sqrt,
         "cbrt":     cube_root,
         "root":     sympy.real_root,
-        "abs":      sympy.Abs,
+        "abs":      absolute,
         "sign":     sympy.sign,
         "sgn":      sympy.sign,
         "gcd":      greatest_common_factor,
@@ -189,15 +320,15 @@ class BaseParse:
         "min":      min,
         "conj":     sympy.conjugate,
         "gamma":    sympy.gamma,
-        "floor":    sympy.floor,
-        "ceil":     sympy.ceiling,
+        "floor":    floor,
+        "ceil":     ceiling,
         "round":    round_float
     }
     SPECIAL_OPS = {
-        "^":        pow,
-        "**":       pow,
-        "!":        sympy.factorial,
-        "C":        sympy.binomial,
+        "^":        power,
+        "**":       power,
+        "!":        factorial,
+        "C":        binomial,
         "°":        radians,
         "deg":      radians
     }
@@ -323,7 +454,10 @@ class BaseParse:
             self.next()
         n = "".join(get_it)
         if is_int:
-            return sympy.Integer(int(n, self.base))
+            if self.NUMERIC_TIER:
+                return int(n, self.base)
+            else:
+                return sympy.Integer(int(n, self.base))
         else:
             return maybe_int(sympy.Float(n, PRECISION))
 
@@ -679,6 +813,226 @@ class MathFunction(BaseParse):
                 self.tokens.append((n, self.current_index))
         self.parse_next = self.next_token
 
+        self.compiled = None
+        if not self.reduce:
+            try:
+                self.compiled = self.compile()
+            except Exception:
+                self.compiled = None
+
+    def compile(self):
+        self.token_position = -1
+        self.current_parse = None
+        result = self.compile_level()
+        if self.current_parse is not None:
+            raise CommonParseError
+        return result
+
+    def compile_next(self):
+        self.token_position += 1
+        try:
+            n = self.tokens[self.token_position]
+        except IndexError:
+            self.current_parse = None
+        else:
+            self.current_index = n[1]
+            self.current_parse = n[0]
+        return self.current_parse
+
+    def compile_level(self):
+        start = self.current_parse
+        end, func = self.ENCLOSED[start]
+        self.compile_next()
+        terms = []
+        sign = 1
+        while True:
+            n = self.current_parse
+            if n == end:
+                break
+            elif n in self.CLOSED:
+                raise ParseError("No closing bracket.")
+            elif n in self.SIGNS:
+                sign = sign * self.SIGNS[n]
+                self.compile_next()
+            else:
+                terms.append((sign, self.compile_group()))
+                sign = 1
+        self.compile_next()
+
+        def level(env):
+            result = None
+            for sign, group in terms:
+                r = sign * group(env)
+                if result is None:
+                    result = r
+                else:
+                    result = result + r
+            return func(result)
+        return level
+
+    def compile_group(self):
+        steps = []
+        last_op = None
+        while True:
+            n = self.current_parse
+            if n in self.SIGNS or n in self.CLOSED or n in self.SIGNALS:
+                if last_op:
+                    raise CommonParseError
+                break
+            elif n in self.OPS.values():
+                if last_op or not steps:
+                    raise CommonParseError
+                last_op = n
+                self.compile_next()
+            else:
+                steps.append((last_op or self.OPS["*"], self.compile_next_value()))
+                last_op = None
+
+        first = steps[0][1]
+        rest = steps[1:]
+
+        def group(env):
+            result = first(env)
+            for op, value in rest:
+                result = op(result, value(env))
+            return result
+        return group
+
+    def compile_next_value(self):
+        n = self.current_parse
+        if n in self.FUNCS.values():
+            result = self.compile_function()
+        elif n in self.user_functions.values():
+            self.compile_next()
+            args = self.compile_func_args()
+            result = lambda env: n(*(a(env) for a in args))
+        elif n in self.ENCLOSED:
+            result = self.compile_level()
+        elif n in self.SIGNS:
+            self.compile_next()
+            sign = self.SIGNS[n]
+            value = self.compile_next_value()
+            result = lambda env: sign * value(env)
+        elif isinstance(n, NoValue):
+            default = self.user_variables.get(n.var, n)
+            result = lambda env: env.get(n.var, default)
+            self.compile_next()
+        else:
+            result = lambda env: n
+            self.compile_next()
+        return self.compile_special(result)
+
+    def compile_special(self, get_value):
+        c = self.current_parse
+        if c == self.SPECIAL_OPS["!"]:
+            def special(env):
+                value = get_value(env)
+                if value in SPECIAL_NUMBERS:
+                    return c(value)
+                elif value > self.MAX_FACTORIAL:
+                    raise ParseError(f"Limit for factorial is {self.MAX_FACTORIAL}!")
+                elif value < 0:
+                    raise ParseError("Can't factorial negetive number.")
+                elif sympy.Integer(value) == value:
+                    return c(value)
+                else:
+                    raise ParseError("Can't factorial non-integer.")
+            self.compile_next()
+            return self.compile_special(special)
+        elif c == self.SPECIAL_OPS["^"]:
+            self.compile_next()
+            get_power = self.compile_next_value()
+            max_power = self.max_power
+            def special(env):
+                value = get_value(env)
+                p = get_power(env)
+                if is_symbolic(value) or is_symbolic(p):
+                    return c(value, p)
+                r = sympy.re(p)
+                v = sympy.re(value)
+                if v == 0 or v in SPECIAL_NUMBERS or r in SPECIAL_NUMBERS or r * log10(sympy.Abs(value)) < max_power:
+                    return c(value, p)
+                else:
+                    raise ParseError(f"Limit for power in base {self.base} is 10^{sympy.Integer(max_power)}")
+            return special
+        elif c == self.SPECIAL_OPS["C"]:
+            self.compile_next()
+            get_k = self.compile_next_value()
+            def special(env):
+                value = get_value(env)
+                k = get_k(env)
+                if value in SPECIAL_NUMBERS:
+                    return c(value, k)
+                elif value > 2 * self.MAX_FACTORIAL:
+                    raise ParseError(f"Limit for combination is n <= {2*self.MAX_FACTORIAL}")
+                else:
+                    return c(value, k)
+            return special
+        elif c == self.SPECIAL_OPS["°"]:
+            self.compile_next()
+            return self.compile_special(lambda env: c(get_value(env)))
+        else:
+            return get_value
+
+    def compile_function(self):
+        f = self.current_parse
+        n = self.compile_next()
+        if n in self.ENCLOSED:
+            args = self.compile_func_args()
+            return lambda env: f(*(a(env) for a in args))
+        else:
+            value = self.compile_next_value()
+            return lambda env: f(value(env))
+
+    def compile_func_args(self):
+        if self.current_parse != "(":
+            raise CommonParseError
+
+        self.compile_next()
+        result = []
+        sign = 1
+        terms = []
+
+        def make_arg(terms):
+            def arg(env):
+                cur = None
+                for sign, group in terms:
+                    r = sign * group(env)
+                    if cur is None:
+                        cur = r
+                    else:
+                        cur = cur + r
+                return maybe_int(cur)
+            return arg
+
+        while True:
+            n = self.current_parse
+            if n == ")":
+                if not terms:
+                    if len(result) > 0:
+                        raise CommonParseError
+                else:
+                    result.append(make_arg(terms))
+                break
+            elif n in self.CLOSED:
+                raise ParseError("No closing bracket.")
+            elif n in self.SIGNS:
+                sign = sign * self.SIGNS[n]
+                self.compile_next()
+            elif n in self.SIGNALS:
+                if not terms:
+                    raise CommonParseError
+                result.append(make_arg(terms))
+                terms = []
+                sign = 1
+                self.compile_next()
+            else:
+                terms.append((sign, self.compile_group()))
+                sign = 1
+
+        self.compile_next()
+        return result
+
     def next_token(self):
         try:
             n = next(self.token_iter)
@@ -697,6 +1051,13 @@ class MathFunction(BaseParse):
     def __call__(self, *args):
         if len(args) != len(self.args):
             raise ParseError("Number of arguments does not match.")
+        if self.compiled:
+            try:
+                return self.compiled(dict(zip(self.args, args)))
+            except Exception as e:
+                if not hasattr(e, "target"):
+                    e.target = self
+                raise
         for i, a in enumerate(self.args):
             self.user_variables[a] = args[i]
 
@@ -863,6 +1224,224 @@ class MathParse(BaseParse):
 
 #==================================================================================================================================================
 
+def dump_state(parser):
+    functions = []
+    indexes = {}
+
+    def dump_function(func):
+        key = id(func)
+        if key not in indexes:
+            deps = {name: dump_function(f) for name, f in func.user_functions.items()}
+            functions.append((func.text, tuple(func.args), func.base, dict(func.user_variables), deps))
+            indexes[key] = len(functions) - 1
+        return indexes[key]
+
+    user_functions = {name: dump_function(f) for name, f in parser.user_functions.items()}
+    return {"variables": dict(parser.user_variables), "functions": functions, "user_functions": user_functions}
+
+def load_state(parser, state):
+    built = []
+    for text, args, base, variables, deps in state["functions"]:
+        built.append(MathFunction(text, args, variables=variables, functions={name: built[i] for name, i in deps.items()}, base=base))
+    parser.user_variables.update(state["variables"])
+    parser.user_functions.update({name: built[i] for name, i in state["user_functions"].items()})
+
+def evaluate(text, state=None):
+    m = MathParse(text)
+    if state:
+        load_state(m, state)
+    try:
+        results = m.result()
+    except Exception as e:
+        e.log = m.log()
+        if getattr(e, "target", None) is None:
+            #some errors are raised straight from result() without a target, show the whole input like before
+            e.target = m
+        raise
+    return results, dump_state(m), m.log()
+
+def solve_polynomial(text, names, template, keep):
+    input = MathParse(text)
+    try:
+        input.result()
+    except Exception:
+        raise ParseError("Calculation error. Please double check your input.")
+    coefficients = {i: input.user_variables.get(i, 0) for i in names}
+    if coefficients["a"] == 0:
+        raise ParseError("Coefficient `a` must be non-zero.")
+    solution = MathParse(template)
+    solution.user_variables.update(coefficients)
+    return solution.result()[-keep:]
+
+def benchmark(corpus=BENCHMARK_CORPUS, repeat=20):
+    report = []
+    try:
+        for text in corpus:
+            timing = {}
+            outputs = {}
+            for tier in (False, True):
+                BaseParse.NUMERIC_TIER = tier
+                start = time.perf_counter()
+                for i in range(repeat):
+                    outputs[tier] = MathParse(text).result()
+                timing[tier] = (time.perf_counter() - start) / repeat
+            report.append((text, timing[False], timing[True], outputs[False] == outputs[True]))
+    finally:
+        BaseParse.NUMERIC_TIER = True
+    return report
+
+def _set_soft_limit(kind, value):
+    soft, hard = resource.getrlimit(kind)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(kind, (value, hard))
+
+def _worker_main(conn, memory_limit, cpu_limit):
+    if resource and memory_limit:
+        _set_soft_limit(resource.RLIMIT_AS, memory_limit)
+    conn.send(None)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args = task
+        if resource and cpu_limit:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            _set_soft_limit(resource.RLIMIT_CPU, int(usage.ru_utime + usage.ru_stime) + cpu_limit + 1)
+        start = time.perf_counter()
+        try:
+            ret = func(*args)
+        except Exception as e:
+            target = getattr(e, "target", None)
+            try:
+                display = target.show_parse_error() if target else ""
+            except Exception:
+                display = ""
+            reply = (False, {"kind": type(e).__name__, "message": str(e), "display": display, "log": getattr(e, "log", ""), "traceback": traceback.format_exc()})
+        else:
+            reply = (True, ret)
+        conn.send((*reply, time.perf_counter() - start))
+
+class CalculatorError(Exception):
+    def __init__(self, info):
+        super().__init__(info["message"])
+        self.kind = info["kind"]
+        self.display = info["display"]
+        self.log = info["log"]
+        self.traceback = info["traceback"]
+
+class CalculatorTimeout(Exception):
+    pass
+
+class CalculatorWorker:
+    def __init__(self, context, memory_limit, cpu_limit):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit, cpu_limit), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def wait_ready(self):
+        self.conn.recv()
+
+    def receive(self, timeout):
+        if self.conn.poll(timeout):
+            return self.conn.recv()
+        else:
+            raise CalculatorTimeout
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+class CalculatorPool:
+    def __init__(self, *, workers=CALC_WORKERS, timeout=CALC_TIMEOUT, cpu_limit=CALC_CPU_LIMIT, memory_limit=CALC_MEMORY_LIMIT, max_tasks=CALC_MAX_TASKS, loop=None):
+        self.timeout = timeout
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.max_tasks = max_tasks
+        self.loop = loop or asyncio.get_event_loop()
+        self.context = multiprocessing.get_context("spawn")
+        self.waiter = ThreadPoolExecutor(workers * 2, thread_name_prefix="belphegor-calc")
+        self.workers = set()
+        self.idle = asyncio.Queue()
+        for i in range(workers):
+            self.idle.put_nowait(None)
+        self.tasks = 0
+        self.timeouts = 0
+        self.recycled = 0
+
+    def _spawn(self):
+        worker = CalculatorWorker(self.context, self.memory_limit, self.cpu_limit)
+        try:
+            worker.wait_ready()
+        except EOFError:
+            worker.kill()
+            raise
+        return worker
+
+    async def _discard(self, worker):
+        self.workers.discard(worker)
+        await self.loop.run_in_executor(self.waiter, worker.kill)
+
+    async def run(self, func, *args, timeout=None):
+        worker = await self.idle.get()
+        try:
+            if worker is None:
+                worker = await self.loop.run_in_executor(self.waiter, self._spawn)
+                self.workers.add(worker)
+            worker.conn.send((func, args))
+            try:
+                ok, ret, elapsed = await self.loop.run_in_executor(self.waiter, worker.receive, timeout or self.timeout)
+            except (CalculatorTimeout, EOFError, OSError):
+                self.timeouts += 1
+                await self._discard(worker)
+                worker = None
+                raise CalculatorTimeout
+            self.tasks += 1
+            worker.tasks += 1
+            if worker.tasks >= self.max_tasks:
+                self.recycled += 1
+                await self._discard(worker)
+                worker = None
+        except asyncio.CancelledError:
+            if worker:
+                self.workers.discard(worker)
+                #kill joins and closes the pipe too, so no zombie is left behind
+                self.loop.run_in_executor(self.waiter, worker.kill)
+                worker = None
+            raise
+        finally:
+            self.idle.put_nowait(worker)
+
+        if ok:
+            return ret, elapsed
+        else:
+            raise CalculatorError(ret)
+
+    def cleanup(self):
+        for worker in self.workers:
+            worker.kill()
+        self.workers.clear()
+        self.waiter.shutdown(wait=False)
+
+#==================================================================================================================================================
+
 class Calculator(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -874,27 +1453,12 @@ class Calculator(commands.Cog):
             del bot.enable_calc_log
 
         self.parsers = data_type.AutoCleanupDict(120, loop=bot.loop)
+        self.engine = CalculatorPool(loop=bot.loop)
 
     def cog_unload(self):
         self.bot.enable_calc_log = self.enable_log
         self.parsers.cleanup()
-
-    def time_stuff(self, func):
-        start = time.perf_counter()
-        ret = func()
-        end = time.perf_counter()
-        return ret, end-start
-
-    def get_calc(self, user_id, text):
-        try:
-            last = self.parsers[user_id]
-        except KeyError:
-            return MathParse(text)
-        else:
-            m = MathParse(text)
-            m.user_functions.update(last.user_functions)
-            m.user_variables.update(last.user_variables)
-            return m
+        self.engine.cleanup()
 
     @modding.help(brief="A calculator with input rule close to handwritten", category="Misc", field="Processing", paragraph=0)
     @commands.command(aliases=["calc"])
@@ -924,31 +1488,34 @@ class Calculator(commands.Cog):
         '''
         text = utils.clean_codeblock(text)
         l = ""
+        log = ""
         try:
-            m = self.get_calc(ctx.author.id, text)
-            results, time_taken = await self.bot.loop.run_in_executor(None, self.time_stuff, m.result)
-        except ParseError as e:
-            target = getattr(e, "target", m)
-            await ctx.send(f"{e}\n```\n{target.show_parse_error()}\n```")
-        except ZeroDivisionError:
-            await ctx.send("Division by zero.")
-        except OverflowError:
-            await ctx.send("IO number too big. U sure need this one?")
-        except ValueError as e:
-            target = getattr(e, "target", m)
-            await ctx.send(f"Calculation error.\n```\n{target.show_parse_error()}\n```")
-            l = traceback.format_exc()
-        except Exception as e:
-            target = getattr(e, "target", m)
-            await ctx.send(f"Parsing error.\n```\n{target.show_parse_error()}\n```")
-            l = traceback.format_exc()
+            (results, state, log), time_taken = await self.engine.run(evaluate, text, self.parsers.get(ctx.author.id))
+        except CalculatorTimeout:
+            await ctx.send(f"Calculation took longer than {self.engine.timeout}s and was stopped.")
+        except CalculatorError as e:
+            log = e.log
+            if e.kind == "ParseError":
+                await ctx.send(f"{e}\n```\n{e.display}\n```")
+            elif e.kind == "ZeroDivisionError":
+                await ctx.send("Division by zero.")
+            elif e.kind == "OverflowError":
+                await ctx.send("IO number too big. U sure need this one?")
+            elif e.kind == "MemoryError":
+                await ctx.send("Calculation used too much memory and was stopped.")
+            elif e.kind == "ValueError":
+                await ctx.send(f"Calculation error.\n```\n{e.display}\n```")
+                l = e.traceback
+            else:
+                await ctx.send(f"Parsing error.\n```\n{e.display}\n```")
+                l = e.traceback
         else:
-            self.parsers[ctx.author.id] = m
+            self.parsers[ctx.author.id] = state
             r = "\n".join(results)
             await ctx.send(f"Result in {1000*(time_taken):.2f}ms\n```\n{r}\n```")
         finally:
             if self.enable_log:
-                l = f"{m.log()}\n{l}"
+                l = f"{log}\n{l}"
                 try:
                     await self.bot.error_hook.execute(l)
                 except AttributeError:
@@ -964,6 +1531,22 @@ class Calculator(commands.Cog):
             self.enable_log = True
             await ctx.confirm()
 
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def calcbench(self, ctx, repeat: int=20):
+        async with ctx.typing():
+            report, time_taken = await self.engine.run(benchmark, BENCHMARK_CORPUS, repeat, timeout=60)
+        lines = [f"{'expression': <28}{'sympy': >10}{'fast': >10}{'x': >7}"]
+        total_sympy = 0
+        total_fast = 0
+        for text, sympy_time, fast_time, same in report:
+            total_sympy += sympy_time
+            total_fast += fast_time
+            expr = text.replace("\n", "; ")
+            lines.append(f"{expr[:26]: <28}{sympy_time*1000: >8.2f}ms{fast_time*1000: >8.2f}ms{sympy_time/fast_time: >6.1f}x{'' if same else ' DIFF'}")
+        lines.append(f"{'total': <28}{total_sympy*1000: >8.2f}ms{total_fast*1000: >8.2f}ms{total_sympy/total_fast: >6.1f}x")
+        await ctx.send("```\n{}\n```".format("\n".join(lines)))
+
     @modding.help(category="Misc", field="Processing", paragraph=0)
     @commands.group()
     async def solve(self, ctx):
@@ -974,6 +1557,18 @@ class Calculator(commands.Cog):
         if ctx.invoked_subcommand is None:
             pass
 
+    async def run_solve(self, ctx, stuff, names, template, keep):
+        try:
+            return await self.engine.run(solve_polynomial, stuff, names, template, keep)
+        except CalculatorTimeout:
+            await ctx.send(f"Calculation took longer than {self.engine.timeout}s and was stopped.")
+        except CalculatorError as e:
+            if e.kind == "ParseError":
+                await ctx.send(str(e))
+            else:
+                await ctx.send("Calculation error. Please double check your input.")
+        return None, None
+
     @modding.help(brief="Solve degree 2 polynominal equation", category="Misc", field="Processing", paragraph=0)
     @solve.command(aliases=["quad", "2nd"])
     async def quadratic(self, ctx, *, stuff):
@@ -984,29 +1579,21 @@ class Calculator(commands.Cog):
             Input is a serial of formulas that defined `a`, `b` and `c` (as in the equation `ax^2 + bx + c = 0`). Default to 0 if not defined.
         '''
         stuff = utils.clean_codeblock(stuff)
-        input = MathParse(stuff)
-        try:
-            r, input_time = await self.bot.loop.run_in_executor(None, self.time_stuff, input.result)
-        except:
-            return await ctx.send("Calculation error. Please double check your input.")
-        else:
-            coefficients = {i: input.user_variables.get(i, 0) for i in ("a", "b", "c")}
-            if coefficients["a"] == 0:
-                return await ctx.send("Coefficient `a` must be non-zero.")
-        solution = MathParse(
+        results, time_taken = await self.run_solve(
+            ctx, stuff, ("a", "b", "c"),
             "a = a\n"
             "b = b\n"
             "c = c\n\n"
             "Δ = b^2 - 4ac\n\n"
             "#Result\n"
             "x1 = (-b + sqrt(Δ))/(2a)\n"
-            "x2 = (-b - sqrt(Δ))/(2a)"
+            "x2 = (-b - sqrt(Δ))/(2a)",
+            9
         )
-        solution.user_variables.update(coefficients)
-        results, solution_time = await self.bot.loop.run_in_executor(None, self.time_stuff, solution.result)
-        r = "\n".join(results[-9:])
+        if results is None:
+            return
+        r = "\n".join(results)
         r = f"ax^2 + bx + c = 0\n{r}"
-        time_taken = input_time + solution_time
         await ctx.send(f"Result in {1000*(time_taken):.2f}ms\n```\n{r}\n```")
 
     @modding.help(brief="Solve degree 3 polynominal equation", category="Misc", field="Processing", paragraph=0)
@@ -1019,16 +1606,8 @@ class Calculator(commands.Cog):
             Input is a serial of formulas that defined `a`, `b`, `c` and `d` (as in the equation `ax^3 + bx^2 + cx + d = 0`). Default to 0 if not defined.
         '''
         stuff = utils.clean_codeblock(stuff)
-        input = MathParse(stuff)
-        try:
-            r, input_time = await self.bot.loop.run_in_executor(None, self.time_stuff, input.result)
-        except:
-            return await ctx.send("Calculation error. Please double check your input.")
-        else:
-            coefficients = {i: input.user_variables.get(i, 0) for i in ("a", "b", "c", "d")}
-            if coefficients["a"] == 0:
-                return await ctx.send("Coefficient `a` must be non-zero.")
-        solution = MathParse(
+        results, time_taken = await self.run_solve(
+            ctx, stuff, ("a", "b", "c", "d"),
             "ζ1 = -1/2 + sqrt(3)/2 * i\n"
             "ζ2 = -1/2 - sqrt(3)/2 * i\n"
             "a = a\n"
@@ -1042,13 +1621,13 @@ class Calculator(commands.Cog):
             "#Result\n"
             "x1 = -(b + C1 + C2)/(3a)\n"
             "x2 = -(b + C1 * ζ1 + C2 / ζ1)/(3a)\n"
-            "x3 = -(b + C1 * ζ2 + C2 / ζ2)/(3a)"
+            "x3 = -(b + C1 * ζ2 + C2 / ζ2)/(3a)",
+            14
         )
-        solution.user_variables.update(coefficients)
-        results, solution_time = await self.bot.loop.run_in_executor(None, self.time_stuff, solution.result)
-        r = "\n".join(results[-14:])
+        if results is None:
+            return
+        r = "\n".join(results)
         r = f"ax^3 + bx^2 + cx + d = 0\n{r}"
-        time_taken = input_time + solution_time
         await ctx.send(f"Result in {1000*(time_taken):.2f}ms\n```\n{r}\n```")
 
 #==================================================================================================================================================
@@ -11,12 +11,23 @@ import collections
 import json
 import asyncio
 import traceback
+import hashlib
+import os
+import math
+import numpy as np
 
 #==================================================================================================================================================
 
 BEGINNING = datetime(2018, 6, 19, 0, 0, 0, tzinfo=pytz.utc)
 BATCH_SIZE = 5000
-WAIT_TIME = 300
+CHECKPOINT_TIME = 300
+CHART_CACHE_SIZE = 1024 * 1024 * 32
+CHART_CACHE_PATH = os.path.join(config.DATA_PATH, "chart_cache")
+CHART_DISK_CACHE_SIZE = 1024 * 1024 * 256
+COUNT_DIGITS = 2
+STATUSES = ("online", "dnd", "idle", "offline")
+STATUS_INDEX = {stt: i for i, stt in enumerate(STATUSES)}
+HISTORY_HOURS = 720
 
 #==================================================================================================================================================
 
@@ -26,38 +37,72 @@ class WTFException(Exception):
 #==================================================================================================================================================
 
 class MemberStats:
-    __slots__ = ("id", "last_updated")
+    __slots__ = ("id", "status", "last_updated", "marks", "durations", "dirty")
 
-    def __init__(self, id, *, last_updated):
+    def __init__(self, id, *, status=None, last_updated):
         self.id = id
+        self.status = status
         self.last_updated = last_updated
+        self.marks = np.full(HISTORY_HOURS, -1, dtype=np.int32)
+        self.durations = np.zeros((HISTORY_HOURS, len(STATUSES)), dtype=np.float32)
+        self.dirty = set()
 
-    def process_status(self, stt, *, update=False):
+    def get_slot(self, mark):
+        index = mark % HISTORY_HOURS
+        if self.marks[index] != mark:
+            self.marks[index] = mark
+            self.durations[index] = 0
+        return index
+
+    def load(self, mark, counts):
+        self.durations[self.get_slot(mark)] = [counts.get(stt, 0) for stt in STATUSES]
+
+    def accumulate(self, end=None):
         start = self.last_updated
-        end = utils.now_time()
+        end = end or utils.now_time()
 
         if end > start:
-            start_hour = (start - BEGINNING).total_seconds() / 3600
-            end_hour = (end - BEGINNING).total_seconds() / 3600
-            if end_hour - start_hour > 720:
-                start_hour = end_hour - 720
-
-            first_mark = int(start_hour)
-            last_mark = int(end_hour)
-            marks = tuple(range(first_mark+1, last_mark+1))
-            left_marks = (start_hour, *marks)
-            right_marks = (*marks, end_hour)
-
-            items = []
-            for left, right in zip(left_marks, right_marks):
-                if right-left > 0:
-                    items.append({"mark": int(left), "stt": stt, "dur": right-left})
-
-            if update:
-                self.last_updated = end
-            return items
-        else:
-            return []
+            column = STATUS_INDEX.get(self.status)
+            if column is not None:
+                start_hour = (start - BEGINNING).total_seconds() / 3600
+                end_hour = (end - BEGINNING).total_seconds() / 3600
+                if end_hour - start_hour > HISTORY_HOURS:
+                    start_hour = end_hour - HISTORY_HOURS
+
+                for mark in range(int(start_hour), math.ceil(end_hour)):
+                    dur = min(mark+1, end_hour) - max(mark, start_hour)
+                    if dur > 0:
+                        self.durations[self.get_slot(mark), column] += dur
+                        self.dirty.add(mark)
+            self.last_updated = end
+
+    def set_status(self, status):
+        self.accumulate()
+        self.status = status
+
+    def get_update_requests(self, marks):
+        reqs = []
+        for mark in marks:
+            index = mark % HISTORY_HOURS
+            if self.marks[index] == mark:
+                reqs.append(pymongo.UpdateOne(
+                    {"user_id": self.id, "mark": mark},
+                    {
+                        "$set": {stt: float(value) for stt, value in zip(STATUSES, self.durations[index])},
+                        "$setOnInsert": {"time": BEGINNING + timedelta(hours=mark)}
+                    },
+                    upsert=True
+                ))
+        return reqs
+
+    def group_by(self, since, key):
+        valid = self.marks >= since
+        keys = key(self.marks[valid].astype(np.int64))
+        durations = self.durations[valid]
+        return {
+            int(k): {stt: float(value) for stt, value in zip(STATUSES, durations[keys==k].sum(axis=0))}
+            for k in np.unique(keys)
+        }
 
 #==================================================================================================================================================
 
@@ -65,15 +110,14 @@ class Statistics(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.user_data = bot.db.user_data
+        self.status_rollup = bot.db.user_status_rollup
         self.belphegor_config = bot.db.belphegor_config
 
         self.fetch_ready = asyncio.Event()
-        self.done_update_event = asyncio.Event()
-        self.done_update_event.clear()
 
         self.all_users = {}
         try:
-            all_users = bot.saved_stuff.pop("all_users")
+            all_users = bot.saved_stuff.pop("member_stats")
         except KeyError:
             self.fetch_ready.clear()
             bot.loop.create_task(self.fetch_users())
@@ -81,21 +125,17 @@ class Statistics(commands.Cog):
             self.fetch_ready.set()
             self.all_users.update(all_users)
 
-        self.all_requests = bot.saved_stuff.pop("status_updates", asyncio.Queue())
-        self.update_task = bot.create_task_and_count(self.update_regularly())
-        self.clear_task = bot.create_task_and_count(self.clear_old_data())
+        try:
+            self.chart_cache = bot.saved_stuff.pop("chart_cache")
+        except KeyError:
+            self.chart_cache = utils.ResponseCache(max_size=CHART_CACHE_SIZE, path=CHART_CACHE_PATH, max_disk_size=CHART_DISK_CACHE_SIZE, loop=bot.loop)
+        self.checkpoint_task = bot.loop.create_task(self.checkpoint_regularly())
+        bot.loop.create_task(self.create_indexes())
 
     def cog_unload(self):
-        self.bot.saved_stuff["all_users"] = self.all_users
-        self.bot.saved_stuff["status_updates"] = self.all_requests
-        try:
-            self.update_task.cancel()
-        except:
-            pass
-        try:
-            self.clear_task.cancel()
-        except:
-            pass
+        self.bot.saved_stuff["member_stats"] = self.all_users
+        self.bot.saved_stuff["chart_cache"] = self.chart_cache
+        self.checkpoint_task.cancel()
 
     async def fetch_users(self):
         user_ids = []
@@ -113,89 +153,69 @@ class Statistics(commands.Cog):
         now = utils.now_time()
         for user_id in user_ids:
             self.all_users[user_id] = MemberStats(user_id, last_updated=now)
+        await self.load_history()
 
         self.fetch_ready.set()
 
-    async def clear_old_data(self):
-        try:
-            while True:
-                await asyncio.sleep(3600)
-                end = utils.now_time()
-                end_hour = (end - BEGINNING).total_seconds() / 3600
-                last_mark = int(end_hour)
-                await self.user_data.update_many({}, {"$pull": {"status": {"mark": {"$lt": last_mark-720}}}})
-        except asyncio.CancelledError:
-            pass
-
-    def get_first_member(self, user_id):
+        await self.bot.wait_until_ready()
+        now = utils.now_time()
         for g in self.bot.guilds:
-            m = g.get_member(user_id)
-            if m:
-                return m
-
-    def get_update_request(self, member_stats, status):
-        member_id = member_stats.id
-        items = member_stats.process_status(status, update=True)
-        if items:
-            return pymongo.UpdateOne(
-                {"user_id": member_id},
-                {"$push": {"status": {"$each": items}}}
-            )
-        else:
-            return None
+            for m in g.members:
+                member_stats = self.all_users.get(m.id)
+                if member_stats and member_stats.status is None:
+                    member_stats.status = m.status.value
+                    member_stats.last_updated = now
+
+    async def load_history(self):
+        now = utils.now_time()
+        mark = int((now - BEGINNING).total_seconds() / 3600)
+        async for doc in self.status_rollup.find({"mark": {"$gte": mark-HISTORY_HOURS}}, projection={"_id": False, "time": False}):
+            member_stats = self.all_users.get(doc["user_id"])
+            if member_stats:
+                member_stats.load(doc["mark"], doc)
+
+    async def create_indexes(self):
+        await self.status_rollup.create_index([("user_id", pymongo.ASCENDING), ("mark", pymongo.ASCENDING)], unique=True)
+        await self.status_rollup.create_index("time", expireAfterSeconds=(HISTORY_HOURS+24)*3600)
 
-    async def update_regularly(self):
+    async def checkpoint(self):
+        now = utils.now_time()
+        pending = []
         all_reqs = []
+        for member_stats in self.all_users.values():
+            member_stats.accumulate(now)
+            if member_stats.dirty:
+                marks = member_stats.dirty
+                member_stats.dirty = set()
+                pending.append((member_stats, marks))
+                all_reqs.extend(member_stats.get_update_requests(marks))
 
-        async def update():
-            await self.user_data.bulk_write(all_reqs)
-            all_reqs.clear()
+        if all_reqs:
+            try:
+                await self.status_rollup.bulk_write(all_reqs, ordered=False)
+            except:
+                for member_stats, marks in pending:
+                    member_stats.dirty.update(marks)
+                raise
 
+    async def checkpoint_regularly(self):
         try:
             while True:
+                await asyncio.sleep(CHECKPOINT_TIME)
                 try:
-                    req = await asyncio.wait_for(self.all_requests.get(), WAIT_TIME)
-                except asyncio.TimeoutError:
-                    if all_reqs:
-                        await asyncio.shield(update())
-                else:
-                    all_reqs.append(req)
-                    if len(all_reqs) >= BATCH_SIZE:
-                        await asyncio.shield(update())
+                    await asyncio.shield(self.checkpoint())
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    text = traceback.format_exc()
+                    if len(text) > 1950:
+                        text = f"{e.__class__.__name__}: {e}"
+                    await self.bot.error_hook.execute(f"```\n{text}\n```")
         except asyncio.CancelledError:
-            if all_reqs:
-                await update()
-            self.done_update_event.set()
-        except Exception as e:
-            text = traceback.format_exc()
-            if len(text) > 1950:
-                text = f"{e.__class__.__name__}: {e}"
-            await self.bot.error_hook.execute(f"```\n{text}\n```")
+            pass
 
     async def update_all(self):
-        try:
-            await asyncio.wait_for(self.done_update_event.wait(), 30)
-        except asyncio.TimeoutError:
-            return
-
-        all_reqs = []
-        for user_id, member_stats in self.all_users.items():
-            member = self.get_first_member(user_id)
-            req = self.get_update_request(member_stats, member.status.value)
-            if req:
-                all_reqs.append(req)
-                if len(all_reqs) > 99:
-                    await self.user_data.bulk_write(all_reqs)
-                    all_reqs.clear()
-        if all_reqs:
-            await self.user_data.bulk_write(all_reqs)
-
-    async def update(self, member):
-        member_stats = self.all_users.get(member.id)
-        if member_stats:
-            req = self.get_update_request(member_stats, member.status.value)
-            if req:
-                await self.all_requests.put(req)
+        await self.checkpoint()
 
     # @commands.Cog.listener()
     # async def on_member_join(self, member):
@@ -215,8 +235,36 @@ class Statistics(commands.Cog):
     @commands.Cog.listener()
     async def on_member_update(self, before, after):
         if before.status != after.status:
-            if getattr(before, "id", None) in self.all_users:
-                await self.update(before)
+            member_stats = self.all_users.get(getattr(after, "id", None))
+            if member_stats:
+                member_stats.set_status(after.status.value)
+
+    @staticmethod
+    def chart_key(chart, data, params):
+        raw = json.dumps([chart.__name__, data, sorted(params.items())], default=str, separators=(",", ":"))
+        return f"{chart.__name__}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    async def draw_chart(self, chart, data, **params):
+        data = [
+            {
+                **item,
+                "count": collections.OrderedDict(((k, round(v, COUNT_DIGITS)) for k, v in item["count"].items()))
+                if isinstance(item["count"], dict) else round(item["count"], COUNT_DIGITS)
+            }
+            for item in data
+        ]
+        cache = self.chart_cache
+        key = self.chart_key(chart, data, params)
+        entry = await cache.get(key)
+        if entry:
+            cache.hits += 1
+            return io.BytesIO(entry.body)
+
+        cache.misses += 1
+        bytes_ = await chart(data, **params, loop=self.bot.loop, executor=self.bot.executors["image"])
+        if bytes_ is not None:
+            await cache.set(key, utils.CacheEntry(bytes_.getvalue(), expires=math.inf))
+        return bytes_
 
     async def check_opt_in_user(self, member):
         await self.fetch_ready.wait()
@@ -258,40 +306,21 @@ class Statistics(commands.Cog):
                 maxi = i
                 maxv = v
 
-        bytes_ = await utils.pie_chart(
-            statuses, title=f"{ctx.guild.name}'s current status", unit="members",
-            outline=(0, 0, 0, 0), explode=explode, outline_width=10, loop=self.bot.loop
+        bytes_ = await self.draw_chart(
+            utils.pie_chart, statuses, title=f"{ctx.guild.name}'s current status", unit="members",
+            outline=(0, 0, 0, 0), explode=explode, outline_width=10
         )
         await ctx.send(file=discord.File(bytes_, "statuses.png"))
 
+    def get_history(self, member, *, since, key):
+        member_stats = self.all_users[member.id]
+        member_stats.accumulate()
+        return member_stats.group_by(since, key)
+
     async def fetch_total_status(self, member):
         now = utils.now_time()
         mark = int((now - BEGINNING).total_seconds() / 3600)
-        member_data = [s async for s in self.user_data.aggregate([
-            {
-                "$match": {"user_id": member.id}
-            },
-            {
-                "$unwind": "$status"
-            },
-            {
-                "$redact": {
-                    "$cond": {
-                        "if": {"$lt": ["$status.mark", mark-720]},
-                        "then": "$$PRUNE",
-                        "else": "$$KEEP"
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$status.stt",
-                    "dur": {
-                        "$sum": "$status.dur"
-                    }
-                }
-            }
-        ])]
+        member_data = self.get_history(member, since=mark-HISTORY_HOURS, key=np.zeros_like)
 
         statuses = (
             {"name": "online", "count": 0, "color": discord.Colour.green().to_rgba()},
@@ -300,12 +329,10 @@ class Statistics(commands.Cog):
             {"name": "offline", "count": 0, "color": discord.Colour.light_grey().to_rgba()}
         )
 
+        data = member_data.get(0)
         for item in statuses:
-            data = utils.get_element(member_data, lambda x: x["_id"]==item["name"])
             if data:
-                item["count"] = data["dur"]
-            if item["name"] == member.status.value:
-                item["count"] += (now - self.all_users[member.id].last_updated).total_seconds() / 3600
+                item["count"] = data[item["name"]]
 
         return statuses
 
@@ -322,35 +349,13 @@ class Statistics(commands.Cog):
         await self.check_opt_in_user(target)
         await ctx.trigger_typing()
         statuses = await self.fetch_total_status(target)
-        bytes_ = await utils.pie_chart(statuses, title=f"{target.display_name}'s total status", unit="hours", outline=(0, 0, 0, 0), outline_width=10, loop=self.bot.loop)
+        bytes_ = await self.draw_chart(utils.pie_chart, statuses, title=f"{target.display_name}'s total status", unit="hours", outline=(0, 0, 0, 0), outline_width=10)
         await ctx.send(file=discord.File(bytes_, filename="pie_status.png"))
 
     async def fetch_daily_status(self, member):
         now = utils.now_time()
         mark = int((now - BEGINNING).total_seconds() / 3600)
-        member_data = [s async for s in self.user_data.aggregate([
-            {
-                "$match": {"user_id": member.id}
-            },
-            {
-                "$unwind": "$status"
-            },
-            {
-                "$redact": {
-                    "$cond": {
-                        "if": {"$lt": ["$status.mark", mark-720]},
-                        "then": "$$PRUNE",
-                        "else": "$$KEEP"
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": {"stt": "$status.stt", "day": {"$floor": {"$divide": [{"$subtract": ["$status.mark", mark]}, 24]}}},
-                    "dur": {"$sum": "$status.dur"}
-                }
-            }
-        ])]
+        member_data = self.get_history(member, since=mark-HISTORY_HOURS, key=lambda marks: (marks-mark)//24)
 
         statuses = (
             {"name": "online", "count": collections.OrderedDict(((i, 0) for i in range(30, 0, -1))), "color": discord.Colour.green().to_rgba()},
@@ -361,15 +366,9 @@ class Statistics(commands.Cog):
 
         for item in statuses:
             for day in range(-30, 0):
-                data = utils.get_element(member_data, lambda x: x["_id"]["day"]==day and x["_id"]["stt"]==item["name"])
+                data = member_data.get(day)
                 if data:
-                    item["count"][-day] = data["dur"]
-            if item["name"] == member.status.value:
-                processed_stt = self.all_users[member.id].process_status(member.status.value)
-                for inst in processed_stt:
-                    _x = -(inst["mark"]-mark)//24
-                    if _x < 0:
-                        item["count"][_x] += inst["dur"]
+                    item["count"][-day] = data[item["name"]]
 
         return statuses
 
@@ -388,7 +387,7 @@ class Statistics(commands.Cog):
         statuses = await self.fetch_daily_status(target)
         title = f"{target.display_name}'s status by day"
         try:
-            bytes_ = await utils.line_chart(statuses, unit_y="hours", unit_x="past day", title=title, loop=self.bot.loop)
+            bytes_ = await self.draw_chart(utils.line_chart, statuses, unit_y="hours", unit_x="past day", title=title)
         except ZeroDivisionError:
             await ctx.send("I need at least 1 hour worth of data to perform this command.")
         else:
@@ -401,46 +400,9 @@ class Statistics(commands.Cog):
         now = utils.now_time()
         mark = int((now - BEGINNING).total_seconds() / 3600)
         if offset is None:
-            offset = "$timezone"
-        raw_data = [s async for s in self.user_data.aggregate([
-            {
-                "$match": {"user_id": member.id}
-            },
-            {
-                "$facet": {
-                    "data": [
-                        {
-                            "$unwind": "$status"
-                        },
-                        {
-                            "$redact": {
-                                "$cond": {
-                                    "if": {"$lt": ["$status.mark", mark-720]},
-                                    "then": "$$PRUNE",
-                                    "else": "$$KEEP"
-                                }
-                            }
-                        },
-                        {
-                            "$group": {
-                                "_id": {"stt": "$status.stt", "mark": {"$mod": [{"$add": ["$status.mark", offset]}, 24]}},
-                                "dur": {"$sum": "$status.dur"}
-                            }
-                        }
-                    ],
-                    "timezone": [
-                        {"$project": {"_id": False, "timezone": "$timezone"}}
-                    ]
-                }
-            }
-        ])][0]
-        member_data = raw_data["data"]
-        if isinstance(offset, str):
-            r = raw_data["timezone"]
-            if r:
-                offset = r[0]["timezone"]
-            else:
-                offset = 0
+            doc = await self.user_data.find_one({"user_id": member.id}, projection={"_id": False, "timezone": True})
+            offset = (doc or {}).get("timezone", 0)
+        member_data = self.get_history(member, since=mark-HISTORY_HOURS, key=lambda marks: (marks+offset)%24)
 
         statuses = (
             {"name": "online", "count": collections.OrderedDict(((i, 0) for i in range(24))), "color": discord.Colour.green().to_rgba()},
@@ -451,13 +413,9 @@ class Statistics(commands.Cog):
 
         for item in statuses:
             for hour in range(24):
-                data = utils.get_element(member_data, lambda x: x["_id"]["stt"]==item["name"] and x["_id"]["mark"]==hour)
+                data = member_data.get(hour)
                 if data:
-                    item["count"][hour] = data["dur"]
-            if item["name"] == member.status.value:
-                processed_stt = self.all_users[member.id].process_status(member.status.value)
-                for inst in processed_stt:
-                    item["count"][(inst["mark"]+offset)%24] += inst["dur"]
+                    item["count"][hour] = data[item["name"]]
 
         return offset, statuses
 
@@ -501,7 +459,7 @@ class Statistics(commands.Cog):
         #draw
         title = f"{target.display_name}'s status by time of day (offset {offset:+d})"
         try:
-            bytes_ = await utils.stacked_area_chart(draw_data, unit_y="%", unit_x="time\nof day", title=title, loop=self.bot.loop)
+            bytes_ = await self.draw_chart(utils.stacked_area_chart, draw_data, unit_y="%", unit_x="time\nof day", title=title)
         except ZeroDivisionError:
             await ctx.send("I need at least 1 day worth of data to perform this command.")
         else:
@@ -510,29 +468,7 @@ class Statistics(commands.Cog):
     async def fetch_weekly_status(self, member):
         now = utils.now_time()
         mark = int((now - BEGINNING).total_seconds() / 3600)
-        member_data = [s async for s in self.user_data.aggregate([
-            {
-                "$match": {"user_id": member.id}
-            },
-            {
-                "$unwind": "$status"
-            },
-            {
-                "$redact": {
-                    "$cond": {
-                        "if": {"$lt": ["$status.mark", mark-672]},
-                        "then": "$$PRUNE",
-                        "else": "$$KEEP"
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": {"stt": "$status.stt", "week": {"$floor": {"$divide": [{"$subtract": ["$status.mark", mark]}, 168]}}},
-                    "dur": {"$sum": "$status.dur"}
-                }
-            }
-        ])]
+        member_data = self.get_history(member, since=mark-672, key=lambda marks: (marks-mark)//168)
 
         statuses = (
             {"name": "online", "count": collections.OrderedDict(((i, 0) for i in range(4, 0, -1))), "color": discord.Colour.green().to_rgba()},
@@ -543,15 +479,9 @@ class Statistics(commands.Cog):
 
         for item in statuses:
             for week in range(-4, 0):
-                data = utils.get_element(member_data, lambda x: x["_id"]["week"]==week and x["_id"]["stt"]==item["name"])
+                data = member_data.get(week)
                 if data:
-                    item["count"][-week] = data["dur"]
-            if item["name"] == member.status.value:
-                processed_stt = self.all_users[member.id].process_status(member.status.value)
-                for inst in processed_stt:
-                    _x = -(inst["mark"]-mark)//168
-                    if _x < 0:
-                        item["count"][_x] += inst["dur"]
+                    item["count"][-week] = data[item["name"]]
 
         return statuses
 
@@ -570,12 +500,72 @@ class Statistics(commands.Cog):
         statuses = await self.fetch_weekly_status(target)
         title = f"{target.display_name}'s status by week"
         try:
-            bytes_ = await utils.bar_chart(statuses, unit_y="hours", unit_x="past week", title=title, loop=self.bot.loop)
+            bytes_ = await self.draw_chart(utils.bar_chart, statuses, unit_y="hours", unit_x="past week", title=title)
         except ZeroDivisionError:
             await ctx.send("I need at least 1 hour worth of data to perform this command.")
         else:
             await ctx.send(file=discord.File(bytes_, filename="bar_status.png"))
 
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def migratestatus(self, ctx):
+        await self.checkpoint()
+        all_reqs = []
+        user_ids = []
+        count = 0
+
+        async def write():
+            nonlocal count
+            if all_reqs:
+                try:
+                    await self.status_rollup.bulk_write(all_reqs, ordered=False)
+                except pymongo.errors.BulkWriteError as e:
+                    #duplicate key means that hour was already migrated by an earlier run
+                    if any(err["code"] != 11000 for err in e.details["writeErrors"]):
+                        raise
+                count += len(all_reqs)
+            #status arrays are only dropped after their rollups are written, so a rerun picks up where this stopped
+            await self.user_data.update_many({"_id": {"$in": user_ids}}, {"$unset": {"status": ""}})
+            all_reqs.clear()
+            user_ids.clear()
+
+        async for user in self.user_data.find({"status.0": {"$exists": True}}, projection={"user_id": True, "status": True}):
+            marks = {}
+            for item in user["status"]:
+                if item.get("stt") in STATUSES:
+                    values = marks.setdefault(item["mark"], dict.fromkeys(STATUSES, 0))
+                    values[item["stt"]] += item["dur"]
+            for mark, values in marks.items():
+                all_reqs.append(pymongo.UpdateOne(
+                    {"user_id": user["user_id"], "mark": mark, "migrated": {"$ne": True}},
+                    {
+                        "$inc": values,
+                        "$set": {"migrated": True},
+                        "$setOnInsert": {"time": BEGINNING + timedelta(hours=mark)}
+                    },
+                    upsert=True
+                ))
+            user_ids.append(user["_id"])
+            if len(all_reqs) >= BATCH_SIZE:
+                await write()
+        await write()
+        await self.load_history()
+        await ctx.send(f"Migrated {count} hourly rollups.")
+
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def chartcache(self, ctx, clear=None):
+        cache = self.chart_cache
+        if clear == "clear":
+            cache.clear()
+        await ctx.send(
+            f"```\n{'entries': <16}{len(cache.container)}\n"
+            f"{'memory': <16}{cache.current_size/1024/1024:.2f}MB\n"
+            f"{'hits': <16}{cache.hits}\n"
+            f"{'misses': <16}{cache.misses}\n"
+            f"{'hit rate': <16}{cache.hit_rate:.2%}\n```"
+        )
+
     @modding.help(brief="Set default timezone for chart commands", category="Experimental", field="Status", paragraph=1)
     @commands.command()
     @commands.cooldown(rate=1, per=10, type=commands.BucketType.user)
@@ -593,15 +583,16 @@ class Statistics(commands.Cog):
         await self.fetch_ready.wait()
         member_id = member.id
         if add:
-            self.all_users[member_id] = MemberStats(member_id, last_updated=utils.now_time())
+            self.all_users[member_id] = MemberStats(member_id, status=member.status.value, last_updated=utils.now_time())
             await self.user_data.update_one(
                 {"user_id": member_id},
-                {"$set": {"user_id": member_id, "timezone": 0, "status": []}},
+                {"$set": {"user_id": member_id, "timezone": 0}, "$unset": {"status": ""}},
                 upsert=True
             )
         else:
             self.all_users.pop(member_id, None)
             await self.user_data.delete_many({"user_id": member_id})
+        await self.status_rollup.delete_many({"user_id": member_id})
 
     @modding.help(brief="Toggle presence tracking, required for user charts", category="Experimental", field="Status", paragraph=1)
     @commands.command()
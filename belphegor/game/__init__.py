@@ -76,9 +76,9 @@ class Game(commands.Cog):
         if density > 0.5:
             return await ctx.send("Density to large.")
 
-        game = await MazeRunner.new(ctx, size, mode=mode, weave=weave, density=density, loop=self.bot.loop)
+        game = await MazeRunner.new(ctx, size, mode=mode, weave=weave, density=density, loop=self.bot.loop, executor=self.bot.executors["cpu"])
         self.mazes[ctx.author] = game
-        bytes_ = await game.draw_maze(loop=self.bot.loop)
+        bytes_ = await game.draw_maze(loop=self.bot.loop, executor=self.bot.executors["image"])
         await ctx.send(file=discord.File(bytes_, "maze.png"))
 
     @maze.command()
@@ -89,7 +89,7 @@ class Game(commands.Cog):
         '''
         game = self.mazes.pop(ctx.author, None)
         if game:
-            bytes_ = await game.draw_solution(loop=self.bot.loop)
+            bytes_ = await game.draw_solution(loop=self.bot.loop, executor=self.bot.executors["image"])
             await ctx.send(file=discord.File(bytes_, "solution.png"))
         else:
             await ctx.send("You haven't created any maze in the last 10 minutes.")
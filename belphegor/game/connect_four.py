@@ -141,7 +141,7 @@ class ConnectFour:
         current_player = next(player_generate)
         while True:
             try:
-                reaction, user = await ctx.bot.wait_for("reaction_add", check=lambda r, u: r.emoji in emojis and r.message.id==message.id and u.id==current_player.id, timeout=600)
+                reaction, user = await ctx.bot.event_router.wait_for_reaction(message, check=lambda r, u: r.emoji in emojis and u.id==current_player.id, timeout=600)
             except asyncio.TimeoutError:
                 await end_game()
                 game.win_player = -game.current_player
@@ -197,11 +197,11 @@ class MazeRunner:
         self.rendering = None
 
     @classmethod
-    async def new(cls, ctx, size, *, mode, weave, density, loop=None):
+    async def new(cls, ctx, size, *, mode, weave, density, loop=None, executor=None):
         func = functools.partial(getattr(Maze, f"{mode}_algorithm"), (size, size), weave=weave, density=density)
         if mode == "kruskal" and size > 30 and weave:
             loop = loop or asyncio.get_event_loop()
-            maze = await loop.run_in_executor(None, func)
+            maze = await loop.run_in_executor(executor, func)
         else:
             maze = func()
         return cls(ctx.author, maze, mode=mode, weave=weave, density=density)
@@ -307,7 +307,7 @@ class MazeRunner:
         else:
             return Image.fromarray(self.rendering)
 
-    async def draw_maze(self, loop=None):
+    async def draw_maze(self, loop=None, executor=None):
         def draw_it():
             image = self._raw_draw()
             bytes_ = BytesIO()
@@ -316,9 +316,9 @@ class MazeRunner:
             return bytes_
 
         loop = loop or asyncio.get_event_loop()
-        return await loop.run_in_executor(None, draw_it)
+        return await loop.run_in_executor(executor, draw_it)
 
-    async def draw_solution(self, loop=None):
+    async def draw_solution(self, loop=None, executor=None):
         def draw_it():
             solution = self.maze.solve()
             image = self._raw_draw()
@@ -357,4 +357,4 @@ class MazeRunner:
             return bytes_
 
         loop = loop or asyncio.get_event_loop()
-        return await loop.run_in_executor(None, draw_it)
+        return await loop.run_in_executor(executor, draw_it)
@@ -8,10 +8,19 @@ import re
 import json
 import traceback
 from urllib.parse import quote
+import asyncio
+import itertools
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import UpdateOne
 
 #==================================================================================================================================================
 
 GFWIKI_API = "https://en.gfwiki.com/api.php"
+WIKI_TITLE_LIMIT = 50
+FETCH_CONCURRENCY = 4
+PARSE_WORKERS = 4
 
 MOBILITY = {
     "AR":   10,
@@ -487,10 +496,129 @@ class Doll(data_type.BaseObject):
 
 #==================================================================================================================================================
 
+def parse_wikitext(text):
+    return parser.parse(text)
+
+def timed(func, *args):
+    start = time.perf_counter()
+    ret = func(*args)
+    return ret, time.perf_counter() - start
+
+def parse_doll_page(title, wikitext):
+    ret = parser.parse(wikitext)
+    for r in ret:
+        if "classification" in r:
+            basic_info = r
+            break
+
+    dtype = basic_info["classification"]
+    doll = Doll({})
+
+    # basic section
+    doll.name = title
+    doll.full_name = normalize(basic_info["fullname"])
+    doll.en_name = normalize(basic_info.get("releasedon", "").strip(" ,"))
+    doll.aliases = name_clean_regex.sub("", normalize(doll.name))
+    doll.index = int(basic_info["index"][-3:]) if basic_info["rarity"] == "EXTRA" else int(basic_info["index"])
+    doll.classification = dtype
+    doll.rarity = basic_info["rarity"]
+    doll.artist = basic_info["artist"]
+    doll.voice_actor = basic_info.get("voiceactor")
+    doll.manufacturer = basic_info.get("manufacturer")
+    doll.origin = basic_info.get("nationality")
+
+    doll.max_hp = int(basic_info["max_hp"]) * 5
+    doll.max_dmg = int(basic_info["max_dmg"])
+    doll.max_eva = int(basic_info["max_eva"])
+    doll.max_acc = int(basic_info["max_acc"])
+    doll.max_rof = int(basic_info["max_rof"])
+    doll.max_armor = utils.to_int(basic_info.get("max_armor"), default=0)
+    doll.clip_size = utils.to_int(basic_info.get("clipsize"), default=0)
+
+    doll.mobility = int(basic_info.get("mov", MOBILITY[dtype]))
+    doll.craft_time = timer_to_seconds(basic_info.get("craft", ""))
+    doll.crit_rate = utils.to_int(basic_info.get("crit", "").rstrip("%"), default=CRIT_RATE[dtype])
+    order = EQUIPMENT_ORDER[dtype].copy()
+    for i in range(3):
+        cur = basic_info.get(f"slot{i+1}")
+        if cur:
+            order[i] = cur
+    doll.equipment_slots = get_equipment_slots(
+        dtype,
+        order,
+        add_ap=basic_info.get("use_armor-piercing_ammo", False),
+        add_armor=basic_info.get("use_ballistic_plate", False)
+    )
+
+    tile = {}
+    tile["shape"] = {str(i): utils.to_int(basic_info.get(f"tile{i}"), default=-1) for i in range(1, 10)}
+    tile["target"] = basic_info.get("aura1")
+    tile["effect"] = [
+        basic_info.get("aura2", ""),
+        basic_info.get("aura3", "")
+    ]
+    doll.tile = tile
+
+    doll.trivia = basic_info.get("trivia")
+
+    # mod 3 basic info section
+    mod = {}
+    if basic_info.get("moddable") or basic_info.get("mod1_max_hp"):
+        doll.moddable = True
+        mod["max_hp"] = int(get_either(basic_info, *mod_keys("max_hp"), default=0)) * 5
+        mod["max_dmg"] = int(get_either(basic_info, *mod_keys("max_dmg"), default=0))
+        mod["max_eva"] = int(get_either(basic_info, *mod_keys("max_eva"), default=0))
+        mod["max_acc"] = int(get_either(basic_info, *mod_keys("max_acc"), default=0))
+        mod["max_rof"] = int(get_either(basic_info, *mod_keys("max_rof"), default=0))
+        mod["max_armor"] = int(get_either(basic_info, *mod_keys("max_armor"), default=0))
+        mod["clip_size"] = int(get_either(basic_info, *mod_keys("clipsize"), default=0))
+
+        mod_tile = {}
+
+        mod_tile["shape"] = {str(i): utils.to_int(get_either(basic_info, *mod_keys(f"tile{i}")), default=-1) for i in range(1, 10)}
+        mod_tile["target"] = basic_info.get("mod1_aura1") or basic_info.get("aura1")
+        mod_tile["effect"] = [
+            basic_info.get("mod1_aura2") or basic_info.get("aura2", ""),
+            basic_info.get("mod1_aura3") or basic_info.get("aura3", "")
+        ]
+        mod["tile"] = mod_tile
+    else:
+        doll.moddable = False
+
+    skill_pages = [f"{doll.name}/skilldata"]
+    if doll.moddable:
+        skill_pages.extend((f"{doll.name}/skilldata/mod1", f"{doll.name}/skill2data"))
+
+    # skin section
+    file_list = {
+        f"File:{doll.name}.png": (0, "default", "normal"),
+        f"File:{doll.name} D.png": (0, "default", "damaged")
+    }
+    number = 0
+    while True:
+        number += 1
+        next_costume = f"costume{number}"
+        costume_name = basic_info.get(next_costume)
+        if costume_name:
+            file_list[f"File:{doll.name}_{next_costume}.png"] = (number, costume_name, "normal")
+            file_list[f"File:{doll.name}_{next_costume}_D.png"] = (number, costume_name, "damaged")
+        else:
+            break
+
+    return doll.__dict__, mod, skill_pages, file_list
+
+#==================================================================================================================================================
+
 class GirlsFrontline(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.doll_list = bot.db.doll_list
+        self.doll_index = data_type.SearchIndex(
+            self.doll_list,
+            atts=["name", "full_name", "en_name", "classification", "aliases"],
+            sort={"index": 1}
+        )
+        bot.loop.create_task(self.doll_index.build())
 
         test_guild_2 = bot.get_guild(config.TEST_GUILD_2_ID)
         self.emojis = {"white_square": "\u2b1c", "black_square": "\u2b1b", "blue_square": "\U0001f7e6"}
@@ -509,6 +637,20 @@ class GirlsFrontline(commands.Cog):
             self.emojis[emoji_name] = discord.utils.find(lambda e: e.name==emoji_name, creampie_guild.emojis)
 
         bot.loop.create_task(self.gfwiki_bot_login())
+        self.parse_pool = None
+
+    def cog_unload(self):
+        pool = self.parse_pool
+        if pool:
+            self.parse_pool = None
+            #shutdown waits for queued parses, keep it off the event loop
+            self.bot.loop.run_in_executor(None, pool.shutdown)
+
+    def get_parse_pool(self):
+        #spawn instead of fork, forking a process running the event loop and motor threads is not safe
+        if self.parse_pool is None:
+            self.parse_pool = ProcessPoolExecutor(PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return self.parse_pool
 
     async def gfwiki_bot_login(self):
         session = self.bot.session
@@ -539,14 +681,12 @@ class GirlsFrontline(commands.Cog):
     async def _search(self, ctx, name, *, prompt=None):
         return await ctx.search(
             name,
-            self.doll_list,
+            self.doll_index,
             cls=Doll,
             colour=discord.Colour.green(),
-            atts=["name", "full_name", "en_name", "classification", "aliases"],
             name_att="qual_name",
             emoji_att="classification",
-            prompt=prompt,
-            sort={"index": 1}
+            prompt=prompt
         )
 
     @commands.group(aliases=["td"], invoke_without_command=True)
@@ -594,213 +734,209 @@ class GirlsFrontline(commands.Cog):
             await ctx.send(file=discord.File.from_str(json.dumps(logs, indent=4, ensure_ascii=False)))
 
     async def update_dolls_with_names(self, ctx, names):
-        await ctx.send(f"Total: {len(names)} dolls")
-        msg = await ctx.send(f"Fetching...\n{utils.progress_bar(0)}")
-        passed = []
-        failed = []
+        return await self.update_with_names(ctx, names, "dolls")
+
+    async def fetch_wikitexts(self, titles):
+        titles = list(dict.fromkeys(titles))
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+        result = {}
+
+        async def fetch_batch(batch):
+            params = {
+                "action":           "query",
+                "prop":             "revisions",
+                "rvprop":           "content",
+                "rvslots":          "main",
+                "titles":           "|".join(batch),
+                "format":           "json",
+                "formatversion":    2,
+                "redirects":        1
+            }
+            async with semaphore:
+                bytes_ = await self.bot.fetch(GFWIKI_API, params=params)
+            data = json.loads(bytes_)["query"]
+            moved = {}
+            for n in itertools.chain(data.get("normalized", []), data.get("redirects", [])):
+                moved[n["from"]] = n["to"]
+            pages = {}
+            for page in data.get("pages", []):
+                revisions = page.get("revisions")
+                if revisions:
+                    rev = revisions[0]
+                    pages[page["title"]] = rev.get("slots", {}).get("main", rev).get("content")
+            for title in batch:
+                target = title
+                for _ in range(3):
+                    if target in moved:
+                        target = moved[target]
+                    else:
+                        break
+                if target in pages:
+                    result[title] = (target, pages[target])
+
+        await asyncio.gather(*(fetch_batch(titles[i:i+WIKI_TITLE_LIMIT]) for i in range(0, len(titles), WIKI_TITLE_LIMIT)))
+        return result
+
+    async def fetch_image_urls(self, titles):
+        titles = list(dict.fromkeys(titles))
+        semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+        result = {}
+
+        async def fetch_batch(batch):
+            file_params = {
+                "action":       "query",
+                "prop":         "imageinfo",
+                "iiprop":       "url",
+                "titles":       "|".join(batch),
+                "format":       "json",
+                "redirects":    1
+            }
+            async with semaphore:
+                file_bytes_ = await self.bot.fetch(GFWIKI_API, params=file_params)
+            file_data = json.loads(file_bytes_)["query"]
+            moved = {n["to"]: n["from"] for n in file_data.get("normalized", [])}
+            for file_info in file_data["pages"].values():
+                if "imageinfo" in file_info:
+                    title = file_info["title"]
+                    result[moved.get(title, title)] = file_info["imageinfo"][0]["url"]
+
+        await asyncio.gather(*(fetch_batch(titles[i:i+WIKI_TITLE_LIMIT]) for i in range(0, len(titles), WIKI_TITLE_LIMIT)))
+        return result
+
+    async def fetch_dolls(self, names, *, executor=None, progress=None):
+        loop = self.bot.loop
         logs = {}
+        stats = {"pages": 0, "parse_time": 0, "parsed": 0, "missing": []}
+
+        async def parse(func, *args):
+            ret, elapsed = await loop.run_in_executor(executor, timed, func, *args)
+            stats["parse_time"] += elapsed
+            stats["parsed"] += 1
+            return ret
+
+        # basic info
+        pages = await self.fetch_wikitexts(names)
+        stats["pages"] += len(pages)
+        parsed = {}
         count = len(names)
-        for i, name in enumerate(names):
+
+        async def parse_main(i, name):
+            try:
+                title, wikitext = pages[name]
+            except KeyError:
+                logs[name] = f"Page {name} doesn't exist."
+                stats["missing"].append(name)
+                return
             try:
-                doll = await self.search_gfwiki(name)
+                parsed[name] = await parse(parse_doll_page, title, wikitext)
             except:
                 logs[name] = traceback.format_exc()
-                failed.append(name)
-            else:
-                passed.append(doll.name)
-                await self.doll_list.update_one(
-                    {"index": doll.index, "rarity": doll.rarity},
-                    {"$set": doll.__dict__},
-                    upsert=True
-                )
-            if (i+1)%10 == 0:
-                await msg.edit(content=f"Fetching...\n{utils.progress_bar((i+1)/count)}")
+            if progress:
+                await progress(i+1, count)
+
+        await asyncio.gather(*(parse_main(i, name) for i, name in enumerate(names)))
+
+        # skill section
+        skill_pages = await self.fetch_wikitexts(p for item in parsed.values() for p in item[2])
+        stats["pages"] += len(skill_pages)
+        skills = {}
+
+        async def parse_skill(page):
+            try:
+                title, wikitext = skill_pages[page]
+                skills[page] = (await parse(parse_wikitext, wikitext))[0]
+            except:
+                skills[page] = traceback.format_exc()
+
+        await asyncio.gather(*(parse_skill(p) for p in dict.fromkeys(p for item in parsed.values() for p in item[2])))
+
+        # skin section
+        image_urls = await self.fetch_image_urls(t for item in parsed.values() for t in item[3])
+
+        dolls = {}
+        for name, (doll_data, mod, skill_page_names, file_list) in parsed.items():
+            doll_skills = [skills.get(p) for p in skill_page_names]
+            if not all(isinstance(sk, dict) for sk in doll_skills):
+                logs[name] = next((sk for sk in doll_skills if not isinstance(sk, dict)), None) or "Skill data not found."
+                continue
+            doll = Doll(doll_data)
+            doll.skill = doll_skills[0]
+            if doll.moddable:
+                mod["skill"] = doll_skills[1:]
+
+            skins = []
+            mod_skins = []
+            for title, info in file_list.items():
+                url = image_urls.get(title)
+                if url:
+                    skin = {
+                        "index": info[0],
+                        "name": info[1],
+                        "form": info[2],
+                        "image_url": url
+                    }
+                    if info[1] == "[Digimind Upgrade]":
+                        mod_skins.append(skin)
+                    else:
+                        skins.append(skin)
+
+            skins.sort(key=lambda x: (-x["index"], x["form"]), reverse=True)
+            doll.skins = skins
+            mod["skins"] = mod_skins
+            doll.mod_data = mod
+            dolls[name] = doll
+
+        return dolls, logs, stats
+
+    async def update_with_names(self, ctx, names, label):
+        await ctx.send(f"Total: {len(names)} {label}")
+        msg = await ctx.send(f"Fetching...\n{utils.progress_bar(0)}")
+
+        async def progress(i, count):
+            if i%10 == 0:
+                await msg.edit(content=f"Fetching...\n{utils.progress_bar(i/count)}")
+
+        start = time.perf_counter()
+        dolls, logs, stats = await self.fetch_dolls(names, executor=self.get_parse_pool(), progress=progress)
+        if dolls:
+            await self.doll_list.bulk_write(
+                [
+                    UpdateOne(
+                        {"index": doll.index, "rarity": doll.rarity},
+                        {"$set": doll.__dict__},
+                        upsert=True
+                    ) for doll in dolls.values()
+                ],
+                ordered=False
+            )
+        elapsed = time.perf_counter() - start
+        passed = [doll.name for doll in dolls.values()]
+        failed = [name for name in names if name not in dolls]
+        await self.doll_index.build()
         await msg.edit(content=f"Done.\n{utils.progress_bar(1)}")
+        throughput = (
+            f"{stats['pages']} pages in {elapsed:.2f}s ({stats['pages']/elapsed:.2f} pages/s), "
+            f"parse {stats['parse_time']*1000/max(stats['parsed'], 1):.2f}ms/page"
+        )
         txt = json.dumps({"passed": passed, "failed": failed}, indent=4)
         if len(txt) > 1900:
             await ctx.send(
-                f"Passed: {len(passed)}\nFailed: {len(failed)}",
+                f"Passed: {len(passed)}\nFailed: {len(failed)}\n{throughput}",
                 file=discord.File.from_str(txt)
             )
         else:
-            await ctx.send(f"Passed: {len(passed)}\nFailed: {len(failed)}\n```json\n{txt}\n```")
+            await ctx.send(f"Passed: {len(passed)}\nFailed: {len(failed)}\n{throughput}\n```json\n{txt}\n```")
         return logs
 
     async def search_gfwiki(self, name):
-        params = {
-            "action":       "parse",
-            "prop":         "wikitext",
-            "page":         name,
-            "format":       "json",
-            "redirects":    1
-        }
-        bytes_ = await self.bot.fetch(GFWIKI_API, params=params)
-        raw = json.loads(bytes_)
-        if "error" in raw:
+        dolls, logs, stats = await self.fetch_dolls([name])
+        if name in dolls:
+            return dolls[name]
+        elif name in stats["missing"]:
             raise checks.CustomError(f"Page {name} doesn't exist.")
-
-        raw_basic_info = raw["parse"]["wikitext"]["*"]
-        ret = parser.parse(raw_basic_info)
-        for r in ret:
-            if "classification" in r:
-                basic_info = r
-                break
-
-        dtype = basic_info["classification"]
-        doll = Doll({})
-
-        # basic section
-        doll.name = raw["parse"]["title"]
-        doll.full_name = normalize(basic_info["fullname"])
-        doll.en_name = normalize(basic_info.get("releasedon", "").strip(" ,"))
-        doll.aliases = name_clean_regex.sub("", normalize(doll.name))
-        doll.index = int(basic_info["index"][-3:]) if basic_info["rarity"] == "EXTRA" else int(basic_info["index"])
-        doll.classification = dtype
-        doll.rarity = basic_info["rarity"]
-        doll.artist = basic_info["artist"]
-        doll.voice_actor = basic_info.get("voiceactor")
-        doll.manufacturer = basic_info.get("manufacturer")
-        doll.origin = basic_info.get("nationality")
-
-        doll.max_hp = int(basic_info["max_hp"]) * 5
-        doll.max_dmg = int(basic_info["max_dmg"])
-        doll.max_eva = int(basic_info["max_eva"])
-        doll.max_acc = int(basic_info["max_acc"])
-        doll.max_rof = int(basic_info["max_rof"])
-        doll.max_armor = utils.to_int(basic_info.get("max_armor"), default=0)
-        doll.clip_size = utils.to_int(basic_info.get("clipsize"), default=0)
-
-        doll.mobility = int(basic_info.get("mov", MOBILITY[dtype]))
-        doll.craft_time = timer_to_seconds(basic_info.get("craft", ""))
-        doll.crit_rate = utils.to_int(basic_info.get("crit", "").rstrip("%"), default=CRIT_RATE[dtype])
-        order = EQUIPMENT_ORDER[dtype].copy()
-        for i in range(3):
-            cur = basic_info.get(f"slot{i+1}")
-            if cur:
-                order[i] = cur
-        doll.equipment_slots = get_equipment_slots(
-            dtype,
-            order,
-            add_ap=basic_info.get("use_armor-piercing_ammo", False),
-            add_armor=basic_info.get("use_ballistic_plate", False)
-        )
-
-        tile = {}
-        tile["shape"] = {str(i): utils.to_int(basic_info.get(f"tile{i}"), default=-1) for i in range(1, 10)}
-        tile["target"] = basic_info.get("aura1")
-        tile["effect"] = [
-            basic_info.get("aura2", ""),
-            basic_info.get("aura3", "")
-        ]
-        doll.tile = tile
-
-        doll.trivia = basic_info.get("trivia")
-
-        # mod 3 basic info section
-        mod = {}
-        if basic_info.get("moddable") or basic_info.get("mod1_max_hp"):
-            doll.moddable = True
-            mod["max_hp"] = int(get_either(basic_info, *mod_keys("max_hp"), default=0)) * 5
-            mod["max_dmg"] = int(get_either(basic_info, *mod_keys("max_dmg"), default=0))
-            mod["max_eva"] = int(get_either(basic_info, *mod_keys("max_eva"), default=0))
-            mod["max_acc"] = int(get_either(basic_info, *mod_keys("max_acc"), default=0))
-            mod["max_rof"] = int(get_either(basic_info, *mod_keys("max_rof"), default=0))
-            mod["max_armor"] = int(get_either(basic_info, *mod_keys("max_armor"), default=0))
-            mod["clip_size"] = int(get_either(basic_info, *mod_keys("clipsize"), default=0))
-
-            mod_tile = {}
-
-            mod_tile["shape"] = {str(i): utils.to_int(get_either(basic_info, *mod_keys(f"tile{i}")), default=-1) for i in range(1, 10)}
-            mod_tile["target"] = basic_info.get("mod1_aura1") or basic_info.get("aura1")
-            mod_tile["effect"] = [
-                basic_info.get("mod1_aura2") or basic_info.get("aura2", ""),
-                basic_info.get("mod1_aura3") or basic_info.get("aura3", "")
-            ]
-            mod["tile"] = mod_tile
         else:
-            doll.moddable = False
-
-        # skill section
-        params = {
-            "action":       "parse",
-            "prop":         "wikitext",
-            "page":         doll.name + "/skilldata",
-            "format":       "json",
-            "redirects":    1
-        }
-        bytes_ = await self.bot.fetch(GFWIKI_API, params=params)
-        raw_skilldata = json.loads(bytes_)
-        doll.skill = parser.parse(raw_skilldata["parse"]["wikitext"]["*"])[0]
-
-        # mod 3 skill
-        if doll.moddable:
-            skill = []
-            for path in ("/skilldata/mod1", "/skill2data"):
-                params = {
-                    "action":       "parse",
-                    "prop":         "wikitext",
-                    "page":         doll.name + path,
-                    "format":       "json",
-                    "redirects":    1
-                }
-                bytes_ = await self.bot.fetch(GFWIKI_API, params=params)
-                raw_skilldata = json.loads(bytes_)
-                skill.append(parser.parse(raw_skilldata["parse"]["wikitext"]["*"])[0])
-            mod["skill"] = skill
-
-        # skin section
-        file_list = {
-            f"File:{doll.name}.png": (0, "default", "normal"),
-            f"File:{doll.name} D.png": (0, "default", "damaged")
-        }
-        number = 0
-        while True:
-            number += 1
-            next_costume = f"costume{number}"
-            costume_name = basic_info.get(next_costume)
-            if costume_name:
-                file_list[f"File:{doll.name}_{next_costume}.png"] = (number, costume_name, "normal")
-                file_list[f"File:{doll.name}_{next_costume}_D.png"] = (number, costume_name, "damaged")
-            else:
-                break
-
-        file_params = {
-            "action":       "query",
-            "prop":         "imageinfo",
-            "iiprop":       "url",
-            "titles":       "|".join(file_list.keys()),
-            "format":       "json",
-            "redirects":    1
-        }
-        file_bytes_ = await self.bot.fetch(GFWIKI_API, params=file_params)
-        file_data = json.loads(file_bytes_)
-
-        for n in file_data["query"].get("normalized", []):
-            file_list[n["to"]] = file_list[n["from"]]
-
-        skins = []
-        mod_skins = []
-        for file_info in file_data["query"]["pages"].values():
-            if "imageinfo" in file_info:
-                url = file_info["imageinfo"][0]["url"]
-                info = file_list[file_info["title"]]
-                skin = {
-                    "index": info[0],
-                    "name": info[1],
-                    "form": info[2],
-                    "image_url": url
-                }
-                if info[1] == "[Digimind Upgrade]":
-                    mod_skins.append(skin)
-                else:
-                    skins.append(skin)
-
-        skins.sort(key=lambda x: (-x["index"], x["form"]), reverse=True)
-        doll.skins = skins
-        mod["skins"] = mod_skins
-        doll.mod_data = mod
-
-        return doll
+            print(logs.get(name))
+            raise checks.CustomError(f"Failed to parse page {name}.")
 
     @doll.command()
     async def filter(self, ctx, *, data: modding.KeyValue(
@@ -1010,37 +1146,7 @@ class GirlsFrontline(commands.Cog):
         await self.update_equipments_with_names(ctx, names)
 
     async def update_equipments_with_names(self, ctx, names):
-        await ctx.send(f"Total: {len(names)} equipments")
-        msg = await ctx.send(f"Fetching...\n{utils.progress_bar(0)}")
-        passed = []
-        failed = []
-        logs = {}
-        count = len(names)
-        for i, name in enumerate(names):
-            try:
-                doll = await self.search_gfwiki(name)
-            except:
-                logs[name] = traceback.format_exc()
-                failed.append(name)
-            else:
-                passed.append(doll.name)
-                await self.doll_list.update_one(
-                    {"index": doll.index, "rarity": doll.rarity},
-                    {"$set": doll.__dict__},
-                    upsert=True
-                )
-            if (i+1)%10 == 0:
-                await msg.edit(content=f"Fetching...\n{utils.progress_bar((i+1)/count)}")
-        await msg.edit(content=f"Done.\n{utils.progress_bar(1)}")
-        txt = json.dumps({"passed": passed, "failed": failed}, indent=4)
-        if len(txt) > 1900:
-            await ctx.send(
-                f"Passed: {len(passed)}\nFailed: {len(failed)}",
-                file=discord.File.from_str(txt)
-            )
-        else:
-            await ctx.send(f"Passed: {len(passed)}\nFailed: {len(failed)}\n```json\n{txt}\n```")
-        return logs
+        return await self.update_with_names(ctx, names, "equipments")
 
 #==================================================================================================================================================
 
@@ -9,10 +9,118 @@ import random
 from PIL import Image
 import textwrap
 import traceback
+import pymongo
+import time
 
 #==================================================================================================================================================
 
 DEFAULT_WELCOME = "Eeeeehhhhhh, go away {mention}, I don't want any more work..."
+SETTINGS_TTL = 600
+
+#==================================================================================================================================================
+
+class GuildSettingsCache:
+    FIELDS = (
+        "log_channel_id", "log_message", "mute_role_id", "muted_member_ids", "nsfw_role_id",
+        "welcome_channel_id", "welcome_message", "welcome_rule",
+        "autorole_id", "autorole_type", "autorole_phrase", "autorole_response", "autorole_response_delete"
+    )
+
+    def __init__(self, collection, *, ttl=SETTINGS_TTL, loop=None):
+        self.collection = collection
+        self.ttl = ttl
+        self.loop = loop or asyncio.get_event_loop()
+        self.projection = {"_id": True, **{f: True for f in self.FIELDS}}
+        self.container = {}
+        self.object_ids = {}
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.watching = False
+        self.watch_task = self.loop.create_task(self.watch())
+
+    def _store(self, guild_id, doc):
+        doc = dict(doc or {})
+        object_id = doc.pop("_id", None)
+        if object_id is not None:
+            self.object_ids[object_id] = guild_id
+        settings = {key: value for key, value in doc.items() if key in self.FIELDS}
+        self.container[guild_id] = (settings, time.monotonic())
+        return settings
+
+    async def _load(self, guild_id):
+        doc = await self.collection.find_one({"guild_id": guild_id}, projection=self.projection)
+        return self._store(guild_id, doc)
+
+    async def get(self, guild_id):
+        item = self.container.get(guild_id)
+        if item:
+            settings, loaded_at = item
+            if self.watching or time.monotonic() - loaded_at < self.ttl:
+                self.hits += 1
+                return settings
+        self.misses += 1
+        fut = self.pending.get(guild_id)
+        if fut is None:
+            fut = self.loop.create_task(self._load(guild_id))
+            self.pending[guild_id] = fut
+            fut.add_done_callback(lambda f: self.pending.pop(guild_id, None))
+        return await asyncio.shield(fut)
+
+    async def update(self, guild_id, update, *, upsert=False):
+        doc = await self.collection.find_one_and_update(
+            {"guild_id": guild_id},
+            update,
+            projection=self.projection,
+            upsert=upsert,
+            return_document=pymongo.ReturnDocument.AFTER
+        )
+        return self._store(guild_id, doc)
+
+    def invalidate(self, guild_id=None):
+        if guild_id is None:
+            self.container.clear()
+        else:
+            self.container.pop(guild_id, None)
+
+    def apply_change(self, change):
+        op = change["operationType"]
+        if op in ("insert", "update", "replace"):
+            doc = change.get("fullDocument")
+            if doc and "guild_id" in doc:
+                self._store(doc["guild_id"], doc)
+            else:
+                guild_id = self.object_ids.get(change["documentKey"]["_id"])
+                if guild_id is not None:
+                    self.invalidate(guild_id)
+        elif op == "delete":
+            guild_id = self.object_ids.pop(change["documentKey"]["_id"], None)
+            if guild_id is not None:
+                self._store(guild_id, None)
+        else:
+            self.invalidate()
+
+    async def watch(self):
+        #change stream only works on replica set, otherwise fall back to ttl refresh
+        try:
+            async with self.collection.watch(full_document="updateLookup") as stream:
+                self.watching = True
+                async for change in stream:
+                    self.apply_change(change)
+        except (pymongo.errors.PyMongoError, asyncio.CancelledError):
+            pass
+        finally:
+            if self.watching:
+                self.watching = False
+                self.invalidate()
+
+    def cleanup(self):
+        self.watch_task.cancel()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
 
 #==================================================================================================================================================
 
@@ -25,7 +133,10 @@ class Guild(commands.Cog):
         self.bot = bot
         self.guild_data = bot.db.guild_data
         self.banned_emojis = set()
-        self.autorole_registration = {}
+        self.settings = GuildSettingsCache(self.guild_data, loop=bot.loop)
+
+    def cog_unload(self):
+        self.settings.cleanup()
 
     @modding.help(brief="Set up bot settings", category="Guild", field="Server management", paragraph=0)
     @commands.group(name="set")
@@ -214,7 +325,7 @@ class Guild(commands.Cog):
         '''
         role = discord.utils.find(lambda r: name.lower()==r.name.lower(), ctx.guild.roles)
         if role:
-            await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$set": {"nsfw_role_id": role.id}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
+            await self.settings.update(ctx.guild.id, {"$set": {"nsfw_role_id": role.id}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
             await ctx.confirm()
         else:
             raise checks.CustomError(f"No role named {name} found.")
@@ -225,7 +336,7 @@ class Guild(commands.Cog):
             `>>unset nsfwrole`
             Unset NSFW role.
         '''
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$unset": {"nsfw_role_id": None}})
+        await self.settings.update(ctx.guild.id, {"$unset": {"nsfw_role_id": None}})
         await ctx.confirm()
 
     @cmd_set.command(name="muterole")
@@ -238,7 +349,7 @@ class Guild(commands.Cog):
         '''
         role = discord.utils.find(lambda r: name.lower()==r.name.lower(), ctx.guild.roles)
         if role:
-            await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$set": {"mute_role_id": role.id}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
+            await self.settings.update(ctx.guild.id, {"$set": {"mute_role_id": role.id}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
             await ctx.confirm()
         else:
             raise checks.CustomError(f"No role named {name} found.")
@@ -249,7 +360,7 @@ class Guild(commands.Cog):
             `>>unset muterole`
             Unset muted role.
         '''
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$unset": {"mute_role_id": None}})
+        await self.settings.update(ctx.guild.id, {"$unset": {"mute_role_id": None}})
         await ctx.confirm()
 
     @modding.help(brief="Get/remove NSFW role, if applicable", category="Guild", field="Role", paragraph=1)
@@ -260,8 +371,8 @@ class Guild(commands.Cog):
             `>>creampie`
             Get/remove NSFW role, if applicable.
         '''
-        role_data = await self.guild_data.find_one({"guild_id": ctx.guild.id, "nsfw_role_id": {"$ne": None}}, projection={"_id": -1, "nsfw_role_id": 1})
-        if role_data:
+        role_data = await self.settings.get(ctx.guild.id)
+        if role_data.get("nsfw_role_id") is not None:
             role = discord.utils.find(lambda r: r.id==role_data["nsfw_role_id"], ctx.guild.roles)
             if role:
                 if role in ctx.author.roles:
@@ -280,7 +391,7 @@ class Guild(commands.Cog):
             A message will be sent to that channel every time a new member joined.
         '''
         target = channel or ctx.channel
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$set": {"welcome_channel_id": target.id}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
+        await self.settings.update(ctx.guild.id, {"$set": {"welcome_channel_id": target.id}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
         await ctx.confirm()
 
     @cmd_unset.command(name="welcome", aliases=["welcomechannel"])
@@ -289,7 +400,7 @@ class Guild(commands.Cog):
             `>>unset welcome`
             Unset welcome channel.
         '''
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$unset": {"welcome_channel_id": None}})
+        await self.settings.update(ctx.guild.id, {"$unset": {"welcome_channel_id": None}})
         await ctx.confirm()
 
     @cmd_set.command(name="welcomemessage")
@@ -304,7 +415,7 @@ class Guild(commands.Cog):
         except:
             await ctx.send("Format error. You sure read the instruction?")
         else:
-            await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$set": {"welcome_message": text}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
+            await self.settings.update(ctx.guild.id, {"$set": {"welcome_message": text}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
             await ctx.send(content)
 
     @cmd_unset.command(name="welcomemessage")
@@ -313,7 +424,7 @@ class Guild(commands.Cog):
             `>>unset welcomemessage`
             Unset custom welcome message and use the default one instead.
         '''
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$unset": {"welcome_message": None}})
+        await self.settings.update(ctx.guild.id, {"$unset": {"welcome_message": None}})
         await ctx.send(utils.str_format(f"Welcome message will be displayed as:\n{DEFAULT_WELCOME}", name=ctx.author.display_name, mention=ctx.author.mention, server=ctx.guild.name))
 
     @cmd_set.command(name="dmrule", aliases=["rule"])
@@ -328,7 +439,7 @@ class Guild(commands.Cog):
         except:
             await ctx.send("Format error. You sure read the instruction?")
         else:
-            await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$set": {"welcome_rule": text}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
+            await self.settings.update(ctx.guild.id, {"$set": {"welcome_rule": text}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
             await ctx.send(content)
 
     @cmd_unset.command(name="dmrule", aliases=["rule"])
@@ -337,7 +448,7 @@ class Guild(commands.Cog):
             `>>unset dmrule`
             Unset DM rule message.
         '''
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$unset": {"welcome_rule": None}})
+        await self.settings.update(ctx.guild.id, {"$unset": {"welcome_rule": None}})
         await ctx.confirm()
 
     @cmd_set.command(name="autorole")
@@ -406,15 +517,14 @@ class Guild(commands.Cog):
                 check = True
         else:
             check = False
-        await self.guild_data.update_one(
-            {"guild_id": ctx.guild.id},
+        await self.settings.update(
+            ctx.guild.id,
             {
                 "$set": {"autorole_id": role.id, "autorole_type": artype, "autorole_phrase": phrase, "autorole_response": response, "autorole_response_delete": check},
                 "$setOnInsert": {"guild_id": ctx.guild.id}
             },
             upsert=True
         )
-        self.autorole_registration[ctx.guild.id] = phrase
         await ctx.send("\U0001f44c Autorole is ready to go.")
 
     @cmd_unset.command(name="autorole")
@@ -423,9 +533,9 @@ class Guild(commands.Cog):
             `>>unset autorole`
             Unset auto assign/remove role for new member.
         '''
-        await self.guild_data.update_one(
-            {"guild_id": ctx.guild.id},
-            {"$unset": {"autorole_id": None, "autorole_type": None, "autorole_phrase": None, "autorole_response": None}}
+        await self.settings.update(
+            ctx.guild.id,
+            {"$unset": {"autorole_id": None, "autorole_type": None, "autorole_phrase": None, "autorole_response": None, "autorole_response_delete": None}}
         )
         await ctx.confirm()
 
@@ -439,7 +549,7 @@ class Guild(commands.Cog):
             Bot activity is excluded.
         '''
         target = channel or ctx.channel
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$set": {"log_channel_id": target.id}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
+        await self.settings.update(ctx.guild.id, {"$set": {"log_channel_id": target.id}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
         await ctx.confirm()
 
     @cmd_unset.command(name="log", aliases=["logchannel"])
@@ -448,7 +558,7 @@ class Guild(commands.Cog):
             `>>unset log`
             Unset log channel.
         '''
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$unset": {"log_channel_id": ""}})
+        await self.settings.update(ctx.guild.id, {"$unset": {"log_channel_id": ""}})
         await ctx.confirm()
 
     @cmd_set.command(name="logmessage")
@@ -458,7 +568,7 @@ class Guild(commands.Cog):
             Set message log.
             If log channel is set, this command enables message edit/delete log.
         '''
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$set": {"log_message": True}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
+        await self.settings.update(ctx.guild.id, {"$set": {"log_message": True}, "$setOnInsert": {"guild_id": ctx.guild.id}}, upsert=True)
         await ctx.confirm()
 
     @cmd_unset.command(name="logmessage")
@@ -467,7 +577,7 @@ class Guild(commands.Cog):
             `>>unset logmessage`
             Unset message log.
         '''
-        await self.guild_data.update_one({"guild_id": ctx.guild.id}, {"$unset": {"log_message": ""}})
+        await self.settings.update(ctx.guild.id, {"$unset": {"log_message": ""}})
         await ctx.confirm()
 
     @cmd_set.command(name="prefix", ignore_extra=False)
@@ -582,17 +692,9 @@ class Guild(commands.Cog):
         member = message.author
         if member.bot or not message.guild:
             return
-        check_not_in = message.guild.id not in self.autorole_registration
-        check_equal = message.content == self.autorole_registration.get(message.guild.id)
-        if check_not_in or check_equal:
-            guild_data = await self.guild_data.find_one(
-                {"guild_id": message.guild.id},
-                projection={"_id": False, "autorole_id": True, "autorole_type": True, "autorole_phrase": True, "autorole_response": True, "autorole_response_delete": True}
-            ) or {}
-            if check_not_in:
-                phrase = guild_data.get("autorole_phrase", False)
-                self.autorole_registration[message.guild.id] = phrase
-                check_equal = message.content == phrase
+        guild_data = await self.settings.get(message.guild.id)
+        phrase = guild_data.get("autorole_phrase")
+        check_equal = phrase is not None and message.content == phrase
         if check_equal:
             role = discord.utils.find(lambda r: r.id==guild_data["autorole_id"], message.guild.roles)
             if not role:
@@ -608,7 +710,7 @@ class Guild(commands.Cog):
                     await member.remove_roles(role)
                 else:
                     return
-            response = guild_data["autorole_response"]
+            response = guild_data.get("autorole_response")
             if response:
                 await message.channel.send(
                     utils.str_format(response, name=message.author.name, mention=message.author.mention, role=role.name, server=message.guild.name),
@@ -621,12 +723,7 @@ class Guild(commands.Cog):
         if member.bot:
             return
         guild = member.guild
-        guild_data = await self.guild_data.find_one(
-            {"guild_id": guild.id},
-            projection={
-                "_id": False, "log_channel_id": True, "welcome_channel_id": True, "welcome_message": True, "welcome_rule": True,
-                "autorole_type": True, "autorole_id": True, "mute_role_id": True, "muted_member_ids": True}
-        )
+        guild_data = await self.settings.get(guild.id)
         if guild_data:
             if member.id in guild_data.get("muted_member_ids", ()):
                 mute_role = discord.utils.find(lambda r: r.id==guild_data["mute_role_id"], guild.roles)
@@ -658,10 +755,7 @@ class Guild(commands.Cog):
         if member.bot:
             return
         guild = member.guild
-        guild_data = await self.guild_data.find_one(
-            {"guild_id": guild.id},
-            projection={"_id": False, "log_channel_id": True}
-        )
+        guild_data = await self.settings.get(guild.id)
         if guild_data:
             log_channel = guild.get_channel(guild_data.get("log_channel_id"))
             if log_channel:
@@ -676,10 +770,7 @@ class Guild(commands.Cog):
     async def on_member_ban(self, guild, user):
         if user.bot:
             return
-        guild_data = await self.guild_data.find_one(
-            {"guild_id": guild.id},
-            projection={"_id": False, "log_channel_id": True}
-        )
+        guild_data = await self.settings.get(guild.id)
         if guild_data:
             log_channel = guild.get_channel(guild_data.get("log_channel_id"))
             if log_channel:
@@ -694,17 +785,14 @@ class Guild(commands.Cog):
     async def on_member_update(self, before, after):
         if before.bot:
             return
-        guild = before.guild
-        guild_data = await self.guild_data.find_one(
-            {"guild_id": guild.id},
-            projection={"_id": False, "log_channel_id": True, "log_message": True, "mute_role_id": True, "muted_member_ids": True}
-        )
-        if guild_data:
-            old_roles = set(before.roles)
-            new_roles = set(after.roles)
-            nick_change = before.nick != after.nick
-            role_change = old_roles != new_roles
-            if nick_change or role_change:
+        old_roles = set(before.roles)
+        new_roles = set(after.roles)
+        nick_change = before.nick != after.nick
+        role_change = old_roles != new_roles
+        if nick_change or role_change:
+            guild = before.guild
+            guild_data = await self.settings.get(guild.id)
+            if guild_data:
                 embed = discord.Embed(colour=discord.Colour.dark_orange())
                 embed.add_field(name="Event", value="member_update", inline=False)
                 embed.add_field(name="ID", value=before.id)
@@ -718,13 +806,13 @@ class Guild(commands.Cog):
                     if add_roles:
                         embed.add_field(name="Roles add", value=", ".join([r.name for r in add_roles]), inline=False)
                         if guild_data.get("mute_role_id") in (r.id for r in add_roles):
-                            if before.id not in guild_data.get("muted_members", ()):
-                                await self.guild_data.update_one({"guild_id": guild.id}, {"$addToSet": {"muted_member_ids": before.id}})
+                            if before.id not in guild_data.get("muted_member_ids", ()):
+                                await self.settings.update(guild.id, {"$addToSet": {"muted_member_ids": before.id}})
                     if remove_roles:
                         embed.add_field(name="Roles remove", value=", ".join([r.name for r in remove_roles]), inline=False)
                         if guild_data.get("mute_role_id") in (r.id for r in remove_roles):
-                            if before.id in guild_data.get("muted_members", ()):
-                                await self.guild_data.update_one({"guild_id": guild.id}, {"$pull": {"muted_member_ids": before.id}})
+                            if before.id in guild_data.get("muted_member_ids", ()):
+                                await self.settings.update(guild.id, {"$pull": {"muted_member_ids": before.id}})
                 embed.set_footer(text=utils.format_time(utils.now_time()))
 
                 if guild_data.get("log_message"):
@@ -739,10 +827,7 @@ class Guild(commands.Cog):
         guild = message.guild
         if not guild:
             return
-        guild_data = await self.guild_data.find_one(
-            {"guild_id": guild.id},
-            projection={"_id": False, "log_channel_id": True, "log_message": True}
-        )
+        guild_data = await self.settings.get(guild.id)
         if guild_data:
             if guild_data.get("log_message"):
                 log_channel = guild.get_channel(guild_data.get("log_channel_id"))
@@ -776,10 +861,7 @@ class Guild(commands.Cog):
         guild = before.guild
         if not guild:
             return
-        guild_data = await self.guild_data.find_one(
-            {"guild_id": guild.id},
-            projection={"_id": False, "log_channel_id": True, "log_message": True}
-        )
+        guild_data = await self.settings.get(guild.id)
         if guild_data:
             if guild_data.get("log_message"):
                 log_channel = guild.get_channel(guild_data.get("log_channel_id"))
@@ -800,10 +882,7 @@ class Guild(commands.Cog):
         if messages:
             channel = messages[0].channel
             guild = channel.guild
-            guild_data = await self.guild_data.find_one(
-                {"guild_id": guild.id},
-                projection={"_id": False, "log_channel_id": True, "log_message": True}
-            )
+            guild_data = await self.settings.get(guild.id)
             if guild_data:
                 if guild_data.get("log_message"):
                     log_channel = guild.get_channel(guild_data.get("log_channel_id"))
@@ -816,6 +895,18 @@ class Guild(commands.Cog):
                         all_text = "\n".join((f"{m.created_at.strftime('%Y-%m-%d %I:%M:%S')} {m.id: <18} {m.author}\n{textwrap.indent(m.content, '    ')}" for m in messages))
                         await log_channel.send(embed=embed, file=discord.File(BytesIO(all_text.encode("utf-8")), filename="purged_messages.log"))
 
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def settingscache(self, ctx):
+        settings = self.settings
+        await ctx.send(
+            f"Cached guilds: {len(settings.container)}\n"
+            f"Hits: {settings.hits}\n"
+            f"Misses: {settings.misses}\n"
+            f"Hit rate: {settings.hit_rate*100:.2f}%\n"
+            f"Refresh: {'change stream' if settings.watching else f'TTL {settings.ttl}s'}"
+        )
+
     async def get_selfroles(self, guild):
         role_data = await self.guild_data.find_one({"guild_id": guild.id}, projection={"_id": -1, "selfrole_ids": 1})
         if role_data:
@@ -945,7 +1036,7 @@ class Guild(commands.Cog):
                 return await ctx.send("There's no member with any selfrole.")
             check_roles.append({"name": "All with selfroles", "count": {"": len(all_members)}, "color": (255, 255, 255, 255)})
 
-            bytes_ = await utils.bar_chart(check_roles, unit_y="members", unit_x="", loop=self.bot.loop)
+            bytes_ = await utils.bar_chart(check_roles, unit_y="members", unit_x="", loop=self.bot.loop, executor=self.bot.executors["image"])
             await ctx.send(file=discord.File(bytes_, filename="distribution.png"))
 
     @modding.help(brief="Give member mute role if applicable", category="Guild", field="Server management", paragraph=1)
@@ -959,8 +1050,8 @@ class Guild(commands.Cog):
             Can specify mute time in reason, i.e. `for 1 hour`.
             If no mute time is specified, mute indefinitely.
         '''
-        role_data = await self.guild_data.find_one({"guild_id": ctx.guild.id, "mute_role_id": {"$ne": None}}, projection={"_id": -1, "mute_role_id": 1})
-        if role_data:
+        role_data = await self.settings.get(ctx.guild.id)
+        if role_data.get("mute_role_id") is not None:
             muted_role = discord.utils.find(lambda r: r.id==role_data["mute_role_id"], ctx.guild.roles)
             await member.add_roles(muted_role)
             try:
@@ -994,8 +1085,8 @@ class Guild(commands.Cog):
             `>>unmute <member>`
             Remove muted role from member.
         '''
-        role_data = await self.guild_data.find_one({"guild_id": ctx.guild.id, "mute_role_id": {"$ne": None}}, projection={"_id": -1, "mute_role_id": 1})
-        if role_data:
+        role_data = await self.settings.get(ctx.guild.id)
+        if role_data.get("mute_role_id") is not None:
             muted_role = discord.utils.find(lambda r: r.id==role_data["mute_role_id"], ctx.guild.roles)
             await member.remove_roles(muted_role)
             await ctx.send(f"{member.mention} has been unmute.")
@@ -383,7 +383,9 @@ class Help(commands.Cog):
         bytes_ = await utils.fetch(
             bot.session,
             "https://api.github.com/repos/nguuuquaaa/Belphegor/commits",
-            headers={"User-Agent": owner.name}
+            headers={"User-Agent": owner.name},
+            cache=bot.http_cache,
+            ttl=300
         )
         now_time = utils.now_time()
         commits = json.loads(bytes_)
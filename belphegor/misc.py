@@ -19,6 +19,7 @@ import aiohttp
 from scipy.ndimage import filters
 import colorsys
 import inspect
+import itertools
 
 #==================================================================================================================================================
 
@@ -105,6 +106,17 @@ def generate_blank_char():
         yield "\u2003"
 
 blank_chars = generate_blank_char()
+
+def pack_bits(cells, weights=None):
+    if weights is None:
+        weights = 1 << np.arange(cells.shape[-1]-1, -1, -1)
+    return cells @ np.asarray(weights)
+
+BOX_TABLE = np.empty(4, dtype=object)
+for key, value in BOX_PATTERN.items():
+    BOX_TABLE[pack_bits(np.array(key))] = value
+DOT_WEIGHTS = [1 << (d - 1) for d in DOT_PATTERN]
+DOT_TABLE = np.array([chr(0x2800 + i) for i in range(256)], dtype=object)
 MOON_PATTERN = {
     (0, 0): "\U0001f311",
     (0, 1): "\U0001f312",
@@ -136,6 +148,10 @@ class CharImage:
         rating = (rating - inverse_weight * inverse_rating) * self.weight
         return rating
 
+MOON_TABLE = np.empty((3, 3), dtype=object)
+for key, value in MOON_PATTERN.items():
+    MOON_TABLE[key] = value
+
 #==================================================================================================================================================
 
 class Misc(commands.Cog):
@@ -196,9 +212,9 @@ class Misc(commands.Cog):
         streak = ""
         while True:
             try:
-                reaction, user = await self.bot.wait_for(
-                    "reaction_add",
-                    check=lambda r,u: u.id==ctx.author.id and r.emoji in possible_reactions and r.message.id==message.id,
+                reaction, user = await self.bot.event_router.wait_for_reaction(
+                    message,
+                    check=lambda r,u: u.id==ctx.author.id and r.emoji in possible_reactions,
                     timeout=30
                 )
             except asyncio.TimeoutError:
@@ -706,8 +722,8 @@ class Misc(commands.Cog):
                 embed.set_image(url=message.attachments[0].url)
             await ctx.send(embed=embed)
 
-    def to_ascii(self, image, width, height):
-        image = image.resize((width, height)).convert("L")
+    def to_ascii(self, bytes_, width, height):
+        image = utils.ingest_image(bytes_, size=(width, height), mode="L")
 
         pixels = image.getdata()
         chars = [ASCII[int(p/RANGE)] for p in pixels]
@@ -727,13 +743,8 @@ class Misc(commands.Cog):
         url = data.get("url", str(target.avatar_url_as(format="png")))
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
-        try:
-            image = Image.open(BytesIO(bytes_))
-        except OSError:
-            return await ctx.send("Cannot identify image.")
-        image = Image.open(BytesIO(bytes_))
-        text = self.to_ascii(image, 64, 30)
+        bytes_ = await self.bot.fetch(url, cache=True)
+        text = await self.bot.loop.run_in_executor(self.bot.executors["image"], self.to_ascii, bytes_, 64, 30)
         await ctx.send(f"```\n{text}\n```")
 
     @modding.help(brief="Bigger grayscale ascii art", category="Misc", field="Processing", paragraph=2)
@@ -753,12 +764,8 @@ class Misc(commands.Cog):
             return await ctx.send("Width should be 64 or more.")
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
-        try:
-            image = Image.open(BytesIO(bytes_))
-        except OSError:
-            return await ctx.send("Cannot identify image.")
-        text = await self.bot.loop.run_in_executor(None, self.to_ascii, image, width, width//2)
+        bytes_ = await self.bot.fetch(url, cache=True)
+        text = await self.bot.loop.run_in_executor(self.bot.executors["image"], self.to_ascii, bytes_, width, width//2)
         await ctx.send(file=discord.File(BytesIO(text.encode("utf-8")), filename=f"ascii_{len(text)}_chars.txt"))
 
     def setup_ascii_chars(self):
@@ -791,31 +798,100 @@ class Misc(commands.Cog):
         for c in ("A", "C", "D", "H", "I", "J", "K", "L", "M", "N", "O", "S", "T", "U", "V", "W", "X", "Y", "Z"):
             self.chars[c].weight = 0.6
 
-    def convert_image_to_ascii(self, image, image_proc, per_cut, width, height, char_width, char_height, threshold, inverse):
-        width = width
-        height = height
-        char_width = char_width
-        char_height = char_height
-        full_width = width * char_width
-        full_height = height * char_height
+        self.glyph_chars = np.array(list(self.chars.keys()), dtype=object)
+        self.glyph_matrix = np.array([im.raw.flatten() for im in self.chars.values()], dtype=np.float64).T
+        self.glyph_sums = np.array([im.sum_raw for im in self.chars.values()], dtype=np.float64)
+        self.glyph_weights = np.array([im.weight for im in self.chars.values()], dtype=np.float64)
 
-        raw = []
-        image = image.resize((full_width, full_height)).convert("L")
+    def image_to_cells(self, bytes_, image_proc, width, height, char_width, char_height, threshold, inverse):
+        image = utils.ingest_image(bytes_, size=(width*char_width, height*char_height), mode="L")
         if image_proc:
             image = image_proc(image)
-        raw_pixels = np.array(image)
-        pixels = np.where(raw_pixels>threshold, 1-inverse, inverse)
-        range_height = range(char_height)
-        range_width = range(char_width)
+        pixels = np.where(np.array(image)>threshold, 1-inverse, inverse)
+        return pixels.reshape(height, char_height, width, char_width).swapaxes(1, 2).reshape(height, width, char_height*char_width)
 
-        for y in range(0, full_height, char_height):
-            for x in range(0, full_width, char_width):
-                cut = pixels[y:y+char_height, x:x+char_width]
-                raw.append(per_cut(cut))
-
-        t = lstrip_generator(("".join(raw[i:i+width]).rstrip() for i in range(0, width*height, width)))
+    def cells_to_text(self, chars):
+        t = lstrip_generator(("".join(row).rstrip() for row in chars))
         return "\n".join(t)
 
+    def edge_chars(self, cells, inverse_weight):
+        rating = cells @ self.glyph_matrix
+        inverse_rating = self.glyph_sums - rating
+        rating = (rating - inverse_weight * inverse_rating) * self.glyph_weights
+        return self.glyph_chars[np.argmax(rating, axis=-1)]
+
+    def block_chars(self, cells):
+        return BOX_TABLE[pack_bits(cells)]
+
+    def dot_chars(self, cells):
+        return DOT_TABLE[pack_bits(cells, DOT_WEIGHTS)]
+
+    def moon_chars(self, cells):
+        cells = cells.reshape(*cells.shape[:2], 4, 4)
+        left = np.sum(cells[..., 0:2], axis=(-2, -1)) // 3
+        right = np.sum(cells[..., 2:4], axis=(-2, -1)) // 3
+        return MOON_TABLE[left, right]
+
+    def ascii_edge_text(self, bytes_, image_proc, width, height, threshold, inverse, inverse_weight):
+        cells = self.image_to_cells(bytes_, image_proc, width, height, *CHAR_SIZE, threshold, inverse)
+        return self.cells_to_text(self.edge_chars(cells, inverse_weight))
+
+    def ascii_block_text(self, bytes_, width, height, threshold, inverse):
+        cells = self.image_to_cells(bytes_, None, width, height, 1, 2, threshold, inverse)
+        return self.cells_to_text(self.block_chars(cells))
+
+    def ascii_dot_text(self, bytes_, width, height, threshold, inverse):
+        cells = self.image_to_cells(bytes_, None, width, height, 2, 4, threshold, inverse)
+        chars = self.dot_chars(cells)
+        blank = chars == DOT_TABLE[0]
+        chars[blank] = list(itertools.islice(blank_chars, int(np.count_nonzero(blank))))
+        return self.cells_to_text(chars)
+
+    def ascii_moon_text(self, bytes_, width, height, threshold, inverse):
+        cells = self.image_to_cells(bytes_, None, width, height, 4, 4, threshold, inverse)
+        return self.cells_to_text(self.moon_chars(cells))
+
+    def benchmark_ascii(self, bytes_, repeat=5):
+        chars = self.chars.items()
+
+        def edge_cell(cell):
+            best_weight = -float("inf")
+            best_char = None
+            for c, im in chars:
+                weight = im.compare(cell.reshape(CHAR_SIZE[1], CHAR_SIZE[0]), 5.0)
+                if weight > best_weight:
+                    best_weight = weight
+                    best_char = c
+            return best_char
+
+        def dot_cell(cell):
+            pos = [str(p) for i, p in enumerate(DOT_PATTERN) if cell[i] == 1]
+            pos.sort()
+            return unicodedata.lookup(f"BRAILLE PATTERN DOTS-{''.join(pos)}") if pos else DOT_TABLE[0]
+
+        def moon_cell(cell):
+            cell = cell.reshape(4, 4)
+            return MOON_PATTERN[(np.sum(cell[:, 0:2])//3, np.sum(cell[:, 2:4])//3)]
+
+        modes = (
+            ("edge", (64, 30, *CHAR_SIZE), edge_cell, lambda cells: self.edge_chars(cells, 5.0)),
+            ("block", (64, 30, 1, 2), lambda cell: BOX_PATTERN[tuple(cell)], self.block_chars),
+            ("dot", (56, 32, 2, 4), dot_cell, self.dot_chars),
+            ("moon", (20, 24, 4, 4), moon_cell, self.moon_chars)
+        )
+        report = []
+        for name, size, per_cell, vectorized in modes:
+            cells = self.image_to_cells(bytes_, None, *size, 128, 0)
+            start = time.perf_counter()
+            expected = [[per_cell(cell) for cell in row] for row in cells]
+            loop_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for i in range(repeat):
+                result = vectorized(cells)
+            vector_time = (time.perf_counter() - start) / repeat
+            report.append((name, loop_time, vector_time, result.tolist() == expected))
+        return report
+
     def check_threshold(self, threshold, *, max=255):
         if threshold > max:
             raise checks.CustomError("Threshold is too big.")
@@ -873,11 +949,7 @@ class Misc(commands.Cog):
             return await ctx.send("Inverse weight value should be a non-negative number.")
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
-        try:
-            image = Image.open(BytesIO(bytes_))
-        except OSError:
-            return await ctx.send("Cannot identify image.")
+        bytes_ = await self.bot.fetch(url, cache=True)
 
         def image_proc(image):
             if edge:
@@ -886,25 +958,13 @@ class Misc(commands.Cog):
                 image = image.filter(ImageFilter.GaussianBlur(radius=blur))
             return image
 
-        chars = self.chars.items()
-        inf = -float("inf")
-        def per_cut(cut):
-            best_weight = inf
-            best_char = None
-            for c, im in chars:
-                weight = im.compare(cut, inverse_weight)
-                if weight > best_weight:
-                    best_weight = weight
-                    best_char = c
-            return best_char
-
         def do_stuff():
             start = time.perf_counter()
-            ret = self.convert_image_to_ascii(image, image_proc, per_cut, width, height, *CHAR_SIZE, threshold, inverse)
+            ret = self.ascii_edge_text(bytes_, image_proc, width, height, threshold, inverse, inverse_weight)
             end = time.perf_counter()
             return ret, end-start
 
-        result, time_taken = await self.bot.loop.run_in_executor(None, do_stuff)
+        result, time_taken = await self.bot.loop.run_in_executor(self.bot.executors["image"], do_stuff)
         await ctx.send(f"Result in {time_taken*1000:.2f}ms```\n{result}\n```")
 
     @ascii_edge.error
@@ -936,16 +996,9 @@ class Misc(commands.Cog):
         threshold, width, height = self.get_params(threshold, size)
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
-        try:
-            image = Image.open(BytesIO(bytes_))
-        except OSError:
-            return await ctx.send("Cannot identify image.")
-
-        def per_cut(cut):
-            return BOX_PATTERN[tuple(cut.flatten())]
+        bytes_ = await self.bot.fetch(url, cache=True)
 
-        result = self.convert_image_to_ascii(image, None, per_cut, width, height, 1, 2, threshold, inverse)
+        result = await self.bot.loop.run_in_executor(self.bot.executors["image"], self.ascii_block_text, bytes_, width, height, threshold, inverse)
         await ctx.send(f"```\n{result}\n```")
 
     @modding.help(brief="Braille dot ascii art", category="Misc", field="Processing", paragraph=2)
@@ -968,22 +1021,9 @@ class Misc(commands.Cog):
         threshold, width, height = self.get_params(threshold, size)
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
-        try:
-            image = Image.open(BytesIO(bytes_))
-        except OSError:
-            return await ctx.send("Cannot identify image.")
-
-        def per_cut(cut):
-            cut = cut.flatten()
-            pos = [str(p) for i, p in enumerate(DOT_PATTERN) if cut[i] == 1]
-            if pos:
-                pos.sort()
-                return unicodedata.lookup(f"BRAILLE PATTERN DOTS-{''.join(pos)}")
-            else:
-                return next(blank_chars)
+        bytes_ = await self.bot.fetch(url, cache=True)
 
-        result = await self.bot.loop.run_in_executor(None, self.convert_image_to_ascii, image, None, per_cut, width, height, 2, 4, threshold, inverse)
+        result = await self.bot.loop.run_in_executor(self.bot.executors["image"], self.ascii_dot_text, bytes_, width, height, threshold, inverse)
         if result.isspace():
             await ctx.send("Result is all blank. Maybe you should try tweaking threshold a little?")
         else:
@@ -1009,19 +1049,22 @@ class Misc(commands.Cog):
         threshold, width, height = self.get_params(threshold, size)
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
-        try:
-            image = Image.open(BytesIO(bytes_))
-        except OSError:
-            return await ctx.send("Cannot identify image.")
+        bytes_ = await self.bot.fetch(url, cache=True)
 
-        def per_cut(cut):
-            pt = (np.sum(cut[:, 0:2])//3, np.sum(cut[:, 2:4])//3)
-            return MOON_PATTERN[pt]
-
-        result = await self.bot.loop.run_in_executor(None, self.convert_image_to_ascii, image, None, per_cut, width, height, 4, 4, threshold, inverse)
+        result = await self.bot.loop.run_in_executor(self.bot.executors["image"], self.ascii_moon_text, bytes_, width, height, threshold, inverse)
         await ctx.send(f"```\n{result}\n```")
 
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def asciibench(self, ctx, member: discord.Member=None):
+        target = member or ctx.author
+        bytes_ = await self.bot.fetch(str(target.avatar_url_as(format="png")), cache=True)
+        report = await self.bot.loop.run_in_executor(self.bot.executors["image"], self.benchmark_ascii, bytes_)
+        lines = [f"{'mode': <8}{'loop': >10}{'vector': >10}{'x': >7}"]
+        for name, loop_time, vector_time, same in report:
+            lines.append(f"{name: <8}{loop_time*1000: >8.2f}ms{vector_time*1000: >8.2f}ms{loop_time/vector_time: >6.1f}x{'' if same else ' DIFF'}")
+        await ctx.send("```\n{}\n```".format("\n".join(lines)))
+
     @modding.help(brief="pong", category=None, field="Other", paragraph=0)
     @commands.command(name="ping")
     async def cmd_ping(self, ctx):
@@ -1091,11 +1134,10 @@ class Misc(commands.Cog):
         self.check_threshold(threshold, max=255*4)
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
+        bytes_ = await self.bot.fetch(url, cache=True)
 
         def do_stuff():
-            image = Image.open(BytesIO(bytes_)).convert("RGBA")
-            a = np.array(image)
+            a = utils.ingest_image(bytes_, mode="RGBA", as_array=True)
             t = np.dot(a[:, :, :3], [0.2989, 0.5870, 0.1140])
             t = np.array((r/threshold, g/threshold, b/threshold), dtype=np.float32) * t[:, :, None]
             if a.shape[2] == 4:
@@ -1109,7 +1151,7 @@ class Misc(commands.Cog):
             bio.seek(0)
             return bio
 
-        bytes_2 = await self.bot.loop.run_in_executor(None, do_stuff)
+        bytes_2 = await self.bot.loop.run_in_executor(self.bot.executors["image"], do_stuff)
         await ctx.send(file=discord.File(bytes_2, "monochrome.png"))
 
     def rgb_to_hsv(self, rgb):
@@ -1198,15 +1240,14 @@ class Misc(commands.Cog):
         mode_func = getattr(self, f"{mode}_{func}")
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
+        bytes_ = await self.bot.fetch(url, cache=True)
 
         from_rgb = getattr(self, f"rgb_to_{mode}")
         to_rgb = getattr(self, f"{mode}_to_rgb")
         h, s, x = from_rgb(np.array([r, g, b]))
 
         def do_stuff():
-            image = Image.open(BytesIO(bytes_)).convert("RGBA")
-            a = np.array(image)
+            a = utils.ingest_image(bytes_, mode="RGBA", as_array=True)
             hsx = from_rgb(a)
             hsx[..., 0] = h
             hsx[..., 1] = mode_func(hsx[..., 1], s, 1)
@@ -1219,7 +1260,7 @@ class Misc(commands.Cog):
             bio.seek(0)
             return bio
 
-        bytes_2 = await self.bot.loop.run_in_executor(None, do_stuff)
+        bytes_2 = await self.bot.loop.run_in_executor(self.bot.executors["image"], do_stuff)
         await ctx.send(file=discord.File(bytes_2, "monochrome.png"))
 
     def rgb_to_hsl(self, rgb):
@@ -1300,7 +1341,7 @@ class Misc(commands.Cog):
             return await ctx.send("Sigma must be a positive number.")
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
+        bytes_ = await self.bot.fetch(url, cache=True)
 
         def dodge(front, back):
             result = front * 255 / (255 - back)
@@ -1309,8 +1350,7 @@ class Misc(commands.Cog):
             return result.astype("uint8")
 
         def do_stuff():
-            image = Image.open(BytesIO(bytes_)).convert("RGB")
-            a = np.array(image)
+            a = utils.ingest_image(bytes_, mode="RGB", as_array=True)
             gray = np.dot(a[:, :, :3], [0.2989, 0.5870, 0.1140])
             invert = 255 - gray
             blur = filters.gaussian_filter(invert, sigma=sigma)
@@ -1322,7 +1362,7 @@ class Misc(commands.Cog):
             bio.seek(0)
             return bio
 
-        bytes_2 = await self.bot.loop.run_in_executor(None, do_stuff)
+        bytes_2 = await self.bot.loop.run_in_executor(self.bot.executors["image"], do_stuff)
         await ctx.send(file=discord.File(bytes_2, "sketch.png"))
 
     @modding.help(brief="Turn avatar into sketch", category="Misc", field="Processing", paragraph=1)
@@ -1343,14 +1383,13 @@ class Misc(commands.Cog):
             return await ctx.send("Depth must be a positive number.")
 
         await ctx.trigger_typing()
-        bytes_ = await self.bot.fetch(url)
+        bytes_ = await self.bot.fetch(url, cache=True)
 
         ele = np.pi/2.2
         azi = np.pi/4
 
         def do_stuff():
-            image = Image.open(BytesIO(bytes_)).convert("L")
-            a = np.array(image).astype("float")
+            a = utils.ingest_image(bytes_, mode="L", as_array=True).astype("float")
             grad = np.gradient(a)
             grad_x, grad_y = grad
             gd = np.cos(ele)
@@ -1372,7 +1411,7 @@ class Misc(commands.Cog):
             bio.seek(0)
             return bio
 
-        bytes_2 = await self.bot.loop.run_in_executor(None, do_stuff)
+        bytes_2 = await self.bot.loop.run_in_executor(self.bot.executors["image"], do_stuff)
         await ctx.send(file=discord.File(bytes_2, "sketch2.png"))
 
     @modding.help(brief="[Elementary cellular automaton](https://en.wikipedia.org/wiki/Elementary_cellular_automaton)", category="Misc", field="Processing", paragraph=0)
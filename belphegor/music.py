@@ -6,23 +6,47 @@ from .utils import config, token, data_type, checks, modding
 from apiclient.discovery import build
 from discord.opus import Encoder as OpusEncoder
 import queue
-from threading import Thread
+import time
+from threading import Thread, Condition, Lock, local
 from io import BytesIO
 import json
 import locale
 import random
 import re
+import pymongo
 from pymongo import ReturnDocument
+import traceback
 import copy
 import weakref
 import youtube_dl
 import functools
+import collections
+import subprocess
+import shlex
+import httplib2
 
 #==================================================================================================================================================
 
 youtube_match = re.compile(r"(?:https?\:\/\/)?(?:www\.)?(?:youtube(?:-nocookie)?\.com\/\S*[^\w\s-]|youtu\.be\/)([\w-]{11})(?:[^\w\s-]|$)")
 BUFFER_SIZE = 3000
+READAHEAD_FRAMES = 50
 MAX_PLAYLIST_SIZE = 1000
+PREFETCH_DEPTH = 1
+TRANSITION_HISTORY = 50
+OPUS_PASSTHROUGH = True
+OPUS_BITRATE = "128k"
+FFMPEG_BEFORE_OPTIONS = "-hide_banner -nostats -loglevel 0 -reconnect 1"
+OPUS_SILENCE = b"\xf8\xff\xfe"
+SOURCE_READY_TIMEOUT = 10
+YOUTUBE_RATE = 10
+METADATA_CACHE_SIZE = 2000
+SEARCH_TTL = 3600
+VIDEO_TTL = 3600
+PLAYLIST_TTL = 600
+STREAM_TTL = 1800
+JOURNAL_FLUSH_TIME = 5
+LOAD_RETRIES = 3
+LOAD_RETRY_DELAY = 2
 
 ytdl_format_options = {
     "format": "bestaudio/best",
@@ -41,64 +65,451 @@ ytdl_extract_info = functools.partial(ytdl.extract_info, download=False)
 
 #==================================================================================================================================================
 
-class Buffer(queue.Queue):
-    def get(self):
-        with self.not_empty:
-            if not self.queue:
-                self.not_empty.wait()
-            item = self.queue.popleft()
-            self.not_full.notify()
-            return item
-
-    def _discard(self, number):
-        with self.not_empty:
-            item = None
-            for i in range(min(number, len(self.queue))):
-                item = self.queue.popleft()
-                if item[0] == b"":
-                    self.queue.append((b"", item[1]))
-                    break
-            self.not_full.notify()
-            return item[1]
+class FrameBuffer:
+    def __init__(self, frames, frame_size, *, readahead=READAHEAD_FRAMES):
+        self.frame_size = frame_size
+        self.capacity = frames * frame_size
+        self.readahead = readahead * frame_size
+        self._data = bytearray(self.capacity)
+        self._view = memoryview(self._data)
+        self.written = 0
+        self.consumed = 0
+        self.eof = False
+        self.closed = False
+        self.tail = b""
+        self._cond = Condition()
+
+    @property
+    def counter(self):
+        return self.consumed // self.frame_size
+
+    def available(self):
+        return (self.written - self.consumed) // self.frame_size
+
+    def _free(self):
+        return self.capacity - (self.written - self.consumed)
+
+    def _advance(self, size):
+        was_waiting = self._free() < self.readahead
+        self.consumed += size
+        if was_waiting and self._free() >= self.readahead:
+            self._cond.notify_all()
+
+    def fill(self, stream):
+        capacity = self.capacity
+        cond = self._cond
+        while True:
+            with cond:
+                while self._free() < self.readahead and not self.closed:
+                    cond.wait()
+                if self.closed:
+                    return
+                start = self.written % capacity
+                size = min(capacity - start, self._free(), self.readahead)
+            try:
+                count = stream.readinto1(self._view[start:start+size])
+            except (OSError, ValueError):
+                count = 0
+            with cond:
+                if count:
+                    was_starved = self.written - self.consumed < self.frame_size
+                    self.written += count
+                    if was_starved:
+                        cond.notify_all()
+                else:
+                    self.eof = True
+                    cond.notify_all()
+                    return
+
+    def read(self):
+        frame_size = self.frame_size
+        with self._cond:
+            while self.written - self.consumed < frame_size:
+                if self.closed:
+                    return self.tail
+                if self.eof:
+                    return b""
+                self._cond.wait()
+            start = self.consumed % self.capacity
+            frame = bytes(self._view[start:start+frame_size])
+            self._advance(frame_size)
+            return frame
+
+    def skip(self, number):
+        with self._cond:
+            self._advance(min(number, self.available()) * self.frame_size)
+            return self.counter
+
+    def wait_ready(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.written - self.consumed >= self.frame_size or self.eof or self.closed, timeout)
+
+    def close(self, tail=b""):
+        with self._cond:
+            if not self.closed:
+                self.closed = True
+                self.tail = tail
+            self._cond.notify_all()
+
+def benchmark_buffers(seconds=120, repeat=3):
+    frame_size = OpusEncoder.FRAME_SIZE
+    pcm = bytes(frame_size * 50 * seconds)
+
+    def queue_run():
+        q = queue.Queue(BUFFER_SIZE)
+        stream = BytesIO(pcm)
+
+        def fill():
+            counter = 0
+            while True:
+                chunk = stream.read(frame_size)
+                counter += 1
+                if len(chunk) != frame_size:
+                    q.put((b"", counter))
+                    return
+                q.put((chunk, counter))
+
+        thread = Thread(target=fill, daemon=True)
+        thread.start()
+        while q.get()[0]:
+            pass
+        thread.join()
+
+    def ring_run():
+        buffer = FrameBuffer(BUFFER_SIZE, frame_size)
+        thread = Thread(target=buffer.fill, args=(BytesIO(pcm),), daemon=True)
+        thread.start()
+        while buffer.read():
+            pass
+        thread.join()
+
+    report = []
+    for name, func in (("queue", queue_run), ("ring", ring_run)):
+        wall = cpu = float("inf")
+        for i in range(repeat):
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+            func()
+            cpu = min(cpu, time.process_time()-start_cpu)
+            wall = min(wall, time.perf_counter()-start_wall)
+        report.append((name, wall, cpu))
+    return seconds * 50, report
 
 #==================================================================================================================================================
 
 class FFmpegWithBuffer(discord.FFmpegPCMAudio):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self._buffer = Buffer(BUFFER_SIZE)
+    def __init__(self, *args, start=0, before_options=FFMPEG_BEFORE_OPTIONS, **kwargs):
+        if start:
+            before_options = f"{before_options} -ss {start*0.02:.2f}"
+        super().__init__(*args, before_options=before_options, **kwargs)
+        self.start = start
+        self._buffer = FrameBuffer(BUFFER_SIZE, OpusEncoder.FRAME_SIZE)
+        thread = Thread(target=self._buffer.fill, args=(self._stdout,))
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def counter(self):
+        return self.start + self._buffer.counter
+
+    def buffered(self):
+        return self._buffer.available()
+
+    def read(self):
+        return self._buffer.read()
+
+    def fast_forward(self, number):
+        return self._buffer.skip(number)
+
+    def wait_ready(self, timeout=SOURCE_READY_TIMEOUT):
+        return self._buffer.wait_ready(timeout)
+
+    def retire(self):
+        self._buffer.close(bytes(OpusEncoder.FRAME_SIZE))
+        self.cleanup()
+
+    def cleanup(self):
+        self._buffer.close()
+        super().cleanup()
+
+#==================================================================================================================================================
+
+class PacketBuffer:
+    def __init__(self, size):
+        self.size = size
+        self.packets = collections.deque()
         self.counter = 0
-        self._is_running = True
+        self.eof = False
+        self.closed = False
+        self.tail = b""
+        self._cond = Condition()
+
+    def put_many(self, packets):
+        with self._cond:
+            while len(self.packets) >= self.size and not self.closed:
+                self._cond.wait()
+            if self.closed:
+                return False
+            was_empty = not self.packets
+            self.packets.extend(packets)
+            if was_empty:
+                self._cond.notify_all()
+            return True
+
+    def finish(self):
+        with self._cond:
+            self.eof = True
+            self._cond.notify_all()
+
+    def read(self):
+        with self._cond:
+            while not self.packets:
+                if self.closed:
+                    return self.tail
+                if self.eof:
+                    return b""
+                self._cond.wait()
+            self.counter += 1
+            packet = self.packets.popleft()
+            if len(self.packets) == self.size - 1:
+                self._cond.notify_all()
+            return packet
+
+    def skip(self, number):
+        with self._cond:
+            number = min(number, len(self.packets))
+            was_full = len(self.packets) >= self.size
+            for i in range(number):
+                self.packets.popleft()
+            self.counter += number
+            if was_full and number:
+                self._cond.notify_all()
+            return self.counter
+
+    def wait_ready(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.packets or self.eof or self.closed, timeout)
+
+    def close(self, tail=b""):
+        with self._cond:
+            if not self.closed:
+                self.closed = True
+                self.tail = tail
+            self._cond.notify_all()
+
+def read_ogg_pages(stream):
+    partial = b""
+    while True:
+        header = stream.read(27)
+        if len(header) < 27 or header[:4] != b"OggS":
+            return
+        segments = stream.read(header[26])
+        body = stream.read(sum(segments))
+        packets = []
+        start = 0
+        end = 0
+        for lacing in segments:
+            end += lacing
+            if lacing < 255:
+                packets.append(partial + body[start:end])
+                partial = b""
+                start = end
+        partial += body[start:end]
+        yield packets
+
+class FFmpegOpusWithBuffer(discord.AudioSource):
+    def __init__(self, source, *, codec=None, volume=1.0, start=0, before_options=FFMPEG_BEFORE_OPTIONS):
+        self.volume = volume
+        args = ["ffmpeg", *shlex.split(before_options)]
+        if start:
+            args.extend(("-ss", f"{start*0.02:.2f}"))
+        args.extend(("-i", source, "-map", "0:a:0", "-vn"))
+        if codec == "opus" and volume == 1.0:
+            args.extend(("-c:a", "copy"))
+        else:
+            args.extend(("-c:a", "libopus", "-b:a", OPUS_BITRATE, "-ar", "48000", "-ac", "2"))
+            if volume != 1.0:
+                args.extend(("-af", f"volume={volume:.2f}"))
+        args.extend(("-f", "ogg", "pipe:1"))
+        try:
+            self._process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise discord.ClientException("ffmpeg was not found.") from None
+        self._buffer = PacketBuffer(BUFFER_SIZE)
+        self._buffer.counter = start
         thread = Thread(target=self.read_buffer, args=())
         thread.daemon = True
         thread.start()
 
-    def read(self):
-        item = self._buffer.get()
-        self.counter = item[1]
-        return item[0]
+    @property
+    def counter(self):
+        return self._buffer.counter
+
+    def buffered(self):
+        return len(self._buffer.packets)
 
     def read_buffer(self):
-        counter = 0
-        while self._is_running:
-            chunk = self._stdout.read(OpusEncoder.FRAME_SIZE)
-            counter += 1
-            if len(chunk) != OpusEncoder.FRAME_SIZE:
-                self._buffer.put((b"", counter))
-                return
-            self._buffer.put((chunk, counter))
+        try:
+            pages = read_ogg_pages(self._process.stdout)
+            header_packets = 2
+            for packets in pages:
+                if header_packets:
+                    skipped = min(header_packets, len(packets))
+                    header_packets -= skipped
+                    packets = packets[skipped:]
+                if packets and not self._buffer.put_many(packets):
+                    return
+        except (OSError, ValueError):
+            pass
+        self._buffer.finish()
+
+    def read(self):
+        return self._buffer.read()
+
+    def is_opus(self):
+        return True
 
     def fast_forward(self, number):
-        return self._buffer._discard(number)
+        return self._buffer.skip(number)
+
+    def wait_ready(self, timeout=SOURCE_READY_TIMEOUT):
+        return self._buffer.wait_ready(timeout)
+
+    def retire(self):
+        self._buffer.close(OPUS_SILENCE)
+        self.cleanup()
 
     def cleanup(self):
-        self._is_running = False
-        super().cleanup()
+        self._buffer.close()
+        proc = self._process
+        if proc is not None:
+            self._process = None
+            proc.kill()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                pass
+
+#==================================================================================================================================================
+
+def select_stream(data):
+    if not data.get("formats"):
+        return None
+    audios = []
+    others = []
+    for f in data["formats"]:
+        if f.get("abr"):
+            audios.append(f)
+        else:
+            others.append(f)
+    audios.sort(key=lambda x: x["abr"], reverse=True)
+    others.sort(key=lambda x: x.get("tbr", 0), reverse=True)
+    f = {}
+    for a in audios:
+        if 72 < a["abr"] < f.get("abr", 9999):
+            f = a
+    if not f:
+        f = utils.get_element(others, lambda x: 144 < x.get("height", 0) < 720, default=utils.get_element(others, 0))
+    return {"url": f["url"], "codec": f.get("acodec"), "duration": data.get("duration")}
+
+def video_key(url):
+    m = youtube_match.match(url)
+    if m:
+        return m.group(1)
+    else:
+        return url
+
+class YoutubeMetadata:
+    def __init__(self, bot, *, rate=YOUTUBE_RATE, cache_size=METADATA_CACHE_SIZE):
+        self.bot = bot
+        self.youtube = build("youtube", "v3", developerKey=token.GOOGLE_CLIENT_API_KEY)
+        self.limiter = utils.RateLimiter(rate, loop=bot.loop)
+        self.cache = data_type.LRUCache(cache_size)
+        self.pending = {}
+        self._local = local()
+
+    def execute(self, request):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = httplib2.Http()
+        return request.execute(http=http)
+
+    async def get(self, key, ttl, func, *args):
+        item = self.cache.peek(key)
+        if item and item[0] > time.time():
+            #peek first so expired entries are counted as misses
+            return self.cache.get(key)[1]
+        self.cache.misses += 1
+        task = self.pending.get(key)
+        if not task:
+            task = self.pending[key] = self.bot.loop.create_task(self.fetch(key, ttl, func, args))
+        return await asyncio.shield(task)
+
+    async def fetch(self, key, ttl, func, args):
+        try:
+            async with self.limiter:
+                value = await self.bot.loop.run_in_executor(self.bot.executors["io"], func, *args)
+            self.cache[key] = (time.time()+ttl, value)
+            return value
+        finally:
+            self.pending.pop(key, None)
+
+    def _search(self, query, type):
+        response = self.execute(self.youtube.search().list(q=query, part="id,snippet", type=type, maxResults=10))
+        return response.get("items", [])[:5]
+
+    async def search(self, query, type="video"):
+        return await self.get(("search", type, query), SEARCH_TTL, self._search, query, type)
+
+    def _video(self, video_id):
+        result = self.execute(self.youtube.videos().list(part="snippet,contentDetails,statistics", id=video_id))
+        return result["items"][0]
+
+    async def video(self, video_id):
+        return await self.get(("video", video_id), VIDEO_TTL, self._video, video_id)
+
+    def _playlist_page(self, playlist_id, page_token):
+        response = self.execute(self.youtube.playlistItems().list(playlistId=playlist_id, part="snippet", maxResults=50, pageToken=page_token))
+        items = [
+            (item["snippet"]["title"], f"https://youtu.be/{item['snippet']['resourceId']['videoId']}")
+            for item in response.get("items", [])
+            if item["snippet"]["title"] not in ("Deleted video", "Private video")
+        ]
+        return items, response.get("nextPageToken")
+
+    async def playlist_items(self, playlist_id):
+        results = []
+        page_token = None
+        while True:
+            items, page_token = await self.get(("playlist", playlist_id, page_token), PLAYLIST_TTL, self._playlist_page, playlist_id, page_token)
+            results.extend(items)
+            if not page_token:
+                return results
+
+    def _extract(self, url):
+        data = ytdl_extract_info(url)
+        return {"title": data.get("title"), "webpage_url": data.get("webpage_url", url), "stream": select_stream(data)}
+
+    async def extract(self, url):
+        result = await self.get(("extract", url), VIDEO_TTL, self._extract, url)
+        #the cache is only touched from the event loop
+        if result["stream"]:
+            self.cache[("stream", video_key(result["webpage_url"]))] = (time.time()+STREAM_TTL, result["stream"])
+        return result
+
+    def _stream(self, url):
+        return select_stream(ytdl_extract_info(url))
+
+    async def stream(self, url):
+        return await self.get(("stream", video_key(url)), STREAM_TTL, self._stream, url)
 
 #==================================================================================================================================================
 
 class Song:
-    __slots__ = ("requestor", "raw_title", "title", "url", "default_volume", "index", "duration", "music")
+    __slots__ = (
+        "requestor", "raw_title", "title", "url", "default_volume", "index", "duration", "music", "stream_url", "codec",
+        "lock", "released"
+    )
 
     def __init__(self, requestor, title, url, index=0):
         self.requestor = requestor
@@ -109,53 +520,100 @@ class Song:
         self.index = index
         self.duration = "?"
         self.music = None
-
-    def raw_update(self):
-        try:
-            data, f = self.get_stream()
-        except:
-            return None
-        if data.get("duration"):
-            d = data["duration"]
+        self.stream_url = None
+        self.codec = None
+        self.lock = Lock()
+        self.released = False
+
+    def raw_update(self, stream):
+        d = stream["duration"]
+        if d:
             self.duration = f"{d//3600:02}:{d%3600//60:02}:{d%60:02}"
-        self.music = discord.PCMVolumeTransformer(
-            FFmpegWithBuffer(
-                f["url"],
-                before_options="-hide_banner -nostats -loglevel 0 -reconnect 1"
-            ),
-            volume=self.default_volume
-        )
+        with self.lock:
+            self.stream_url = stream["url"]
+            self.codec = stream["codec"]
+            self.released = False
+            if self.music:
+                self.music.cleanup()
+            self.music = self.make_source()
+        self.check_released()
+
+    def make_source(self, start=0):
+        if OPUS_PASSTHROUGH:
+            return FFmpegOpusWithBuffer(self.stream_url, codec=self.codec, volume=self.default_volume, start=start)
+        else:
+            return discord.PCMVolumeTransformer(
+                FFmpegWithBuffer(self.stream_url, start=start),
+                volume=self.default_volume
+            )
 
-    def get_stream(self):
-        data = ytdl_extract_info(self.url)
-        if not data["formats"]:
-            return None
-        audios = []
-        others = []
-        for f in data["formats"]:
-            if f.get("abr"):
-                audios.append(f)
+    @property
+    def source(self):
+        return getattr(self.music, "original", self.music)
+
+    def set_volume(self, voice_client, volume):
+        with self.lock:
+            self.default_volume = volume
+            music = self.music
+            if isinstance(music, discord.PCMVolumeTransformer):
+                music.volume = volume
+            elif music and music.volume != volume:
+                self._restart(voice_client, music.counter)
+        self.check_released()
+
+    def seek(self, voice_client, frame):
+        with self.lock:
+            if self.music is None:
+                return None
+            source = self.source
+            frame = max(frame, 0)
+            delta = frame - source.counter
+            if 0 <= delta <= source.buffered():
+                source.fast_forward(delta)
             else:
-                others.append(f)
-        audios.sort(key=lambda x: x["abr"], reverse=True)
-        others.sort(key=lambda x: x.get("tbr", 0), reverse=True)
-        f = {}
-        for a in audios:
-            if 72 < a["abr"] < f.get("abr", 9999):
-                f = a
-        if not f:
-            f = utils.get_element(others, lambda x: 144 < x.get("height", 0) < 720, default=utils.get_element(others, 0))
-        return data, f
+                self._restart(voice_client, frame)
+            counter = self.source.counter
+        self.check_released()
+        return counter
+
+    def _restart(self, voice_client, start):
+        old = self.music
+        new = self.make_source(start)
+        #only swap once ffmpeg has produced something, otherwise the player stalls and then bursts the backlog
+        if not getattr(new, "original", new).wait_ready():
+            new.cleanup()
+            return False
+        self.music = new
+        if voice_client and voice_client.source is old:
+            voice_client.source = new
+        #a read already blocked on the old source gets a silent frame instead of ending the song
+        getattr(old, "original", old).retire()
+        return True
+
+    def release(self):
+        #runs on the event loop, so never wait for a restart in progress, the thread holding the lock retries after it
+        self.released = True
+        if self.lock.acquire(blocking=False):
+            try:
+                if self.released and self.music:
+                    self.music.cleanup()
+                    self.music = None
+            finally:
+                self.lock.release()
+
+    def check_released(self):
+        if self.released:
+            self.release()
 
     def info(self):
         if self.music:
-            second_elapsed = int(self.music.original.counter * 0.02)
+            second_elapsed = int(self.source.counter * 0.02)
         else:
             second_elapsed = 0
         return f"{self.title} ({second_elapsed//3600:02}:{second_elapsed%3600//60:02}:{second_elapsed%60:02} / {self.duration})"
 
     def time_elapsed(self):
-        second_elapsed = int(self.music.original.counter * 0.02)
+        second_elapsed = int(self.source.counter * 0.02)
         return (second_elapsed//3600, second_elapsed%3600//60, second_elapsed%60)
 
     def to_dict(self):
@@ -163,37 +621,192 @@ class Song:
 
 #==================================================================================================================================================
 
+class JournalEntry:
+    __slots__ = ("cleared", "pushed", "removed", "fields", "ops")
+
+    def __init__(self):
+        self.cleared = False
+        self.pushed = []
+        self.removed = set()
+        self.fields = {}
+        self.ops = 0
+
+    def push(self, items):
+        self.pushed.extend(items)
+        self.ops += 1
+
+    def remove(self, index):
+        self._remove(index)
+        self.ops += 1
+
+    def _remove(self, index):
+        for i, item in enumerate(self.pushed):
+            if item["index"] == index:
+                self.pushed.pop(i)
+                break
+        else:
+            if not self.cleared:
+                self.removed.add(index)
+
+    def clear(self):
+        self.cleared = True
+        self.pushed.clear()
+        self.removed.clear()
+        self.ops += 1
+
+    def set(self, fields):
+        self.fields.update(fields)
+        self.ops += 1
+
+    def merge(self, newer):
+        if newer.cleared:
+            self.cleared = True
+            self.pushed = newer.pushed
+            self.removed.clear()
+        else:
+            for index in newer.removed:
+                self._remove(index)
+            self.pushed.extend(newer.pushed)
+        self.fields.update(newer.fields)
+        self.ops += newer.ops
+
+    def to_requests(self, guild_id):
+        query = {"guild_id": guild_id}
+        if self.cleared:
+            return [pymongo.UpdateOne(query, {"$set": {**self.fields, "playlist": self.pushed}})]
+        reqs = []
+        #pull pushed items first so a retried flush never duplicates them
+        pulls = list(self.removed) + [item["index"] for item in self.pushed]
+        if pulls:
+            reqs.append(pymongo.UpdateOne(query, {"$pull": {"playlist": {"index": {"$in": pulls}}}}))
+        update = {}
+        if self.fields:
+            update["$set"] = self.fields
+        if self.pushed:
+            update["$push"] = {"playlist": {"$each": self.pushed}}
+        if update:
+            reqs.append(pymongo.UpdateOne(query, update))
+        return reqs
+
+class PlaylistJournal:
+    def __init__(self, collection, *, flush_time=JOURNAL_FLUSH_TIME, loop=None):
+        self.collection = collection
+        self.flush_time = flush_time
+        self.loop = loop or asyncio.get_event_loop()
+        self.pending = {}
+        self.flush_lock = asyncio.Lock()
+        self.flushed_ops = 0
+        self.flushed_writes = 0
+        self.flush_count = 0
+        self.total_latency = 0
+        self.last_latency = 0
+        self.working_task = self.loop.create_task(self.flush_regularly())
+
+    def entry(self, guild_id):
+        e = self.pending.get(guild_id)
+        if e is None:
+            e = self.pending[guild_id] = JournalEntry()
+        return e
+
+    def push(self, guild_id, songs, **fields):
+        e = self.entry(guild_id)
+        e.push([s.to_dict() for s in songs])
+        if fields:
+            e.fields.update(fields)
+
+    def remove(self, guild_id, song, **fields):
+        e = self.entry(guild_id)
+        e.remove(song.index)
+        if fields:
+            e.fields.update(fields)
+
+    def clear(self, guild_id):
+        self.entry(guild_id).clear()
+
+    def set(self, guild_id, **fields):
+        self.entry(guild_id).set(fields)
+
+    def has_pending(self, guild_id):
+        return guild_id in self.pending
+
+    async def flush(self):
+        async with self.flush_lock:
+            pending = self.pending
+            self.pending = {}
+            if not pending:
+                return
+            start = time.perf_counter()
+            failed = None
+            for guild_id, e in pending.items():
+                reqs = e.to_requests(guild_id)
+                try:
+                    if reqs:
+                        await self.collection.bulk_write(reqs, ordered=True)
+                except pymongo.errors.PyMongoError as err:
+                    e.merge(self.pending.pop(guild_id, JournalEntry()))
+                    self.pending[guild_id] = e
+                    failed = err
+                else:
+                    self.flushed_ops += e.ops
+                    self.flushed_writes += len(reqs)
+            self.last_latency = time.perf_counter() - start
+            self.total_latency += self.last_latency
+            self.flush_count += 1
+            if failed:
+                raise failed
+
+    async def flush_regularly(self):
+        try:
+            while True:
+                await asyncio.sleep(self.flush_time)
+                try:
+                    await asyncio.shield(self.flush())
+                except pymongo.errors.PyMongoError:
+                    traceback.print_exc()
+        except asyncio.CancelledError:
+            await self.flush()
+
+    async def takeover(self, old):
+        #wait for the final flush of a journal left behind by a reload, then carry over whatever it couldn't write
+        await asyncio.wait([old.working_task])
+        if not old.working_task.cancelled() and old.working_task.exception():
+            err = old.working_task.exception()
+            traceback.print_exception(type(err), err, err.__traceback__)
+        for guild_id, e in old.pending.items():
+            e.merge(self.pending.pop(guild_id, JournalEntry()))
+            self.pending[guild_id] = e
+        old.pending = {}
+
+    def cleanup(self):
+        self.working_task.cancel()
+
+#==================================================================================================================================================
+
 class MusicQueue:
-    __slots__ = ("playlist_data", "guild_id", "playlist", "_lock", "_not_empty", "_not_full", "next_index")
+    __slots__ = ("journal", "guild_id", "playlist", "_lock", "_not_empty", "_not_full", "next_index", "on_update")
 
-    def __init__(self, bot, guild_id, *, next_index):
-        self.playlist_data = bot.db.music_playlist_data
+    def __init__(self, guild_id, *, next_index, journal):
+        self.journal = journal
         self.guild_id = guild_id
         self.playlist = []
         self._lock = asyncio.Lock()
         self._not_empty = asyncio.Condition(self._lock)
         self._not_full = asyncio.Condition(self._lock)
         self.next_index = next_index
+        self.on_update = None
+
+    def updated(self):
+        if self.on_update:
+            self.on_update()
 
     async def put(self, song):
         async with self._not_full:
             song.index = self.next_index
             self.next_index += 1
             self.playlist.append(song)
-            await self.playlist_data.update_one(
-                {
-                    "guild_id": self.guild_id
-                },
-                {
-                    "$set": {
-                        "next_index": self.next_index
-                    },
-                    "$push": {
-                        "playlist": song.to_dict()
-                    }
-                }
-            )
+            self.journal.push(self.guild_id, [song], next_index=self.next_index)
             self._not_empty.notify()
+            self.updated()
 
     async def put_many(self, songs):
         if songs:
@@ -202,41 +815,32 @@ class MusicQueue:
                     s.index = self.next_index
                     self.next_index += 1
                     self.playlist.append(s)
-                await self.playlist_data.update_one(
-                    {
-                        "guild_id": self.guild_id
-                    },
-                    {
-                        "$set": {
-                            "next_index": self.next_index
-                        },
-                        "$push": {
-                            "playlist": {
-                                "$each": [s.to_dict() for s in songs]
-                            }
-                        }
-                    }
-                )
+                self.journal.push(self.guild_id, songs, next_index=self.next_index)
                 self._not_empty.notify()
+                self.updated()
 
     async def get(self):
         async with self._not_empty:
             if not len(self.playlist):
                 await self._not_empty.wait()
             song = self.playlist.pop(0)
-            await asyncio.shield(self.playlist_data.update_one({"guild_id": self.guild_id}, {"$pop": {"playlist": -1}, "$set": {"current_song": song.to_dict()}}))
+            self.journal.remove(self.guild_id, song, current_song=song.to_dict())
             return song
 
     async def delete(self, position):
         async with self._not_empty:
             song = self.playlist.pop(position)
-            await self.playlist_data.update_one({"guild_id": self.guild_id}, {"$pull": {"playlist": {"index": song.index}}})
+            song.release()
+            self.journal.remove(self.guild_id, song)
+            self.updated()
             return song
 
     async def purge(self):
         async with self._not_empty:
+            for song in self.playlist:
+                song.release()
             self.playlist.clear()
-            await self.playlist_data.update_one({"guild_id": self.guild_id}, {"$set": {"playlist": []}})
+            self.journal.clear(self.guild_id)
 
     def __getitem__(self, key):
         if isinstance(key, slice):
@@ -259,12 +863,15 @@ class MusicQueue:
 #==================================================================================================================================================
 
 class MusicPlayer:
-    __slots__ = ("bot", "guild", "queue", "current_song", "repeat", "channel", "player", "lock", "auto_info")
+    __slots__ = (
+        "bot", "guild", "queue", "current_song", "repeat", "channel", "player", "lock", "auto_info",
+        "prefetch_depth", "prefetching", "prefetch_hits", "prefetch_misses", "transitions", "metadata", "cancelled"
+    )
 
-    def __init__(self, bot, guild, *, initial, next_index, repeat=False):
+    def __init__(self, bot, guild, *, initial, next_index, metadata, journal, repeat=False, prefetch_depth=PREFETCH_DEPTH):
         self.bot = bot
         self.guild = guild
-        self.queue = MusicQueue(bot, guild.id, next_index=next_index)
+        self.queue = MusicQueue(guild.id, next_index=next_index, journal=journal)
         self.current_song = None
         self.repeat = repeat
         self.channel = None
@@ -272,11 +879,29 @@ class MusicPlayer:
         self.lock = asyncio.Lock()
         self.queue.playlist.extend((Song(guild.get_member(s["requestor_id"]), s["title"], s["url"], s["index"]) for s in initial))
         self.auto_info = None
+        self.metadata = metadata
+        self.prefetch_depth = prefetch_depth
+        self.prefetching = {}
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+        self.transitions = collections.deque(maxlen=TRANSITION_HISTORY)
+        self.cancelled = False
+        self.queue.on_update = self.prefetch
 
     def ready_to_play(self, channel):
         self.channel = channel
         self.player = weakref.ref(self.bot.loop.create_task(self.play_till_eternity()))
 
+    async def seek(self, seconds):
+        song = self.current_song
+        voice_client = self.guild.voice_client
+        if not song or not song.music or not voice_client or voice_client.source is not song.music:
+            return None
+        frame = await self.bot.loop.run_in_executor(self.bot.executors["io"], song.seek, voice_client, int(seconds*50))
+        if frame is None:
+            return None
+        return frame * 0.02
+
     def skip(self):
         if self.guild.voice_client:
             if self.guild.voice_client.is_playing():
@@ -290,17 +915,77 @@ class MusicPlayer:
 
     async def clear_current_song(self):
         self.current_song = None
-        await asyncio.shield(self.queue.playlist_data.update_one({"guild_id": self.guild.id}, {"$set": {"current_song": None}}))
+        self.queue.journal.set(self.guild.id, current_song=None)
 
     async def set_repeat(self, mode):
         self.repeat = mode
-        await self.queue.playlist_data.update_one({"guild_id": self.guild.id}, {"$set": {"repeat": mode}})
+        self.queue.journal.set(self.guild.id, repeat=mode)
 
     def cancel(self):
+        self.cancelled = True
         try:
             self.player().cancel()
         except:
             pass
+        for task in self.prefetching.values():
+            task.cancel()
+        for song in self.queue:
+            song.release()
+
+    def prefetch(self):
+        if self.cancelled or not self.guild.voice_client:
+            return
+        for song in self.queue.playlist[:self.prefetch_depth]:
+            if song.music is None and song not in self.prefetching:
+                self.prefetching[song] = self.bot.loop.create_task(self.resolve(song))
+
+    async def load(self, song):
+        try:
+            stream = await self.metadata.stream(song.url)
+        except checks.CustomError:
+            raise
+        except Exception:
+            return
+        if stream:
+            update = self.bot.loop.run_in_executor(self.bot.executors["io"], song.raw_update, stream)
+            try:
+                await asyncio.shield(update)
+            except asyncio.CancelledError:
+                #raw_update can't be stopped midway, release whatever source it ends up building
+                update.add_done_callback(functools.partial(self.release_unused, song))
+                raise
+
+    def release_unused(self, song, update=None):
+        if update and not update.cancelled():
+            update.exception()
+        if self.cancelled or (song is not self.current_song and song not in self.queue):
+            song.release()
+
+    async def resolve(self, song):
+        try:
+            await self.load(song)
+        except checks.CustomError:
+            pass
+        finally:
+            self.prefetching.pop(song, None)
+            self.release_unused(song)
+
+    async def prepare(self, song):
+        task = self.prefetching.get(song)
+        if task:
+            await asyncio.shield(task)
+        if song.music is None:
+            self.prefetch_misses += 1
+            #the io pool rejects jobs when saturated, wait a bit instead of killing the player
+            for i in range(LOAD_RETRIES):
+                try:
+                    await self.load(song)
+                except checks.CustomError:
+                    await asyncio.sleep(LOAD_RETRY_DELAY)
+                else:
+                    break
+        else:
+            self.prefetch_hits += 1
 
     def quit(self):
         self.cancel()
@@ -315,23 +1000,29 @@ class MusicPlayer:
         play_next_song = asyncio.Event()
         cmd = self.bot.get_command("music info")
         voice = self.guild.voice_client
+        ended_at = None
 
         while True:
             play_next_song.clear()
             if not self.current_song:
+                if not self.queue:
+                    ended_at = None
                 try:
                     self.current_song = await asyncio.wait_for(self.queue.get(), 120, loop=self.bot.loop)
                 except asyncio.TimeoutError:
                     await self.channel.send("No music? Time to sleep then. Yaaawwnnnn~~")
                     async with self.lock:
                         return await self.leave_voice()
-            await self.bot.loop.run_in_executor(None, self.current_song.raw_update)
+            await self.prepare(self.current_song)
             if self.current_song.music is None:
                 title = self.current_song.title
                 await self.clear_current_song()
                 await self.channel.send(f"**{title}** is not available.")
             else:
                 voice.play(self.current_song.music, after=next_part)
+                if ended_at is not None:
+                    self.transitions.append(self.bot.loop.time()-ended_at)
+                self.prefetch()
                 name = utils.discord_escape(getattr(self.current_song.requestor, "display_name", "<User left server>"))
                 await self.channel.send(f"Playing **{self.current_song.title}** requested by {name}.")
                 if self.auto_info:
@@ -340,6 +1031,8 @@ class MusicPlayer:
                     new_ctx = await self.bot.get_context(new_msg, cls=data_type.BelphegorContext)
                     await new_ctx.invoke(cmd)
                 await play_next_song.wait()
+                ended_at = self.bot.loop.time()
+                self.current_song.release()
                 if self.repeat is None:
                     await asyncio.shield(self.queue.put(self.current_song))
                 if not self.repeat:
@@ -355,6 +1048,8 @@ class MusicPlayer:
                     await self.channel.send("No one's here? I'm skipping this then.")
                     async with self.lock:
                         return await self.leave_voice()
+                else:
+                    ended_at = None
 
 #==================================================================================================================================================
 
@@ -368,26 +1063,41 @@ class Music(commands.Cog):
         self.playlist_data = bot.db.music_playlist_data
         self.music_players = {}
         locale.setlocale(locale.LC_ALL, "")
-        self.youtube = build("youtube", "v3", developerKey=token.GOOGLE_CLIENT_API_KEY)
-        self.yt_lock = asyncio.Lock()
+        self.metadata = YoutubeMetadata(bot)
+        self.journal = PlaylistJournal(self.playlist_data, loop=bot.loop)
+        self.old_journals = bot.saved_stuff.pop("music_journals", [])
         self.mp_lock = asyncio.Lock()
-        self.ytdl_lock = asyncio.Lock()
 
     def cog_unload(self):
         for mp in self.music_players.values():
             mp.quit()
+        self.journal.cleanup()
+        self.bot.saved_stuff["music_journals"] = self.old_journals + [self.journal]
 
     async def get_music_player(self, guild):
         async with self.mp_lock:
             mp = self.music_players.get(guild.id)
             if not mp:
+                while self.old_journals:
+                    await self.journal.takeover(self.old_journals[0])
+                    self.old_journals.pop(0)
+                #also waits for a flush already in flight, whose changes are no longer pending
+                try:
+                    await self.journal.flush()
+                except pymongo.errors.PyMongoError:
+                    #only a failure for this guild would leave the stored playlist stale
+                    if self.journal.has_pending(guild.id):
+                        raise
                 mp_data = await self.playlist_data.find_one_and_update(
                     {"guild_id": guild.id},
                     {"$setOnInsert": {"guild_id": guild.id, "next_index": 0, "playlist": [], "current_song": None, "repeat": False}},
                     return_document=ReturnDocument.AFTER,
                     upsert=True
                 )
-                mp = MusicPlayer(self.bot, guild, initial=mp_data["playlist"], next_index=mp_data["next_index"], repeat=mp_data["repeat"])
+                mp = MusicPlayer(
+                    self.bot, guild, initial=mp_data["playlist"], next_index=mp_data["next_index"],
+                    metadata=self.metadata, journal=self.journal, repeat=mp_data["repeat"]
+                )
                 cur_song = mp_data.get("current_song")
                 if cur_song:
                     mp.current_song = Song(guild.get_member(cur_song["requestor_id"]), cur_song["title"], cur_song["url"], cur_song["index"])
@@ -462,15 +1172,6 @@ class Music(commands.Cog):
                 music_player.quit()
                 await ctx.send(f"{self.bot.user.display_name} left {name}.")
 
-    def youtube_search(self, name, type="video"):
-        search_response = self.youtube.search().list(q=name, part="id,snippet", type=type, maxResults=10).execute()
-        results = []
-        for search_result in search_response.get("items", None):
-            results.append(search_result)
-            if len(results) > 4:
-                break
-        return results
-
     def current_queue_info(self, music_player):
         try:
             if music_player.guild.voice_client.is_playing():
@@ -522,11 +1223,11 @@ class Music(commands.Cog):
 
         if name.startswith(("http://", "https://")):
             try:
-                d = await self.bot.run_in_lock(self.ytdl_lock, ytdl_extract_info, name)
+                d = await self.metadata.extract(name)
             except:
                 await ctx.send("This url is not available.")
             else:
-                if d["formats"]:
+                if d["stream"]:
                     await music_player.queue.put(Song(ctx.message.author, d["title"], d["webpage_url"]))
                     await ctx.send(f"Added **{d['title']}** to queue.")
                 else:
@@ -534,7 +1235,7 @@ class Music(commands.Cog):
             finally:
                 return
 
-        results = await self.bot.run_in_lock(self.yt_lock, self.youtube_search, name)
+        results = await self.metadata.search(name)
         stuff = "\n\n".join([
             f"`{i+1}:` **[{utils.discord_escape(v['snippet']['title'])}](https://youtu.be/{v['id']['videoId']})**\n      By: {v['snippet']['channelTitle']}"
             for i,v in enumerate(results)
@@ -573,9 +1274,10 @@ class Music(commands.Cog):
         music_player = await self.get_music_player(ctx.guild)
         if 0 <= vol <= 200:
             if music_player.current_song:
-                music_player.current_song.default_volume = vol / 100
-                if music_player.current_song.music:
-                    music_player.current_song.music.volume = vol / 100
+                await self.bot.loop.run_in_executor(
+                    self.bot.executors["io"],
+                    music_player.current_song.set_volume, ctx.voice_client, vol / 100
+                )
                 await ctx.send(f"Volume for current song has been set to {vol}%.")
             else:
                 await ctx.send("No song is currently playing.")
@@ -705,23 +1407,6 @@ class Music(commands.Cog):
         except:
             await ctx.send("Wrong format for imported file.")
 
-    def youtube_playlist_items(self, message, playlist_id):
-        results = []
-        playlist_items = self.youtube.playlistItems().list(playlistId=playlist_id, part="snippet", maxResults=50).execute()
-        for song in playlist_items.get("items", None):
-            if song["snippet"]["title"] in ("Deleted video", "Private video"):
-                continue
-            else:
-                results.append(Song(message.author, song["snippet"]["title"], f"https://youtu.be/{song['snippet']['resourceId']['videoId']}"))
-        while playlist_items.get("nextPageToken", None):
-            playlist_items = self.youtube.playlistItems().list(playlistId=playlist_id, part="snippet", maxResults=50, pageToken=playlist_items["nextPageToken"]).execute()
-            for song in playlist_items.get("items", None):
-                if song["snippet"]["title"] in ("Deleted video", "Private video"):
-                    continue
-                else:
-                    results.append(Song(message.author, song["snippet"]["title"], f"https://youtu.be/{song['snippet']['resourceId']['videoId']}"))
-        return results
-
     @modding.help(brief="Queue a playlist", category="Music", field="Commands", paragraph=1)
     @music.command(aliases=["p"])
     async def playlist(self, ctx, *, name=None):
@@ -746,7 +1431,7 @@ class Music(commands.Cog):
             name = name[3:]
         else:
             shuffle = False
-        results = await self.bot.run_in_lock(self.yt_lock, self.youtube_search, name, "playlist")
+        results = await self.metadata.search(name, "playlist")
         stuff = "\n\n".join([
             f"`{i+1}:` **[{utils.discord_escape(p['snippet']['title'])}](https://www.youtube.com/playlist?list={p['id']['playlistId']})**\n      By: {p['snippet']['channelTitle']}"
             for i,p in enumerate(results)
@@ -759,7 +1444,7 @@ class Music(commands.Cog):
             return
         else:
             result = results[index-1]
-        items = await self.bot.run_in_lock(self.yt_lock, self.youtube_playlist_items, ctx.message, result["id"]["playlistId"])
+        items = [Song(ctx.author, title, url) for title, url in await self.metadata.playlist_items(result["id"]["playlistId"])]
         if len(items) + len(music_player.queue) > MAX_PLAYLIST_SIZE:
             return await ctx.send("Too many entries.")
         if shuffle:
@@ -770,11 +1455,6 @@ class Music(commands.Cog):
         await music_player.queue.put_many(items)
         await ctx.send(f"Added {len(items)} songs to queue{add_text}.")
 
-    def youtube_video_info(self, video_id):
-        result = self.youtube.videos().list(part='snippet,contentDetails,statistics', id=video_id).execute()
-        video = result["items"][0]
-        return video
-
     @modding.help(brief="Display video info", category="Music", field="Commands", paragraph=2)
     @music.command(aliases=["i"])
     @commands.cooldown(rate=1, per=5, type=commands.BucketType.user)
@@ -804,7 +1484,7 @@ class Music(commands.Cog):
         if not m:
             return await ctx.send("Info can only be used with youtube url.")
 
-        video = await self.bot.run_in_lock(self.yt_lock, self.youtube_video_info, m.group(1))
+        video = await self.metadata.video(m.group(1))
         snippet = video["snippet"]
         stat = video["statistics"]
         description = utils.unifix(snippet.get("description", "None")).strip()
@@ -870,29 +1550,45 @@ class Music(commands.Cog):
                 vc.pause()
                 await ctx.send("Paused.")
 
+    async def seek_to(self, ctx, music_player, get_target):
+        song = music_player.current_song
+        if song and song.music and ctx.voice_client and ctx.voice_client.is_playing():
+            tbefore = song.time_elapsed()
+            safter = await music_player.seek(get_target(song.source.counter * 0.02))
+            if safter is not None:
+                safter = int(safter)
+                tafter = (safter//3600, safter%3600//60, safter%60)
+                return await ctx.send(f"Moved from {tbefore[0]:02}:{tbefore[1]:02}:{tbefore[2]:02} to {tafter[0]:02}:{tafter[1]:02}:{tafter[2]:02}.")
+
+        await ctx.send("Nothing is playing right now, oi.")
+
     @modding.help(brief="Fast forward", category="Music", field="Commands", paragraph=3)
     @music.command(aliases=["f"])
     async def forward(self, ctx, seconds: int=10):
         '''
             `>>music forward <optional: seconds>`
-            Fast forward. The limit is 59 seconds.
+            Fast forward. Use negative value to rewind.
             If no argument is provided, fast forward by 10 seconds.
         '''
         music_player = await self.get_music_player(ctx.guild)
-        song = music_player.current_song
-        if song:
-            if ctx.voice_client:
-                if ctx.voice_client.is_playing():
-                    if 0 < seconds < 60:
-                        tbefore = song.time_elapsed()
-                        safter = int(song.music.original.fast_forward(seconds*50) * 0.02)
-                        tafter = (safter//3600, safter%3600//60, safter%60)
-                        await ctx.send(f"Forward from {tbefore[0]:02}:{tbefore[1]:02}:{tbefore[2]:02} to {tafter[0]:02}:{tafter[1]:02}:{tafter[2]:02}.")
-                    else:
-                        await ctx.send("Fast forward time must be between 1 and 59 seconds.")
-                    return
+        await self.seek_to(ctx, music_player, lambda elapsed: elapsed + seconds)
 
-        await ctx.send("Nothing is playing right now, oi.")
+    @modding.help(brief="Jump to a timestamp", category="Music", field="Commands", paragraph=3)
+    @music.command()
+    async def seek(self, ctx, timestamp):
+        '''
+            `>>music seek <timestamp>`
+            Jump to a timestamp of current song.
+            Timestamp can be in seconds, mm:ss or hh:mm:ss format.
+        '''
+        try:
+            seconds = 0
+            for part in timestamp.split(":"):
+                seconds = seconds * 60 + int(part)
+        except ValueError:
+            return await ctx.send("Timestamp should be in seconds, mm:ss or hh:mm:ss format.")
+        music_player = await self.get_music_player(ctx.guild)
+        await self.seek_to(ctx, music_player, lambda elapsed: seconds)
 
     @modding.help(brief="Change notifying channel", category="Music", field="Commands", paragraph=4)
     @music.command(aliases=["channel"])
@@ -922,6 +1618,37 @@ class Music(commands.Cog):
             music_player.auto_info = None
             await ctx.send("Auto-info mode is off.")
 
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def musicstats(self, ctx):
+        lines = [f"{'guild': <20}{'depth': >6}{'hits': >6}{'miss': >6}{'avg gap': >10}{'max gap': >10}"]
+        for guild_id, mp in self.music_players.items():
+            gaps = mp.transitions
+            if gaps:
+                avg_gap = f"{sum(gaps)/len(gaps)*1000:.0f}ms"
+                max_gap = f"{max(gaps)*1000:.0f}ms"
+            else:
+                avg_gap = max_gap = "-"
+            lines.append(f"{guild_id: <20}{mp.prefetch_depth: >6}{mp.prefetch_hits: >6}{mp.prefetch_misses: >6}{avg_gap: >10}{max_gap: >10}")
+        j = self.journal
+        avg_latency = j.total_latency / j.flush_count * 1000 if j.flush_count else 0
+        lines.append(
+            f"queue journal: {j.flushed_ops} ops in {j.flushed_writes} writes ({j.flushed_ops-j.flushed_writes} coalesced), "
+            f"{len(j.pending)} guilds pending, flush {j.last_latency*1000:.0f}ms last/{avg_latency:.0f}ms avg"
+        )
+        cache = self.metadata.cache
+        lines.append(f"metadata cache: {len(cache)}/{cache.maxsize} entries, {cache.hits} hits, {cache.misses} misses, {len(self.metadata.pending)} pending")
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+    @commands.command(hidden=True)
+    @checks.owner_only()
+    async def bufferbench(self, ctx, seconds: int=120):
+        frames, report = await self.bot.loop.run_in_executor(self.bot.executors["cpu"], benchmark_buffers, seconds)
+        lines = [f"{frames} frames", f"{'buffer': <8}{'wall': >10}{'cpu': >10}{'cpu/frame': >12}"]
+        for name, wall, cpu in report:
+            lines.append(f"{name: <8}{wall*1000: >8.1f}ms{cpu*1000: >8.1f}ms{cpu/frames*1e6: >10.2f}us")
+        await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
 #==================================================================================================================================================
 
 def setup(bot):
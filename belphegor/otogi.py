@@ -9,13 +9,19 @@ import traceback
 from bs4 import BeautifulSoup as BS
 from apiclient.discovery import build
 import asyncio
-from pymongo import ReturnDocument, UpdateOne, ASCENDING
+from pymongo import ReturnDocument, UpdateOne, ReplaceOne, ASCENDING
 import json
 import math
 from io import BytesIO
 
 #==================================================================================================================================================
 
+WIKIA_API = "https://otogi.wikia.com/api.php"
+WIKIA_WORKERS = 8
+WIKIA_RATE = 5
+WIKIA_TITLE_LIMIT = 50
+WIKIA_BATCH = 8
+
 SPECIAL = {
     "Commander Yashichi": ("Yashichi", "prefixed"),
     "Earth Defense Force: Helium": ("Helium Elf", "prefixed"),
@@ -366,6 +372,13 @@ class Otogi(commands.Cog):
 
         db = bot.db
         self.daemon_collection = db.daemon_collection
+        self.daemon_index = data_type.SearchIndex(
+            self.daemon_collection,
+            atts=["name", "alias", "form"],
+            fields=["id", "daemon_class"],
+            sort={"id": 1}
+        )
+        bot.loop.create_task(self.daemon_index.build())
         self.summon_pool = db.daemon_summon_pool
         self.player_list = db.otogi_simulation_player_list
         self.google_sheets = build("sheets", "v4", developerKey=token.GOOGLE_CLIENT_API_KEY)
@@ -384,15 +397,13 @@ class Otogi(commands.Cog):
 
     async def _search(self, ctx, name, *, prompt=None):
         return await ctx.search(
-            name, self.daemon_collection,
+            name, self.daemon_index,
             cls=Daemon,
             colour=discord.Colour.orange(),
-            atts=["name", "alias", "form"],
             name_att="name",
             index_att="id",
             emoji_att="daemon_class",
-            prompt=prompt,
-            sort={"id": 1}
+            prompt=prompt
         )
 
     @modding.help(brief="Check a daemon info", category="Otogi", field="Database", paragraph=0)
@@ -599,6 +610,7 @@ class Otogi(commands.Cog):
                     else:
                         new_daemon.skills.append((d, data[i+1]))
             await self.daemon_collection.insert_one(new_daemon.__dict__)
+            await self.daemon_index.build()
             await ctx.send(f"Entry #{new_daemon.id} has been created.")
         except Exception as e:
             print(e)
@@ -611,6 +623,7 @@ class Otogi(commands.Cog):
         if not daemon:
             return
         await self.daemon_collection.find_one_and_delete({"id": daemon.id})
+        await self.daemon_index.build()
         await ctx.send(f"The entry for {daemon.name} has been deleted.")
 
     @update.command(hidden=True)
@@ -653,6 +666,7 @@ class Otogi(commands.Cog):
 
         if success:
             await self.daemon_collection.replace_one({"id": daemon.id}, daemon.__dict__)
+            await self.daemon_index.build()
         await ctx.send(f"The entry for {daemon.name} has been edited.\nSuccess: {', '.join(success)}\nFailed: {', '.join(failed)}")
 
     @update.command(hidden=True, name="summon")
@@ -700,11 +714,18 @@ class Otogi(commands.Cog):
         new_daemon = await self.search_wikia(daemon, data.get("image_name"))
         if new_daemon:
             await self.daemon_collection.replace_one({"id": daemon.id}, new_daemon.__dict__)
+            await self.daemon_index.build()
             await ctx.send(f"The entry for {new_daemon.name} has been updated with latest information from wikia.")
         else:
             await ctx.send("No wikia page found.")
 
     async def search_wikia(self, daemon, image_name):
+        new_daemon, files = await self.parse_wikia(daemon, image_name)
+        urls = await self.fetch_wikia_files(files.values())
+        self.apply_file_urls(daemon, new_daemon, {key: urls.get(title) for key, title in files.items()})
+        return new_daemon
+
+    async def parse_wikia(self, daemon, image_name, *, limiter=None):
         name = daemon.name
         try:
             bracket_index = name.index("[")
@@ -724,7 +745,9 @@ class Otogi(commands.Cog):
             "format":       "json",
             "redirects":    1
         }
-        bytes_ = await self.bot.fetch("https://otogi.wikia.com/api.php", params=params)
+        if limiter:
+            await limiter.acquire()
+        bytes_ = await self.bot.fetch(WIKIA_API, params=params)
         data = json.loads(bytes_)
         text_generator = iter(data["parse"]["wikitext"]["*"])
         new_daemon = None
@@ -759,38 +782,49 @@ class Otogi(commands.Cog):
             "summon_quote":         f"File:{filename_base} Summon.ogg",
             "limit_break_quote":    f"File:{filename_base} Limit Break.ogg"
         }
-        rev = {v: k for k, v in files.items()}
-        file_params = {
-            "action":       "query",
-            "prop":         "imageinfo",
-            "iiprop":       "url",
-            "titles":       "|".join(files.values()),
-            "format":       "json",
-            "redirects":    1
-        }
-        file_bytes_ = await self.bot.fetch("https://otogi.wikia.com/api.php", params=file_params)
-        file_data = json.loads(file_bytes_)
-
-        for n in file_data["query"].get("normalized", []):
-            files[rev[n["from"]]] = n["to"]
-
-        redirects = file_data["query"].get("redirects")
-        if redirects:
-            for n in redirects:
-                files[rev[n["from"]]] = n["to"]
-            file_params["titles"] = "|".join(files.values())
-            file_bytes_ = await self.bot.fetch("https://otogi.wikia.com/api.php", params=file_params)
-            file_data = json.loads(file_bytes_)
-
-        file_urls = {}
-        rev = {v: k for k, v in files.items()}
-        for d in file_data["query"]["pages"].values():
-            if d["title"] in rev:
+        return new_daemon, files
+
+    async def fetch_wikia_files(self, titles, *, limiter=None):
+        titles = list(dict.fromkeys(titles))
+        moved = {}
+        urls = {}
+        for i in range(0, len(titles), WIKIA_TITLE_LIMIT):
+            file_params = {
+                "action":       "query",
+                "prop":         "imageinfo",
+                "iiprop":       "url",
+                "titles":       "|".join(titles[i:i+WIKIA_TITLE_LIMIT]),
+                "format":       "json",
+                "redirects":    1
+            }
+            if limiter:
+                await limiter.acquire()
+            file_bytes_ = await self.bot.fetch(WIKIA_API, params=file_params)
+            file_data = json.loads(file_bytes_)["query"]
+            for n in file_data.get("normalized", []):
+                moved[n["from"]] = n["to"]
+            for n in file_data.get("redirects", []):
+                moved[n["from"]] = n["to"]
+            for d in file_data["pages"].values():
                 try:
-                    file_urls[rev[d["title"]]] = d["imageinfo"][0]["url"]
+                    urls[d["title"]] = d["imageinfo"][0]["url"]
                 except (IndexError, KeyError):
                     pass
 
+        result = {}
+        for title in titles:
+            target = title
+            for _ in range(3):
+                if target in moved:
+                    target = moved[target]
+                else:
+                    break
+            url = urls.get(target)
+            if url:
+                result[title] = url
+        return result
+
+    def apply_file_urls(self, daemon, new_daemon, file_urls):
         new_daemon.pic_url = file_urls.get("pic") or daemon.pic_url
         new_daemon.artwork_url = file_urls.get("artwork") or daemon.artwork_url
         new_daemon.quotes["main"]["url"] = file_urls.get("main_quote")
@@ -798,42 +832,103 @@ class Otogi(commands.Cog):
         new_daemon.quotes["summon"]["url"] = file_urls.get("summon_quote")
         new_daemon.quotes["limit_break"]["url"] = file_urls.get("limit_break_quote")
 
-        return new_daemon
-
     @update.command(hidden=True, name="from", aliases=["all"])
     @checks.owner_only()
-    async def update_everything(self, ctx, start_from: int=0):
+    async def update_everything(self, ctx, start_from: int=None, workers: int=WIKIA_WORKERS, rate: float=WIKIA_RATE):
         done = []
         undone = []
 
+        checkpoint = await self.belphegor_config.find_one({"category": "otogi_wikia_checkpoint"})
+        if start_from is None and checkpoint:
+            start_from = checkpoint["start_from"]
+            skip_ids = set(checkpoint.get("done_ids", []))
+        else:
+            start_from = start_from or 0
+            skip_ids = set()
+            await self.belphegor_config.replace_one(
+                {"category": "otogi_wikia_checkpoint"},
+                {"category": "otogi_wikia_checkpoint", "start_from": start_from, "done_ids": []},
+                upsert=True
+            )
+
         msg = await ctx.send(f"Fetching...\n{utils.progress_bar(0)}")
-        cursor = self.daemon_collection.find({"id": {"$gte": start_from}})
+        cursor = self.daemon_collection.find({"id": {"$gte": start_from, "$nin": list(skip_ids)}})
         daemons = await cursor.to_list(None)
         if daemons:
             count = len(daemons)
-            i = 0
+            limiter = utils.RateLimiter(rate)
+            in_queue = asyncio.Queue()
+            out_queue = asyncio.Queue()
             for daemon_data in daemons:
+                in_queue.put_nowait(Daemon(daemon_data))
+
+            async def work():
+                while True:
+                    try:
+                        daemon = in_queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    try:
+                        result = await self.parse_wikia(daemon, None, limiter=limiter)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        result = None
+                    await out_queue.put((daemon, result))
+
+            async def write(batch):
                 try:
-                    daemon = Daemon(daemon_data)
-                    new_daemon = await self.search_wikia(daemon, None)
-                    await self.daemon_collection.replace_one({"id": daemon.id}, new_daemon.__dict__)
-                except:
-                    undone.append(f"#{daemon.id: 4d} {daemon.name}")
+                    urls = await self.fetch_wikia_files((title for item in batch for title in item[2].values()), limiter=limiter)
+                    reqs = []
+                    for daemon, new_daemon, files in batch:
+                        self.apply_file_urls(daemon, new_daemon, {key: urls.get(title) for key, title in files.items()})
+                        reqs.append(ReplaceOne({"id": daemon.id}, new_daemon.__dict__))
+                    await self.daemon_collection.bulk_write(reqs, ordered=False)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    undone.extend(f"#{daemon.id: 4d} {daemon.name}" for daemon, new_daemon, files in batch)
                 else:
-                    done.append(f"#{new_daemon.id: 4d} {new_daemon.name}")
-                i += 1
-                if i%10 == 0:
-                    await msg.edit(content=f"Fetching...\n{utils.progress_bar(i/count)}")
-
-            await msg.edit(content=f"Done.\n{utils.progress_bar(i/count)}")
+                    done.extend(f"#{new_daemon.id: 4d} {new_daemon.name}" for daemon, new_daemon, files in batch)
+                    await self.belphegor_config.update_one(
+                        {"category": "otogi_wikia_checkpoint"},
+                        {"$addToSet": {"done_ids": {"$each": [daemon.id for daemon, new_daemon, files in batch]}}}
+                    )
+                batch.clear()
+
+            tasks = [self.bot.loop.create_task(work()) for _ in range(max(workers, 1))]
+            batch = []
+            try:
+                for i in range(1, count+1):
+                    daemon, result = await out_queue.get()
+                    if result:
+                        batch.append((daemon, *result))
+                    else:
+                        undone.append(f"#{daemon.id: 4d} {daemon.name}")
+                    if len(batch) >= WIKIA_BATCH:
+                        await write(batch)
+                    if i%10 == 0:
+                        await msg.edit(content=f"Fetching...\n{utils.progress_bar(i/count)}")
+                if batch:
+                    await write(batch)
+            finally:
+                for t in tasks:
+                    t.cancel()
+
+            if not undone:
+                await self.belphegor_config.delete_one({"category": "otogi_wikia_checkpoint"})
+            await self.daemon_index.build()
+            await msg.edit(content=f"Done.\n{utils.progress_bar(1)}")
             txt = json.dumps({"done": done, "undone": undone}, indent=4, ensure_ascii=False)
             if len(txt) > 1900:
                 await ctx.send(f"Done: {len(done)}\nUndone: {len(undone)}", file=discord.File(BytesIO(txt.encode("utf-8")), filename="result.json"))
             else:
                 await ctx.send(f"Done: {len(done)}\nUndone: {len(undone)}\n```json\n{txt}\n```")
         else:
+            await self.belphegor_config.delete_one({"category": "otogi_wikia_checkpoint"})
             await ctx.send("There's nothing to update.")
 
+
     @update.command(hidden=True, name="one")
     @checks.owner_only()
     async def update_one(self, ctx, *, name):
@@ -1244,7 +1339,7 @@ class Otogi(commands.Cog):
     @update.command(hidden=True, name="sheet")
     @checks.owner_only()
     async def update_sheet(self, ctx):
-        result = await self.bot.loop.run_in_executor(None, self.get_sheet, "1oJnQ5TYL5d9LJ04HMmsuXBvJSAxqhYqcggDZKOctK2k", "Sheet1!$A$1:$YY")
+        result = await self.bot.loop.run_in_executor(self.bot.executors["io"], self.get_sheet, "1oJnQ5TYL5d9LJ04HMmsuXBvJSAxqhYqcggDZKOctK2k", "Sheet1!$A$1:$YY")
         await self.stat_sheet.find_one_and_replace({}, result)
         await ctx.message.add_reaction("\u2705")
 
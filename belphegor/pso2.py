@@ -296,6 +296,11 @@ class PSO2(commands.Cog):
         self.weapon_list = bot.db.weapon_list
         self.unit_list = bot.db.unit_list
         self.guild_data = bot.db.guild_data
+        self.chip_index = data_type.SearchIndex(self.chip_library, atts=["en_name", "jp_name"], fields=["element"])
+        self.weapon_index = data_type.SearchIndex(self.weapon_list, atts=["en_name", "jp_name", "category"], sort={"category": WEAPON_SORT})
+        self.unit_index = data_type.SearchIndex(self.unit_list, atts=["en_name", "jp_name", "category"])
+        for index in (self.chip_index, self.weapon_index, self.unit_index):
+            bot.loop.create_task(index.build())
         test_guild = self.bot.get_guild(config.TEST_GUILD_ID)
         test_guild_2 = self.bot.get_guild(config.TEST_GUILD_2_ID)
         self.emojis = {}
@@ -344,10 +349,9 @@ class PSO2(commands.Cog):
             I'm not maintaining this anymore.
         '''
         chip = await ctx.search(
-            name, self.chip_library,
+            name, self.chip_index,
             cls=Chip,
             colour=discord.Colour.blue(),
-            atts=["en_name", "jp_name"],
             name_att="en_name",
             emoji_att="element"
         )
@@ -364,9 +368,9 @@ class PSO2(commands.Cog):
             Weapon name is case-insensitive and can be either EN or JP.
         '''
         weapon = await ctx.search(
-            name, self.weapon_list,
+            name, self.weapon_index,
             cls=Weapon, colour=discord.Colour.blue(),
-            atts=["en_name", "jp_name", "category"], name_att="en_name", emoji_att="category", sort={"category": WEAPON_SORT}
+            name_att="en_name", emoji_att="category"
         )
         if not weapon:
             return
@@ -600,7 +604,7 @@ class PSO2(commands.Cog):
         for category, url in urls.items():
             bytes_ = await utils.fetch(self.bot.session, url)
             try:
-                category_weapons = await self.bot.loop.run_in_executor(None, self.weapon_parse, category, bytes_)
+                category_weapons = await self.bot.loop.run_in_executor(self.bot.executors["cpu"], self.weapon_parse, category, bytes_)
             except:
                 await ctx.send(f"Error parsing {CATEGORY_DICT[category]}.")
                 raise
@@ -608,6 +612,7 @@ class PSO2(commands.Cog):
                 weapons.extend(category_weapons)
         await self.weapon_list.delete_many({"category": {"$in": tuple(urls.keys())}})
         await self.weapon_list.insert_many(weapons)
+        await self.weapon_index.build()
         await msg.edit(content="Done.")
 
     @modding.help(brief="Search for items", category="PSO2", field="Database", paragraph=1)
@@ -627,7 +632,7 @@ class PSO2(commands.Cog):
         name = " ".join(name)
         desc = data.geteither("description", "desc")
         params = {"name": name}
-        bytes_ = await utils.fetch(self.bot.session, "http://db.kakia.org/item/search", params=params)
+        bytes_ = await self.bot.fetch("http://db.kakia.org/item/search", params=params, cache=True, ttl=3600)
         try:
             result = json.loads(bytes_)
         except json.JSONDecodeError:
@@ -667,7 +672,7 @@ class PSO2(commands.Cog):
         '''
         async with ctx.typing():
             params = {"name": name}
-            bytes_ = await utils.fetch(self.bot.session, "http://db.kakia.org/item/search", params=params)
+            bytes_ = await self.bot.fetch("http://db.kakia.org/item/search", params=params, cache=True, ttl=3600)
             result = json.loads(bytes_)
             if result:
                 item = result[0]
@@ -890,9 +895,9 @@ class PSO2(commands.Cog):
             Name given is case-insensitive, and can be either EN or JP.
         '''
         unit = await ctx.search(
-            name, self.unit_list,
+            name, self.unit_index,
             cls=Unit, colour=discord.Colour.blue(),
-            atts=["en_name", "jp_name", "category"], name_att="en_name", emoji_att="category"
+            name_att="en_name", emoji_att="category"
         )
         if not unit:
             return
@@ -910,7 +915,7 @@ class PSO2(commands.Cog):
         for category, url in urls.items():
             bytes_ = await utils.fetch(self.bot.session, url)
             try:
-                category_units = await self.bot.loop.run_in_executor(None, self.unit_parse, category, bytes_)
+                category_units = await self.bot.loop.run_in_executor(self.bot.executors["cpu"], self.unit_parse, category, bytes_)
             except:
                 await ctx.send(f"Error parsing {CATEGORY_DICT[category]}.")
                 raise
@@ -918,6 +923,7 @@ class PSO2(commands.Cog):
                 units.extend(category_units)
         await self.unit_list.delete_many({"category": {"$in": tuple(urls.keys())}})
         await self.unit_list.insert_many(units)
+        await self.unit_index.build()
         await msg.edit(content = "Done.")
 
     def unit_parse(self, category, bytes_):
@@ -1072,7 +1078,7 @@ class PSO2(commands.Cog):
         return results
 
     async def update_events(self):
-        events = await self.bot.loop.run_in_executor(None, self.get_calendar_events, "pso2emgquest@gmail.com")
+        events = await self.bot.loop.run_in_executor(self.bot.executors["io"], self.get_calendar_events, "pso2emgquest@gmail.com")
         self.incoming_events.assign(events)
 
     @modding.help(brief="Display current week's boost events", category="PSO2", field="EQ", paragraph=0)
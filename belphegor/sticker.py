@@ -1,7 +1,7 @@
 import discord
 from discord.ext import commands
 from . import utils
-from .utils import checks, modding
+from .utils import checks, modding, counter
 import re
 from fuzzywuzzy import process
 
@@ -21,6 +21,12 @@ class Sticker(commands.Cog):
         self.sticker_regexes = {}
         bot.loop.create_task(self.get_all_prefixes())
         self.auto_rep_disabled = bot.get_cog("Misc").auto_rep_disabled
+        self.sticker_index = {}
+        self.usage_counter = counter.UsageCounter(loop=bot.loop)
+        bot.loop.create_task(self.get_all_stickers())
+
+    def cog_unload(self):
+        self.usage_counter.cleanup()
 
     async def get_all_prefixes(self):
         async for data in self.guild_data.find(
@@ -29,6 +35,17 @@ class Sticker(commands.Cog):
         ):
             self.sticker_regexes[data["guild_id"]] = re.compile(fr"(?<={re.escape(data['sticker_prefix'])})\w+")
 
+    async def get_all_stickers(self):
+        async for data in self.sticker_list.find({}, projection={"_id": False, "name": True, "url": True, "banned_guilds": True}):
+            self.sticker_index[data["name"]] = {"url": data["url"], "banned_guilds": set(data.get("banned_guilds", ()))}
+
+    def get_sticker(self, names, guild_id):
+        for name in names:
+            st = self.sticker_index.get(name)
+            if st and guild_id not in st["banned_guilds"]:
+                return name, st
+        return None, None
+
     @commands.Cog.listener()
     async def on_message(self, message):
         if message.author.bot:
@@ -37,11 +54,11 @@ class Sticker(commands.Cog):
         if gid in self.auto_rep_disabled:
             return
         result = self.sticker_regexes.get(gid, DEFAULT_PREFIX_REGEX).findall(message.content)
-        query = {"name": {"$in": result}}
-        if message.guild:
-            query["banned_guilds"] = {"$not": {"$eq": gid}}
-        st = await self.sticker_list.find_one_and_update(query, {"$inc": {"uses": 1}}, projection={"_id": False, "url": True})
+        if not result:
+            return
+        name, st = self.get_sticker(result, gid)
         if st:
+            self.usage_counter.incr(self.sticker_list, {"name": name})
             embed = discord.Embed()
             embed.set_image(url=st["url"])
             await message.channel.send(embed=embed)
@@ -78,6 +95,7 @@ class Sticker(commands.Cog):
                 if before is not None:
                     await ctx.send("Cannot add already existed sticker.")
                 else:
+                    self.sticker_index[name] = {"url": url, "banned_guilds": set()}
                     await ctx.send(f"Sticker {name} added.")
             else:
                 await ctx.send(f"Name is not valid.")
@@ -95,6 +113,7 @@ class Sticker(commands.Cog):
         if before is None:
             await ctx.send(f"Cannot edit sticker.\nEither sticker doesn't exist or you are not the creator of the sticker.")
         else:
+            self.sticker_index[name] = {"url": url, "banned_guilds": set(before.get("banned_guilds", ()))}
             await ctx.send(f"Sticker {name} edited.")
 
     @modding.help(brief="Delete a sticker", category="Tag & sticker", field="Commands", paragraph=1)
@@ -106,6 +125,8 @@ class Sticker(commands.Cog):
         '''
         result = await self.sticker_list.delete_one({"name": name, "author_id": ctx.author.id})
         if result.deleted_count > 0:
+            self.sticker_index.pop(name, None)
+            self.usage_counter.discard(self.sticker_list, {"name": name})
             await ctx.send(f"Sticker {name} deleted.")
         else:
             await ctx.send(f"Cannot delete sticker.\nEither sticker doesn't exist or you are not the creator of the sticker.")
@@ -154,6 +175,9 @@ class Sticker(commands.Cog):
         '''
         result = await self.sticker_list.update_one({"name": name}, {"$addToSet": {"banned_guilds": ctx.guild.id}})
         if result.matched_count > 0:
+            st = self.sticker_index.get(name)
+            if st:
+                st["banned_guilds"].add(ctx.guild.id)
             await ctx.confirm()
         else:
             await ctx.deny()
@@ -169,6 +193,9 @@ class Sticker(commands.Cog):
         '''
         result = await self.sticker_list.update_one({"name": name}, {"$pull": {"banned_guilds": ctx.guild.id}})
         if result.matched_count > 0:
+            st = self.sticker_index.get(name)
+            if st:
+                st["banned_guilds"].discard(ctx.guild.id)
             await ctx.confirm()
         else:
             await ctx.deny()
@@ -241,7 +268,7 @@ class Sticker(commands.Cog):
                 embed.description = "Banned in this server."
             embed.add_field(name="Name", value=f"[{name}]({data['url']})", inline=False)
             embed.add_field(name="Author", value=f"<@{data['author_id']}>")
-            embed.add_field(name="Uses", value=data.get("uses", 0))
+            embed.add_field(name="Uses", value=data.get("uses", 0)+self.usage_counter.get_pending(self.sticker_list, {"name": name}))
             await ctx.send(embed=embed)
         else:
             await ctx.send(f"Can't find sticker with name {name}.")
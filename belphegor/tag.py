@@ -1,28 +1,46 @@
 import discord
 from discord.ext import commands
 from . import utils
-from .utils import checks, modding
+from .utils import checks, modding, counter, data_type
 from fuzzywuzzy import process
 
 #==================================================================================================================================================
 
+CACHE_SIZE = 512
+
+#==================================================================================================================================================
+
 class Tag(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.tag_list = bot.db.tag_list
+        self.tag_cache = data_type.LRUCache(CACHE_SIZE)
+        self.usage_counter = counter.UsageCounter(loop=bot.loop)
+
+    def cog_unload(self):
+        self.usage_counter.cleanup()
+
+    def invalidate_tag(self, guild, name):
+        self.tag_cache.pop_if(lambda k, v: k[0]==guild.id and (k[1]==name or v[1]["name"]==name))
 
     async def get_tag(self, name, guild, *, update=False):
-        if update:
-            tag = await self.tag_list.find_one_and_update({"guild_id": guild.id, "name": name}, {"$inc": {"uses": 1}})
+        key = (guild.id, name)
+        cached = self.tag_cache.get(key)
+        if cached:
+            alias_of, tag = cached
         else:
             tag = await self.tag_list.find_one({"guild_id": guild.id, "name": name})
-        if tag:
-            alias_of = tag.get("alias_of", None)
-            if alias_of:
-                if update:
-                    tag = await self.tag_list.find_one_and_update({"guild_id": guild.id, "name": alias_of}, {"$inc": {"uses": 1}})
-                else:
+            alias_of = None
+            if tag:
+                alias_of = tag.get("alias_of", None)
+                if alias_of:
                     tag = await self.tag_list.find_one({"guild_id": guild.id, "name": alias_of})
+            if tag:
+                self.tag_cache[key] = (alias_of, tag)
+        if tag and update:
+            if alias_of:
+                self.usage_counter.incr(self.tag_list, {"guild_id": guild.id, "name": name})
+            self.usage_counter.incr(self.tag_list, {"guild_id": guild.id, "name": tag["name"]})
         return tag
 
     @modding.help(brief="Get tag with given name", category="Tag & sticker", field="Commands", paragraph=0)
@@ -71,6 +89,7 @@ class Tag(commands.Cog):
         if before is None:
             await ctx.send(f"Cannot edit tag.\nEither tag doesn't exist, tag is an alias or you are not the creator of the tag.")
         else:
+            self.invalidate_tag(ctx.guild, before["name"])
             await ctx.send(f"Tag {name} edited.")
 
     @modding.help(brief="Add an alias to another tag", category="Tag & sticker", field="Commands", paragraph=0)
@@ -111,6 +130,8 @@ class Tag(commands.Cog):
         q.update({"guild_id": ctx.guild.id, "name": name})
         before = await self.tag_list.find_one_and_delete(q)
         if before:
+            self.invalidate_tag(ctx.guild, name)
+            self.usage_counter.discard(self.tag_list, {"guild_id": ctx.guild.id, "name": name})
             aliases = before.get("aliases")
             if aliases:
                 await self.tag_list.delete_many({"guild_id": ctx.guild.id, "name": {"$in": aliases}})
@@ -192,7 +213,7 @@ class Tag(commands.Cog):
             if original:
                 embed.add_field(name="Alias of", value=original)
             else:
-                embed.add_field(name="Uses", value=data.get("uses", 0))
+                embed.add_field(name="Uses", value=data.get("uses", 0)+self.usage_counter.get_pending(self.tag_list, {"guild_id": ctx.guild.id, "name": name}))
             await ctx.send(embed=embed)
         else:
             await ctx.send(f"Can't find tag with name {name}.")
@@ -0,0 +1,100 @@
+import asyncio
+import pymongo
+import traceback
+
+#==================================================================================================================================================
+
+FLUSH_TIME = 60
+MAX_PENDING = 1000
+
+#==================================================================================================================================================
+
+class UsageCounter:
+    def __init__(self, *, flush_time=FLUSH_TIME, max_pending=MAX_PENDING, loop=None):
+        self.flush_time = flush_time
+        self.max_pending = max_pending
+        self.loop = loop or asyncio.get_event_loop()
+        self.collections = {}
+        self.pending = {}
+        self.pending_count = 0
+        self.full = asyncio.Event()
+        self.flushed_ops = 0
+        self.flushed_writes = 0
+        self.working_task = self.loop.create_task(self.flush_regularly())
+
+    @staticmethod
+    def _key(query):
+        return tuple(sorted(query.items()))
+
+    def incr(self, collection, query, field="uses", amount=1):
+        name = collection.name
+        self.collections[name] = collection
+        fields = self.pending.setdefault(name, {}).setdefault(self._key(query), {})
+        fields[field] = fields.get(field, 0) + amount
+        self.pending_count += 1
+        if self.pending_count >= self.max_pending:
+            self.full.set()
+
+    def get_pending(self, collection, query, field="uses"):
+        return self.pending.get(collection.name, {}).get(self._key(query), {}).get(field, 0)
+
+    def discard(self, collection, query):
+        self.pending.get(collection.name, {}).pop(self._key(query), None)
+
+    def restore(self, name, items, count):
+        current = self.pending.setdefault(name, {})
+        for key, fields in items.items():
+            current_fields = current.setdefault(key, {})
+            for field, amount in fields.items():
+                current_fields[field] = current_fields.get(field, 0) + amount
+        self.pending_count += count
+
+    async def flush(self):
+        pending = self.pending
+        self.pending = {}
+        pending_count = self.pending_count
+        self.pending_count = 0
+        self.full.clear()
+        failed = None
+        for name, items in pending.items():
+            if items:
+                reqs = [pymongo.UpdateOne(dict(key), {"$inc": fields}) for key, fields in items.items()]
+                try:
+                    await self.collections[name].bulk_write(reqs, ordered=False)
+                except pymongo.errors.BulkWriteError as err:
+                    #unordered bulk write, only put back the updates that did not go through
+                    failed_indexes = {e["index"] for e in err.details.get("writeErrors", [])}
+                    keys = list(items)
+                    failed_items = {keys[i]: items[keys[i]] for i in failed_indexes}
+                    count = sum(sum(fields.values()) for fields in failed_items.values())
+                    self.restore(name, failed_items, count)
+                    self.flushed_writes += len(reqs) - len(failed_items)
+                    pending_count -= count
+                    failed = err
+                except pymongo.errors.PyMongoError as err:
+                    count = sum(sum(fields.values()) for fields in items.values())
+                    self.restore(name, items, count)
+                    pending_count -= count
+                    failed = err
+                else:
+                    self.flushed_writes += len(reqs)
+        self.flushed_ops += max(pending_count, 0)
+        if failed:
+            raise failed
+
+    async def flush_regularly(self):
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.flush_time)
+                except asyncio.TimeoutError:
+                    pass
+                try:
+                    await asyncio.shield(self.flush())
+                except pymongo.errors.PyMongoError:
+                    traceback.print_exc()
+        except asyncio.CancelledError:
+            await self.flush()
+
+    def cleanup(self):
+        self.working_task.cancel()
@@ -8,6 +8,7 @@ import collections
 from datetime import datetime, timedelta
 import pytz
 import itertools
+import bisect
 
 #==================================================================================================================================================
 
@@ -53,6 +54,105 @@ class BaseObject:
 
 #==================================================================================================================================================
 
+class SearchIndex:
+    def __init__(self, collection, *, atts, fields=[], sort={}):
+        self.collection = collection
+        self.atts = atts
+        self.sort = sort
+        self.projection = {"_id": True}
+        for key in itertools.chain(atts, fields, sort):
+            self.projection[key] = True
+        self.documents = {}
+        self.rank = {}
+        self.postings = {}
+        self.vocab = []
+        self.vocab_text = ""
+        self.offsets = []
+        self.ready = asyncio.Event()
+        self.build_lock = asyncio.Lock()
+
+    @staticmethod
+    def _sort_key(value):
+        if value is None:
+            return (0,)
+        else:
+            return (1, value)
+
+    def _build_rank(self, ids):
+        ids = list(ids)
+        for key, value in reversed(tuple(self.sort.items())):
+            documents = self.documents
+            if isinstance(value, int):
+                ids.sort(key=lambda i: self._sort_key(documents[i].get(key)), reverse=value<0)
+            elif isinstance(value, (list, tuple)):
+                order = {v: i for i, v in enumerate(value)}
+                ids.sort(key=lambda i: order.get(documents[i].get(key), -1))
+        return {item_id: i for i, item_id in enumerate(ids)}
+
+    async def build(self):
+        async with self.build_lock:
+            await self._build()
+
+    async def _build(self):
+        documents = {}
+        postings = {}
+        async for item_data in self.collection.find({}, projection=self.projection):
+            item_id = item_data["_id"]
+            documents[item_id] = item_data
+            text = " ".join(str(item_data.get(att) or "") for att in self.atts)
+            for token in text.lower().split():
+                postings.setdefault(token, set()).add(item_id)
+        self.documents = documents
+        self.postings = postings
+        self.rank = self._build_rank(documents)
+        self.vocab = sorted(postings)
+        self.offsets = []
+        offset = 0
+        for token in self.vocab:
+            self.offsets.append(offset)
+            offset += len(token) + 1
+        self.vocab_text = "\n".join(self.vocab)
+        self.ready.set()
+
+    def lookup(self, word):
+        #substring match on the joined vocabulary, each token is picked up at most once
+        vocab_text = self.vocab_text
+        offsets = self.offsets
+        vocab = self.vocab
+        postings = self.postings
+        result = set()
+        pos = vocab_text.find(word)
+        while pos >= 0:
+            i = bisect.bisect_right(offsets, pos) - 1
+            result.update(postings[vocab[i]])
+            if i + 1 >= len(offsets):
+                break
+            pos = vocab_text.find(word, offsets[i+1])
+        return result
+
+    async def search(self, name):
+        if not self.ready.is_set():
+            #startup build is still running or has failed, wait for it and retry if needed
+            async with self.build_lock:
+                if not self.ready.is_set():
+                    await self._build()
+        words = name.lower().split()
+        if not words:
+            return []
+        result = None
+        for word in sorted(words, key=len, reverse=True):
+            ids = self.lookup(word)
+            result = ids if result is None else result & ids
+            if not result:
+                return []
+        rank = self.rank
+        return [self.documents[item_id] for item_id in sorted(result, key=rank.__getitem__)]
+
+    async def fetch(self, item_data):
+        return await self.collection.find_one({"_id": item_data["_id"]})
+
+#==================================================================================================================================================
+
 class BelphegorContext(commands.Context):
     async def confirm(self):
         await self.message.add_reaction("\u2705")
@@ -68,9 +168,9 @@ class BelphegorContext(commands.Context):
         for r in possible_reactions:
             _loop.create_task(message.add_reaction(r))
         try:
-            reaction, user = await self.bot.wait_for(
-                "reaction_add",
-                check=lambda r,u: u.id==target.id and r.emoji in possible_reactions and r.message.id==message.id,
+            reaction, user = await self.bot.event_router.wait_for_reaction(
+                message,
+                check=lambda r,u: u.id==target.id and r.emoji in possible_reactions,
                 timeout=timeout
             )
         except:
@@ -93,6 +193,12 @@ class BelphegorContext(commands.Context):
         return result
 
     async def search(self, name, pool, *, cls=BaseObject, colour=None, atts=[], index_att=None, name_att, emoji_att=None, prompt=None, sort={}):
+        if isinstance(pool, SearchIndex):
+            index = pool
+            pool = index.collection
+            atts = index.atts
+        else:
+            index = None
         if index_att:
             try:
                 item_id = int(name)
@@ -104,6 +210,46 @@ class BelphegorContext(commands.Context):
                     return cls(result)
                 else:
                     raise checks.CustomError(f"Can't find {name} in database.")
+        if index:
+            items = await index.search(name)
+        else:
+            items = await self._aggregate_search(name, pool, atts=atts, sort=sort)
+        if prompt is False:
+            lower_name = name.lower()
+            for item_data in items:
+                if lower_name in ((item_data.get(att) or "").lower() for att in atts):
+                    break
+            try:
+                return cls(await index.fetch(item_data) if index else item_data)
+            except:
+                raise checks.CustomError(f"Can't find {name} in database.")
+        else:
+            result = [cls(item_data) for item_data in items]
+            if not result:
+                raise checks.CustomError(f"Can't find {name} in database.")
+            elif len(result) == 1 and not prompt:
+                chosen = items[0]
+            else:
+                emojis = self.cog.emojis
+
+                paging = paginator.Paginator(
+                    result, 10,
+                    title="Do you mean:",
+                    description=lambda i, x: f"`{i+1}:` {emojis.get(getattr(x, emoji_att), '') if emoji_att else ''}{getattr(x, name_att)}",
+                    colour=colour
+                )
+                t = self.bot.loop.create_task(paging.navigate(self))
+                choice = await self.wait_for_choice(max=len(result))
+                t.cancel()
+                if choice is None:
+                    return None
+                chosen = items[choice-1]
+            if index:
+                return cls(await index.fetch(chosen))
+            else:
+                return cls(chosen)
+
+    async def _aggregate_search(self, name, pool, *, atts, sort):
         pipeline = [
             {
                 "$addFields": {
@@ -138,42 +284,12 @@ class BelphegorContext(commands.Context):
             if add_fields:
                 pipeline.append({"$addFields": add_fields})
             pipeline.append({"$sort": sort_order})
-        cursor = pool.aggregate(pipeline)
-        if prompt is False:
-            lower_name = name.lower()
-            async for item_data in cursor:
-                if lower_name in (item_data.get(att, "").lower() for att in atts):
-                    break
-            try:
-                return cls(item_data)
-            except:
-                raise checks.CustomError(f"Can't find {name} in database.")
-        else:
-            result = [cls(item_data) async for item_data in cursor]
-            if not result:
-                raise checks.CustomError(f"Can't find {name} in database.")
-            elif len(result) == 1 and not prompt:
-                return result[0]
-            emojis = self.cog.emojis
-
-            paging = paginator.Paginator(
-                result, 10,
-                title="Do you mean:",
-                description=lambda i, x: f"`{i+1}:` {emojis.get(getattr(x, emoji_att), '') if emoji_att else ''}{getattr(x, name_att)}",
-                colour=colour
-            )
-            t = self.bot.loop.create_task(paging.navigate(self))
-            index = await self.wait_for_choice(max=len(result))
-            t.cancel()
-            if index is None:
-                return None
-            else:
-                return result[index-1]
+        return [item_data async for item_data in pool.aggregate(pipeline)]
 
     async def wait_for_choice(self, *, max, target=None, timeout=600):
         target = target or self.author
         try:
-            msg = await self.bot.wait_for("message", check=lambda m: m.author.id==target.id and m.channel.id==self.channel.id, timeout=timeout)
+            msg = await self.bot.event_router.wait_for_message(self.channel, target, timeout=timeout)
         except asyncio.TimeoutError:
             return None
         try:
@@ -299,3 +415,126 @@ class AutoCleanupDict:
 
     async def on_pop_item(self, key, value):
         pass
+
+#==================================================================================================================================================
+
+class EventRouter:
+    REACTION_EVENTS = ("reaction_add", "reaction_remove", "reaction_add_or_remove")
+
+    def __init__(self, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.waiters = {}
+        self.dispatched = 0
+        self.resolved = 0
+
+    def get_key(self, event, args):
+        if event in self.REACTION_EVENTS:
+            return (event, args[0].message.id)
+        elif event == "message":
+            message = args[0]
+            return (event, message.channel.id, message.author.id)
+        else:
+            return None
+
+    def dispatch(self, event, *args):
+        if not self.waiters:
+            return
+        key = self.get_key(event, args)
+        waiters = self.waiters.get(key)
+        if not waiters:
+            return
+        self.dispatched += 1
+        for item in tuple(waiters):
+            future, check = item
+            if future.done():
+                waiters.remove(item)
+                continue
+            try:
+                result = check(*args) if check else True
+            except Exception as e:
+                future.set_exception(e)
+                waiters.remove(item)
+            else:
+                if result:
+                    future.set_result(args[0] if len(args) == 1 else args)
+                    waiters.remove(item)
+                    self.resolved += 1
+        if not waiters:
+            self.waiters.pop(key, None)
+
+    async def wait_for(self, key, *, check=None, timeout=None):
+        future = self.loop.create_future()
+        item = (future, check)
+        self.waiters.setdefault(key, []).append(item)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            waiters = self.waiters.get(key)
+            if waiters:
+                try:
+                    waiters.remove(item)
+                except ValueError:
+                    pass
+                if not waiters:
+                    self.waiters.pop(key, None)
+
+    def wait_for_reaction(self, message, *, event="reaction_add", check=None, timeout=None):
+        return self.wait_for((event, message.id), check=check, timeout=timeout)
+
+    def wait_for_message(self, channel, author, *, check=None, timeout=None):
+        return self.wait_for(("message", channel.id, author.id), check=check, timeout=timeout)
+
+    def stats(self):
+        counter = collections.Counter()
+        for key, waiters in self.waiters.items():
+            counter[key[0]] += len(waiters)
+        return counter
+
+    @property
+    def live_waiters(self):
+        return sum(len(waiters) for waiters in self.waiters.values())
+
+#==================================================================================================================================================
+
+class LRUCache:
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.container = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        try:
+            value = self.container[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        else:
+            self.hits += 1
+            self.container.move_to_end(key)
+            return value
+
+    def peek(self, key, default=None):
+        return self.container.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.container[key] = value
+        self.container.move_to_end(key)
+        while len(self.container) > self.maxsize:
+            self.container.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self.container
+
+    def __len__(self):
+        return len(self.container)
+
+    def pop(self, key, default=None):
+        return self.container.pop(key, default)
+
+    def pop_if(self, predicate):
+        for key in [k for k, v in self.container.items() if predicate(k, v)]:
+            self.container.pop(key, None)
+
+    def clear(self):
+        self.container.clear()
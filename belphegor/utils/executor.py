@@ -0,0 +1,101 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import checks
+
+#==================================================================================================================================================
+
+EXECUTOR_SIZES = {
+    "cpu": (2, 8),
+    "image": (2, 8),
+    "io": (8, 32)
+}
+
+#==================================================================================================================================================
+
+class BoundedExecutor(ThreadPoolExecutor):
+    def __init__(self, name, max_workers, *, max_queue):
+        super().__init__(max_workers, thread_name_prefix=f"belphegor-{name}")
+        self.name = name
+        self.size = max_workers
+        self.max_queue = max_queue
+        self.stats_lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.total_wait = 0
+        self.total_run = 0
+        self.max_wait = 0
+        self.peak_queue = 0
+
+    @property
+    def queue_depth(self):
+        return self.pending - self.running
+
+    def submit(self, fn, *args, **kwargs):
+        with self.stats_lock:
+            if self.pending >= self.size + self.max_queue:
+                self.rejected += 1
+                raise checks.CustomError(f"I'm busy with too many {self.name} jobs right now. Please try again in a bit.")
+            self.pending += 1
+            self.submitted += 1
+            self.peak_queue = max(self.peak_queue, self.queue_depth)
+        queued = time.perf_counter()
+
+        def job():
+            start = time.perf_counter()
+            wait = start - queued
+            with self.stats_lock:
+                self.running += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self.stats_lock:
+                    self.running -= 1
+                    self.total_run += time.perf_counter() - start
+
+        def done(future):
+            #also fires when a queued future is cancelled and job never runs
+            with self.stats_lock:
+                self.pending -= 1
+                if future.cancelled():
+                    self.cancelled += 1
+                elif future.exception() is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+        try:
+            future = super().submit(job)
+        except:
+            with self.stats_lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(done)
+        return future
+
+    def stats(self):
+        with self.stats_lock:
+            done = self.completed + self.failed
+            return {
+                "size": self.size,
+                "running": self.running,
+                "queued": self.queue_depth,
+                "peak_queue": self.peak_queue,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "avg_wait": self.total_wait / done if done else 0,
+                "max_wait": self.max_wait,
+                "avg_run": self.total_run / done if done else 0
+            }
+
+def create_executors(sizes=EXECUTOR_SIZES):
+    return {name: BoundedExecutor(name, max_workers, max_queue=max_queue) for name, (max_workers, max_queue) in sizes.items()}
@@ -1,6 +1,7 @@
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
-from . import config, data_type
+from . import config, data_type, checks
+import numpy as np
 import asyncio
 import math
 import random
@@ -10,13 +11,57 @@ import itertools
 #==================================================================================================================================================
 
 EPSILON = 0.01
+MAX_IMAGE_PIXELS = 6000 * 6000
+MAX_INGEST_SIDE = 1024
+REDUCING_GAP = 3.0
+AA_MAX_PIXELS = 32 * 1024 * 1024
+MAX_AA = 4
+MIN_AA = 2
+AA_REDUCING_GAP = 2.0
+
+#==================================================================================================================================================
+
+def ingest_image(bytes_, *, size=None, max_side=MAX_INGEST_SIDE, mode=None, as_array=False):
+    try:
+        image = Image.open(BytesIO(bytes_))
+    except (OSError, Image.DecompressionBombError):
+        raise checks.CustomError("Cannot identify image.")
+
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise checks.CustomError("Image is too large.")
+    if size:
+        target = tuple(size)
+    elif max_side and max(width, height) > max_side:
+        ratio = max_side / max(width, height)
+        target = (max(1, round(width*ratio)), max(1, round(height*ratio)))
+    else:
+        target = None
+
+    if target and image.format == "JPEG":
+        image.draft(mode if mode in ("L", "RGB") else None, target)
+    try:
+        image.load()
+    except (OSError, SyntaxError, Image.DecompressionBombError):
+        raise checks.CustomError("Cannot identify image.")
+
+    if image.mode in ("P", "1", "I", "F"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+    if target and image.size != target:
+        image = image.resize(target, resample=Image.BICUBIC, reducing_gap=REDUCING_GAP)
+    if mode and image.mode != mode:
+        image = image.convert(mode)
+    if as_array:
+        return np.array(image)
+    else:
+        return image
 
 #==================================================================================================================================================
 
 class AAImageProcessing:
-    def __init__(self, pred, *, background=(255, 255, 255, 0), aa=4):
+    def __init__(self, pred, *, background=(255, 255, 255, 0), aa=None):
         if isinstance(pred, (tuple, list)):
-            self.aa = aa
+            self.aa = aa or adaptive_aa(pred)
             self.original_size = pred
             self.size = tuple(self.aa*i for i in pred)
             if isinstance(background, tuple):
@@ -51,7 +96,13 @@ class AAImageProcessing:
         self.fonts[name] = ImageFont.truetype(*args, size*self.aa, **kwargs)
 
     def save(self, fp, *, format, scale=1, **params):
-        im = self.image.resize((int(self.original_size[0]*scale), int(self.original_size[1]*scale)), resample=Image.LANCZOS)
+        size = (int(self.original_size[0]*scale), int(self.original_size[1]*scale))
+        im = self.image
+        if im.mode == "RGBA":
+            #resize premultiplies RGBA on its own but then ignores reducing_gap, so premultiply here instead
+            im = im.convert("RGBa").resize(size, resample=Image.LANCZOS, reducing_gap=AA_REDUCING_GAP).convert("RGBA")
+        else:
+            im = im.resize(size, resample=Image.LANCZOS, reducing_gap=AA_REDUCING_GAP)
         im.save(fp, format=format, **params)
 
     def text_size(self, text, *, font, **kwargs):
@@ -67,38 +118,48 @@ class AAImageProcessing:
         else:
             half_aawidth = aa * width / 2
             border = (math.ceil(aaxy[0]-half_aawidth), math.ceil(aaxy[1]-half_aawidth), math.floor(aaxy[0]+half_aawidth), math.floor(aaxy[1]+half_aawidth))
-            figure = Image.new("RGBA", self.size, (0, 0, 0, 0))
-            fig_draw = ImageDraw.Draw(figure)
-            fig_draw.ellipse(border, fill=fill)
+            if data_type.get_element(fill, 3, default=255) == 255:
+                self.draw.ellipse(border, fill=fill)
+            else:
+                draw_size = (border[2]-border[0]+1, border[3]-border[1]+1)
+                figure = Image.new("RGBA", draw_size, (0, 0, 0, 0))
+                fig_draw = ImageDraw.Draw(figure)
+                fig_draw.ellipse((0, 0, draw_size[0]-1, draw_size[1]-1), fill=fill)
 
-            self.image.paste(figure, (0, 0), figure)
+                self.image.paste(figure, border[:2], figure)
 
     def draw_line(self, xy, *, fill, width=1):
         aa = self.aa
         aaxy = tuple(aa*i for i in xy)
         aawidth = aa * width
-        draw_border = get_border(aaxy, aa*2)
-        draw_size = (draw_border[2]-draw_border[0], draw_border[3]-draw_border[1])
-
-        figure = Image.new("RGBA", draw_size, (0, 0, 0, 0))
-        mask = Image.new("L", draw_size, 0)
-        draw = (
-            (ImageDraw.Draw(figure), adjust_alpha(fill, 255)),
-            (ImageDraw.Draw(mask), data_type.get_element(fill, 3, default=255))
-        )
+        alpha = data_type.get_element(fill, 3, default=255)
+        if alpha == 255:
+            draw_border = (0, 0)
+            dr = self.draw
+            f = fill
+        else:
+            #translucent, draw coverage on a bounded mask and blend the colour through it
+            draw_border = get_border(aaxy, aa*2)
+            draw_size = (draw_border[2]-draw_border[0], draw_border[3]-draw_border[1])
+            mask = Image.new("L", draw_size, 0)
+            dr = ImageDraw.Draw(mask)
+            f = alpha
 
         draw_aaxy = tuple(item-draw_border[i%2] for i, item in enumerate(aaxy))
-        for value in draw:
-            dr = value[0]
-            f = value[1]
-            dr.line(draw_aaxy, fill=f, width=aawidth)
-            if width > 1:
-                half_aawidth = aawidth / 2
-                for aax, aay in pairwise(draw_aaxy):
-                    border = (math.ceil(aax-half_aawidth), math.ceil(aay-half_aawidth), math.floor(aax+half_aawidth), math.floor(aay+half_aawidth))
-                    dr.ellipse(border, fill=f)
+        dr.line(draw_aaxy, fill=f, width=aawidth)
+        if width > 1:
+            half_aawidth = aawidth / 2
+            for aax, aay in pairwise(draw_aaxy):
+                border = (math.ceil(aax-half_aawidth), math.ceil(aay-half_aawidth), math.floor(aax+half_aawidth), math.floor(aay+half_aawidth))
+                dr.ellipse(border, fill=f)
 
-        self.image.paste(figure, draw_border, mask)
+        if alpha != 255:
+            self.paste_color(adjust_alpha(fill, 255), draw_border, mask)
+
+    def paste_color(self, color, border, mask):
+        #paste a solid layer, pasting a bare colour through a mask blends alpha differently
+        figure = Image.new("RGBA", mask.size, color)
+        self.image.paste(figure, border, mask)
 
     def draw_arc(self, xy, start, end, *, fill, width=1):
         aa = self.aa
@@ -153,8 +214,16 @@ class AAImageProcessing:
             outer_border = (int(aaxy[0]-half_aawidth), int(aaxy[1]-half_aawidth), int(aaxy[2]+half_aawidth), int(aaxy[3]+half_aawidth))
             inner_border = (int(aaxy[0]+half_aawidth), int(aaxy[1]+half_aawidth), int(aaxy[2]-half_aawidth), int(aaxy[3]-half_aawidth))
 
-            figure = Image.new("RGBA", self.size, (0, 0, 0, 0))
-            mask = Image.new("L", self.size, 0)
+            draw_border = expand_border(outer_border, aa)
+            draw_size = (draw_border[2]-draw_border[0], draw_border[3]-draw_border[1])
+            center = (center[0]-draw_border[0], center[1]-draw_border[1])
+            int_center, arc_start, arc_end, outer_border, inner_border = (
+                tuple(item-draw_border[i%2] for i, item in enumerate(value))
+                for value in (int_center, arc_start, arc_end, outer_border, inner_border)
+            )
+
+            figure = Image.new("RGBA", draw_size, (0, 0, 0, 0))
+            mask = Image.new("L", draw_size, 0)
             draw = (
                 (ImageDraw.Draw(figure), adjust_alpha(outline, 255), adjust_alpha(fill, 255)),
                 (ImageDraw.Draw(mask), data_type.get_element(outline, 3, default=255), data_type.get_element(fill, 3, default=255))
@@ -198,7 +267,7 @@ class AAImageProcessing:
                         fill=o
                     )
 
-            self.image.paste(figure, (0, 0), mask)
+            self.image.paste(figure, draw_border[:2], mask)
 
     def draw_pie_chart(self, xy, cutlist, *, explode=None, outline=None, outline_width=0):
         aa = self.aa
@@ -213,8 +282,16 @@ class AAImageProcessing:
             inner_border = (int(aaxy[0]+half_aawidth), int(aaxy[1]+half_aawidth), int(aaxy[2]-half_aawidth), int(aaxy[3]-half_aawidth))
 
             if not explode:
-                figure = Image.new("RGBA", self.size, (0, 0, 0, 0))
-                mask = Image.new("L", self.size, 0)
+                draw_border = expand_border(outer_border, aa)
+                draw_size = (draw_border[2]-draw_border[0], draw_border[3]-draw_border[1])
+                center = (center[0]-draw_border[0], center[1]-draw_border[1])
+                int_center, outer_border, inner_border = (
+                    tuple(item-draw_border[i%2] for i, item in enumerate(value))
+                    for value in (int_center, outer_border, inner_border)
+                )
+
+                figure = Image.new("RGBA", draw_size, (0, 0, 0, 0))
+                mask = Image.new("L", draw_size, 0)
                 draw = (
                     (ImageDraw.Draw(figure), adjust_alpha(outline, 255), lambda f: adjust_alpha(f, 255)),
                     (ImageDraw.Draw(mask), data_type.get_element(outline, 3, default=255), lambda f: data_type.get_element(f, 3, default=255))
@@ -270,7 +347,7 @@ class AAImageProcessing:
                                 fill=o
                             )
 
-                self.image.paste(figure, (0, 0), mask)
+                self.image.paste(figure, draw_border[:2], mask)
             else:
                 ccl = cutlist.copy()
                 last_angle = ccl.pop(0)[0]
@@ -356,6 +433,19 @@ class AAImageProcessing:
     def draw_polygon(self, xy, *, fill, outline=None, outline_width=0):
         aa = self.aa
         aaxy = tuple(aa*i for i in xy)
+        if not outline or outline_width <= 0:
+            alpha = data_type.get_element(fill, 3, default=255)
+            if alpha == 255:
+                self.draw.polygon(aaxy, fill=fill)
+            else:
+                draw_border = get_border(aaxy, aa*2)
+                draw_size = (draw_border[2]-draw_border[0], draw_border[3]-draw_border[1])
+                mask = Image.new("L", draw_size, 0)
+                draw_aaxy = tuple(item-draw_border[i%2] for i, item in enumerate(aaxy))
+                ImageDraw.Draw(mask).polygon(draw_aaxy, fill=alpha)
+                self.paste_color(adjust_alpha(fill, 255), draw_border, mask)
+            return
+
         aawidth = aa * outline_width
         draw_border = get_border(aaxy, aa*2)
         draw_size = (draw_border[2]-draw_border[0], draw_border[3]-draw_border[1])
@@ -397,6 +487,16 @@ def adjust_alpha(inp, alpha):
     if inp:
         return (inp[0], inp[1], inp[2], alpha)
 
+def adaptive_aa(size, *, max_pixels=AA_MAX_PIXELS, max_aa=MAX_AA, min_aa=MIN_AA):
+    #full quality unless the supersampled canvas would get unreasonably large
+    aa = max_aa
+    while aa > min_aa and aa * aa * size[0] * size[1] > max_pixels:
+        aa -= 1
+    return aa
+
+def expand_border(border, epsilon=1):
+    return (border[0]-epsilon, border[1]-epsilon, border[2]+epsilon+1, border[3]+epsilon+1)
+
 def pairwise(iterable):
     i = iter(iterable)
     while True:
@@ -423,7 +523,7 @@ def get_border(xy, epsilon=1):
 
 async def pie_chart(
     data, *, title=None, unit="counts", background=(255, 255, 255, 0), text_color=(255, 255, 255, 255),
-    outline=None, scale=1, aa=4, explode=None, outline_width=4, loop=None
+    outline=None, scale=1, aa=None, explode=None, outline_width=4, loop=None, executor=None
 ):
     def drawing():
         number_of_fields = len(data)
@@ -487,11 +587,11 @@ async def pie_chart(
         return bytes_io
 
     _loop = loop or asyncio.get_event_loop()
-    return await _loop.run_in_executor(None, drawing)
+    return await _loop.run_in_executor(executor, drawing)
 
 async def line_chart(
     data, *, title=None, unit_y="amount", unit_x="time", background=(255, 255, 255, 0), text_color=(255, 255, 255, 255),
-    axis_color=(150, 150, 150, 255), axis_text_color=(215, 215, 215, 255), scale=1, aa=4, loop=None
+    axis_color=(150, 150, 150, 255), axis_text_color=(215, 215, 215, 255), scale=1, aa=None, loop=None, executor=None
 ):
     def drawing():
         number_of_fields = len(data)
@@ -553,11 +653,11 @@ async def line_chart(
         return bytes_io
 
     _loop = loop or asyncio.get_event_loop()
-    return await _loop.run_in_executor(None, drawing)
+    return await _loop.run_in_executor(executor, drawing)
 
 async def stacked_area_chart(
     data, *, title=None, unit_y="amount", unit_x="time", background=(255, 255, 255, 0), text_color=(255, 255, 255, 255),
-    axis_color=(200, 200, 200, 255), axis_text_color=(235, 235, 235, 255), scale=1, aa=4, loop=None
+    axis_color=(200, 200, 200, 255), axis_text_color=(235, 235, 235, 255), scale=1, aa=None, loop=None, executor=None
 ):
     def drawing():
         number_of_fields = len(data)
@@ -614,11 +714,11 @@ async def stacked_area_chart(
         return bytes_io
 
     _loop = loop or asyncio.get_event_loop()
-    return await _loop.run_in_executor(None, drawing)
+    return await _loop.run_in_executor(executor, drawing)
 
 async def bar_chart(
     data, *, title=None, unit_y="amount", unit_x="time", background=(255, 255, 255, 0), text_color=(255, 255, 255, 255),
-    axis_color=(200, 200, 200, 255), axis_text_color=(235, 235, 235, 255), scale=1, aa=4, loop=None
+    axis_color=(200, 200, 200, 255), axis_text_color=(235, 235, 235, 255), scale=1, aa=None, loop=None, executor=None
 ):
     def drawing():
         number_of_fields = len(data)
@@ -676,4 +776,4 @@ async def bar_chart(
         return bytes_io
 
     _loop = loop or asyncio.get_event_loop()
-    return await _loop.run_in_executor(None, drawing)
+    return await _loop.run_in_executor(executor, drawing)
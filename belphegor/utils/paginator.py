@@ -273,9 +273,10 @@ class Paginator:
         try:
             while True:
                 try:
-                    reaction, user = await _bot.wait_for(
-                        event,
-                        check=lambda r, u: target==u and r.emoji in self.navigation and r.message.id==message.id,
+                    reaction, user = await _bot.event_router.wait_for_reaction(
+                        message,
+                        event=event,
+                        check=lambda r, u: target==u and r.emoji in self.navigation,
                         timeout=timeout
                     )
                 except asyncio.TimeoutError:
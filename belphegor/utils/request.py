@@ -5,12 +5,215 @@ from . import config, checks
 import itertools
 import math
 import functools
+import collections
+import hashlib
+import json
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode, urlparse
 
 #==================================================================================================================================================
 
-_lock = asyncio.Lock()
 MAX_FILE_SIZE = 1024 * 1024 * 20
 TIMEOUT = 20
+CACHE_PATH = os.path.join(config.DATA_PATH, "http_cache")
+MEMORY_CACHE_SIZE = 1024 * 1024 * 64
+DISK_CACHE_SIZE = 1024 * 1024 * 512
+PER_HOST_DOWNLOADS = 4
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+#==================================================================================================================================================
+
+class RateLimiter:
+    def __init__(self, rate, per=1, *, loop=None):
+        self.rate = rate
+        self.per = per
+        self.loop = loop or asyncio.get_event_loop()
+        self.history = collections.deque()
+
+    async def acquire(self):
+        history = self.history
+        while True:
+            now = self.loop.time()
+            while history and history[0] <= now - self.per:
+                history.popleft()
+            if len(history) < self.rate:
+                history.append(now)
+                return
+            await asyncio.sleep(history[0] + self.per - now)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+#==================================================================================================================================================
+
+def _parse_cache_control(value):
+    directives = {}
+    for item in value.split(","):
+        key, _, arg = item.strip().partition("=")
+        if key:
+            directives[key.lower()] = arg.strip('"')
+    return directives
+
+def _get_expiry(headers, ttl=None):
+    now = time.time()
+    if ttl is not None:
+        return now + ttl
+    directives = _parse_cache_control(headers.get("Cache-Control", ""))
+    if "no-store" in directives:
+        return None
+    elif "no-cache" in directives:
+        return now
+    max_age = directives.get("max-age")
+    if max_age is not None:
+        try:
+            return now + int(max_age) - int(headers.get("Age", 0))
+        except ValueError:
+            return now
+    expires = headers.get("Expires")
+    if expires:
+        try:
+            return parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return now
+    return now
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "last_modified", "expires")
+
+    def __init__(self, body, *, etag=None, last_modified=None, expires=0):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class ResponseCache:
+    def __init__(self, *, max_size=MEMORY_CACHE_SIZE, path=CACHE_PATH, max_disk_size=DISK_CACHE_SIZE, loop=None):
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_size = max_disk_size
+        self.loop = loop or asyncio.get_event_loop()
+        self.container = collections.OrderedDict()
+        self.current_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.stores = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def make_key(url, params=None):
+        if params:
+            if isinstance(params, dict):
+                params = sorted(params.items())
+            return f"{url}?{urlencode(params)}"
+        else:
+            return str(url)
+
+    def _file_path(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def _read_disk(self, key):
+        try:
+            with open(self._file_path(key), "rb") as f:
+                meta, _, body = f.read().partition(b"\n")
+        except OSError:
+            return None
+        try:
+            meta = json.loads(meta)
+            if meta.get("key") != key:
+                return None
+            return CacheEntry(body, etag=meta["etag"], last_modified=meta["last_modified"], expires=meta["expires"])
+        except (ValueError, KeyError, AttributeError):
+            #truncated or corrupt file, drop it and treat as a miss
+            try:
+                os.remove(self._file_path(key))
+            except OSError:
+                pass
+            return None
+
+    def _write_disk(self, key, entry):
+        meta = json.dumps({"key": key, "etag": entry.etag, "last_modified": entry.last_modified, "expires": entry.expires})
+        file_path = self._file_path(key)
+        with open(f"{file_path}.tmp", "wb") as f:
+            f.write(meta.encode("utf-8"))
+            f.write(b"\n")
+            f.write(entry.body)
+        os.replace(f"{file_path}.tmp", file_path)
+
+    def _prune_disk(self):
+        files = []
+        total = 0
+        with os.scandir(self.path) as it:
+            for e in it:
+                stat = e.stat()
+                files.append((stat.st_mtime, stat.st_size, e.path))
+                total += stat.st_size
+        files.sort()
+        for mtime, size, file_path in files:
+            if total <= self.max_disk_size:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            total -= size
+
+    def _put_memory(self, key, entry):
+        old = self.container.pop(key, None)
+        if old:
+            self.current_size -= len(old.body)
+        if len(entry.body) > self.max_size:
+            return
+        self.container[key] = entry
+        self.current_size += len(entry.body)
+        while self.current_size > self.max_size:
+            k, e = self.container.popitem(last=False)
+            self.current_size -= len(e.body)
+
+    async def get(self, key):
+        entry = self.container.get(key)
+        if entry:
+            self.container.move_to_end(key)
+        elif self.path:
+            entry = await self.loop.run_in_executor(None, self._read_disk, key)
+            if entry:
+                self._put_memory(key, entry)
+        return entry
+
+    async def set(self, key, entry):
+        self._put_memory(key, entry)
+        self.stores += 1
+        if self.path:
+            await self.loop.run_in_executor(None, self._write_disk, key, entry)
+            if self.stores % 100 == 0:
+                await self.loop.run_in_executor(None, self._prune_disk)
+
+    def clear(self):
+        self.container.clear()
+        self.current_size = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses + self.revalidated
+        return (self.hits + self.revalidated) / total if total else 0
 
 #==================================================================================================================================================
 
@@ -26,9 +229,26 @@ def _error_handle(func):
     return new_func
 
 @_error_handle
-async def fetch(session, url, *, max_file_size=MAX_FILE_SIZE, timeout=TIMEOUT, **options):
+async def fetch(session, url, *, max_file_size=MAX_FILE_SIZE, timeout=TIMEOUT, cache=None, ttl=None, **options):
     headers = options.pop("headers", {"User-Agent": config.USER_AGENT})
+    if cache:
+        key = cache.make_key(url, options.get("params"))
+        entry = await cache.get(key)
+        if entry:
+            if entry.fresh:
+                cache.hits += 1
+                return entry.body
+            headers = {**headers, **entry.conditional_headers()}
+    else:
+        entry = None
     async with session.get(url, headers=headers, timeout=timeout, **options) as response:
+        if entry and response.status == 304:
+            cache.revalidated += 1
+            expires = _get_expiry(response.headers, ttl)
+            if expires is not None:
+                entry.expires = expires
+                await cache.set(key, entry)
+            return entry.body
         stream = response.content
         data = []
         current_size = 0
@@ -39,18 +259,183 @@ async def fetch(session, url, *, max_file_size=MAX_FILE_SIZE, timeout=TIMEOUT, *
             else:
                 data.append(chunk)
         if stream.at_eof():
-            return b"".join(data)
+            body = b"".join(data)
+            if cache:
+                cache.misses += 1
+                if response.status == 200:
+                    expires = _get_expiry(response.headers, ttl)
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+                    if expires is not None and (expires > time.time() or etag or last_modified):
+                        await cache.set(key, CacheEntry(body, etag=etag, last_modified=last_modified, expires=expires))
+            return body
         else:
             raise checks.CustomError(f"File size limit is {max_file_size/1024/1024:.1f}MB.")
 
+def _open_part(path, offset):
+    f = open(path, "ab" if offset else "wb")
+    f.truncate(offset)
+    return f
+
+def _finish_part(f, part_path, path):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.replace(part_path, path)
+    _remove_files(f"{part_path}.meta")
+
+def _remove_files(*paths):
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+def _read_part_meta(part_path, url):
+    #a partial file is only resumable if we know which version of the remote file it belongs to
+    try:
+        offset = os.path.getsize(part_path)
+        with open(f"{part_path}.meta", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return 0, None
+    if meta.get("url") != str(url) or not (meta.get("etag") or meta.get("last_modified")):
+        return 0, None
+    return offset, meta
+
+def _write_part_meta(part_path, meta):
+    with open(f"{part_path}.meta", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+def _content_range(value):
+    #"bytes start-end/total", total can be *
+    try:
+        unit, _, rest = value.partition(" ")
+        span, _, total = rest.partition("/")
+        start = int(span.partition("-")[0])
+        return start, (None if total == "*" else int(total))
+    except (AttributeError, ValueError):
+        return None, None
+
+async def _maybe_await(value):
+    if asyncio.iscoroutine(value):
+        await value
+
 @_error_handle
-async def download(session, url, path, *, timeout=TIMEOUT, **options):
-    async with _lock:
-        headers = options.pop("headers", {"User-Agent": config.USER_AGENT})
+async def download(session, url, path, *, timeout=TIMEOUT, max_file_size=None, progress=None, resume=True, loop=None, **options):
+    loop = loop or asyncio.get_event_loop()
+    base_headers = dict(options.pop("headers", {"User-Agent": config.USER_AGENT}))
+    part_path = f"{path}.part"
+    meta_path = f"{part_path}.meta"
+    if resume:
+        offset, meta = await loop.run_in_executor(None, _read_part_meta, part_path, url)
+    else:
+        offset, meta = 0, None
+
+    while True:
+        headers = dict(base_headers)
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            etag = meta.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["If-Range"] = etag
+            else:
+                headers["If-Range"] = meta["last_modified"]
+
         async with session.get(url, headers=headers, timeout=timeout, **options) as response:
-            with open(path, "wb") as f:
-                stream = response.content
-                async for chunk in stream.iter_chunked(config.CHUNK_SIZE):
-                    f.write(chunk)
-                else:
+            if offset and response.status == 416:
+                #only trust "already complete" if the partial file has exactly the recorded length
+                if meta.get("length") == offset:
+                    await loop.run_in_executor(None, os.replace, part_path, path)
+                    await loop.run_in_executor(None, _remove_files, meta_path)
                     return True
+                await loop.run_in_executor(None, _remove_files, part_path, meta_path)
+                offset, meta = 0, None
+                continue
+            elif offset and response.status == 206:
+                start, full_length = _content_range(response.headers.get("Content-Range"))
+                if start != offset or (full_length is not None and meta.get("length") not in (None, full_length)):
+                    await loop.run_in_executor(None, _remove_files, part_path, meta_path)
+                    offset, meta = 0, None
+                    continue
+            elif response.status == 200:
+                #fresh copy, either requested or the remote file changed and If-Range did not match
+                offset = 0
+                meta = {
+                    "url": str(url),
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "length": response.content_length
+                }
+                await loop.run_in_executor(None, _write_part_meta, part_path, meta)
+            else:
+                raise checks.CustomError(f"Cannot download file: {response.status} {response.reason}")
+
+            length = response.content_length
+            total = offset + length if length is not None else None
+            if max_file_size and total and total > max_file_size:
+                raise checks.CustomError(f"File size limit is {max_file_size/1024/1024:.1f}MB.")
+
+            f = await loop.run_in_executor(None, _open_part, part_path, offset)
+            try:
+                done = offset
+                buffer = bytearray()
+                async for chunk in response.content.iter_chunked(config.CHUNK_SIZE):
+                    done += len(chunk)
+                    if max_file_size and done > max_file_size:
+                        raise checks.CustomError(f"File size limit is {max_file_size/1024/1024:.1f}MB.")
+                    buffer.extend(chunk)
+                    if len(buffer) >= WRITE_BUFFER_SIZE:
+                        await loop.run_in_executor(None, f.write, bytes(buffer))
+                        buffer.clear()
+                        if progress:
+                            await _maybe_await(progress(done, total))
+                if buffer:
+                    await loop.run_in_executor(None, f.write, bytes(buffer))
+                await loop.run_in_executor(None, _finish_part, f, part_path, path)
+            except checks.CustomError:
+                f.close()
+                await loop.run_in_executor(None, _remove_files, part_path, meta_path)
+                raise
+            except BaseException:
+                f.close()
+                raise
+            if progress:
+                await _maybe_await(progress(done, total))
+            return True
+
+class DownloadManager:
+    def __init__(self, session, *, per_host=PER_HOST_DOWNLOADS, max_file_size=None, loop=None):
+        self.session = session
+        self.per_host = per_host
+        self.max_file_size = max_file_size
+        self.loop = loop or asyncio.get_event_loop()
+        self.host_locks = {}
+        self.active = collections.Counter()
+        self.completed = 0
+        self.failed = 0
+
+    def _get_lock(self, host):
+        lock = self.host_locks.get(host)
+        if lock is None:
+            lock = asyncio.Semaphore(self.per_host)
+            self.host_locks[host] = lock
+        return lock
+
+    async def download(self, url, path, **kwargs):
+        host = urlparse(str(url)).hostname
+        kwargs.setdefault("max_file_size", self.max_file_size)
+        async with self._get_lock(host):
+            self.active[host] += 1
+            try:
+                result = await download(self.session, url, path, loop=self.loop, **kwargs)
+            except:
+                self.failed += 1
+                raise
+            else:
+                self.completed += 1
+                return result
+            finally:
+                self.active[host] -= 1
+                if self.active[host] <= 0:
+                    del self.active[host]
@@ -25,10 +25,10 @@ class XmasSpecial(commands.Cog):
         else:
             return
         async with ctx.typing():
-            bytes_ = await self.bot.fetch(member.avatar_url_as(static_format="png"))
+            bytes_ = await self.bot.fetch(member.avatar_url_as(static_format="png"), cache=True)
 
             def image_process():
-                base_img = Image.open(BytesIO(bytes_))
+                base_img = utils.ingest_image(bytes_, mode="RGBA")
                 width, height = base_img.size
                 min_size = min(width, height)
                 hat = random.choice(HAT_IMAGE)
@@ -41,7 +41,7 @@ class XmasSpecial(commands.Cog):
                 pic_bytes.seek(0)
                 return pic_bytes
 
-            result = await self.bot.loop.run_in_executor(None, image_process)
+            result = await self.bot.loop.run_in_executor(self.bot.executors["image"], image_process)
             await ctx.send(file=discord.File(result, filename="santa_hat.png"))
 
 #==================================================================================================================================================
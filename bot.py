@@ -1,7 +1,7 @@
 import discord
 from discord.ext import commands
 from belphegor import utils
-from belphegor.utils import checks, config, data_type
+from belphegor.utils import checks, config, data_type, executor
 import asyncio
 import aiohttp
 import psutil
@@ -35,6 +35,14 @@ class Belphegor(commands.AutoShardedBot):
         self.initial_extensions = kwargs.get("initial_extensions", config.all_extensions)
         self.restart_flag = False
         self.saved_stuff = {}
+        self.event_router = data_type.EventRouter(loop=self.loop)
+        self.http_cache = utils.ResponseCache(loop=self.loop)
+        self.download_manager = utils.DownloadManager(self.session, loop=self.loop)
+        self.executors = executor.create_executors(kwargs.get("executor_sizes", executor.EXECUTOR_SIZES))
+
+    def dispatch(self, event_name, *args, **kwargs):
+        self.event_router.dispatch(event_name, *args)
+        super().dispatch(event_name, *args, **kwargs)
 
     async def get_prefix(self, message):
         prefixes = [f"<@{self.user.id}> ", f"<@!{self.user.id}> "]
@@ -94,7 +102,7 @@ class Belphegor(commands.AutoShardedBot):
         if callable(item):
             async with lock:
                 run_func = functools.partial(item, *args, **kwargs)
-                return await self.loop.run_in_executor(None, run_func)
+                return await self.loop.run_in_executor(self.executors["io"], run_func)
         else:
             raise TypeError("Wat. You serious?")
 
@@ -107,6 +115,8 @@ class Belphegor(commands.AutoShardedBot):
         await asyncio.sleep(3)
         if "google" in self.saved_stuff:
             self.saved_stuff["google"].terminate()
+        for pool in self.executors.values():
+            pool.shutdown(wait=False)
 
     def block_or_not(self, ctx):
         author_id = ctx.author.id
@@ -226,11 +236,13 @@ class Belphegor(commands.AutoShardedBot):
                 return await self.logout()
         print("Done")
 
-    async def fetch(self, url, **kwargs):
+    async def fetch(self, url, *, cache=False, **kwargs):
+        if cache:
+            kwargs["cache"] = self.http_cache
         return await utils.fetch(self.session, url, **kwargs)
 
     async def download(self, url, path, **kwargs):
-        return await utils.download(self.session, url, path, **kwargs)
+        return await self.download_manager.download(url, path, **kwargs)
 
     def do_after(self, coro, wait_time):
         async def things_to_do():